@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# admission.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Decides which requests the server works
+on when it is saturated: requests wait in a bounded RequestQueue,
+the most urgent first, and once the queue is full the server sheds
+requests (answers them with SERVER_BUSY_MESSAGE) instead of letting
+every request wait longer and longer.
+
+A class details request is what a user is waiting for after
+choosing a class, so it comes before a search, which comes before a
+prefetch of class details: a prefetch only saves a later wait, and
+the next search usually makes it obsolete, so it is the first to be
+shed. Of the requests of the same priority, the oldest is shed
+first: with search-as-you-type, a newer search of the same user
+usually makes it obsolete, and it is the one whose latency is
+already the worst.
+"""
+
+from heapq import heappush, heappop, heapify
+from itertools import count
+from queue import Empty
+from threading import Condition
+from protocol import GET_OVERVIEWS, GET_OVERVIEWS_PAGE,\
+    STREAM_OVERVIEWS, GET_DETAIL, GET_DETAILS, CACHE_STATS, METRICS
+
+#-----------------------------------------------------------------------
+
+# The default number of requests that may wait for a worker.
+MAX_PENDING = 32
+
+# Lower numbers are more urgent; unknown commands come last.
+_PRIORITIES = {GET_DETAIL: 0, CACHE_STATS: 0, METRICS: 0,
+    GET_OVERVIEWS: 1, GET_OVERVIEWS_PAGE: 1, STREAM_OVERVIEWS: 1,
+    GET_DETAILS: 2}
+_LOWEST_PRIORITY = 3
+
+#-----------------------------------------------------------------------
+
+def get_priority(command):
+    """
+    Returns the priority of the requests of command; lower numbers
+    are more urgent.
+
+    Keyword arguments:
+        command -- one of the commands in protocol.py
+    """
+    return _PRIORITIES.get(command, _LOWEST_PRIORITY)
+
+#-----------------------------------------------------------------------
+
+class RequestQueue:
+    """
+    A thread-safe queue of at most capacity requests that yields the
+    most urgent request first, and requests of the same priority in
+    the order they were put. Once it is closed, get returns None
+    when it is empty.
+    """
+
+    def __init__(self, capacity=MAX_PENDING):
+        if capacity < 1:
+            raise ValueError("a request queue needs room for a request")
+
+        self._capacity = capacity
+        self._condition = Condition()
+        self._closed = False
+        self._order = count()
+
+        # (priority, order, item) tuples
+        self._heap = []
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap)
+
+    def put(self, item, priority):
+        """
+        Adds item to the queue. If the queue is full, either item or
+        the oldest of the least urgent items in the queue, if that is
+        no more urgent than item, is shed instead. Returns the shed
+        item, or None if nothing was shed.
+
+        Keyword arguments:
+            item -- the request
+            priority -- the priority of the request (see
+                get_priority)
+        """
+        with self._condition:
+            shed = None
+
+            if len(self._heap) >= self._capacity:
+                victim = max(range(len(self._heap)),
+                    key=lambda index: (self._heap[index][0],
+                    -self._heap[index][1]))
+                if self._heap[victim][0] < priority:
+                    return item
+
+                shed = self._heap[victim][2]
+                self._heap[victim] = self._heap[-1]
+                self._heap.pop()
+                heapify(self._heap)
+
+            heappush(self._heap, (priority, next(self._order), item))
+            self._condition.notify()
+            return shed
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the most urgent item, waiting up to
+        timeout seconds (forever if timeout is None) for one. Raises
+        queue.Empty if the time runs out, and returns None if the
+        queue is closed and empty.
+
+        Keyword arguments:
+            timeout -- the number of seconds to wait, or None
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._heap or self._closed, timeout):
+                raise Empty
+
+            if not self._heap:
+                return None
+            return heappop(self._heap)[2]
+
+    def get_nowait(self):
+        """
+        Removes and returns the most urgent item, or returns None if
+        the queue is empty.
+        """
+        with self._condition:
+            if not self._heap:
+                return None
+            return heappop(self._heap)[2]
+
+    def close(self):
+        """
+        Tells the getters that no more items will be put; the items
+        already in the queue are still returned.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# asyncserver.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Serves client connections from a single
+asyncio event loop instead of a process per client, so that thousands
+of concurrent (mostly idle) sockets cost almost nothing. Reading
+requests and writing responses never blocks the loop; the database
+work for each request is run in a pool of executor processes. Both
+the original and the framed protocol (see protocol.py) are served,
+and the requests of a framed connection are worked on concurrently, and
+identical requests that arrive while one of them is being worked on
+share its execution and its encoded responses.
+"""
+
+import asyncio
+import signal
+from sys import stderr
+from time import monotonic
+from io import BytesIO
+from pickle import load, dumps, UnpicklingError
+from socket import SOMAXCONN
+from multiprocessing import get_context, get_all_start_methods
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from protocol import HEADER, MAGIC_SIZE, CANCEL, SERVER_BUSY_MESSAGE,\
+    is_framed, legacy_command, encode_frame, decode_frame_length
+from codec import MalformedRequestError, get_codec
+from admission import RequestQueue, MAX_PENDING, get_priority
+
+#-----------------------------------------------------------------------
+
+# Largest request (in bytes) that a client may send, and the number of
+# seconds it may take to send it, before its connection is dropped.
+MAX_REQUEST_SIZE = 64 * 1024
+REQUEST_TIMEOUT = 30.0
+
+# Seconds to wait for in-flight requests when the server shuts down.
+DRAIN_TIMEOUT = 10.0
+
+READ_SIZE = 4096
+
+# Number of requests that can be cancelled while an executor process
+# works on them; requests beyond that many in flight still run to
+# completion when cancelled, but are not answered.
+CANCEL_SLOTS = 1024
+
+# The cancellation flags shared by the event loop and the executor
+# processes, one per slot, and the Metrics of the server, or None
+# (set in every executor process).
+_cancel_flags = None
+_metrics = None
+
+#-----------------------------------------------------------------------
+
+def get_executor_context():
+    """
+    Returns the multiprocessing context of the executor processes.
+    Objects that they share with the event loop process (e.g. locks)
+    must be created with it.
+    """
+    # Executor processes must not be forked from the event loop
+    # process: they would inherit every client socket open at that
+    # moment and keep those connections from ever closing.
+    if 'forkserver' in get_all_start_methods():
+        return get_context('forkserver')
+    return get_context('spawn')
+
+#-----------------------------------------------------------------------
+
+def _init_executor_process(initializer, initargs, cancel_flags,
+    metrics):
+    global _cancel_flags, _metrics
+
+    # The event loop coordinates shutdown, so a Ctrl-C in the terminal
+    # must not kill an executor process mid-request.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    _cancel_flags = cancel_flags
+    _metrics = metrics
+
+    if initializer is not None:
+        initializer(*initargs)
+
+#-----------------------------------------------------------------------
+
+def _execute_and_encode(request_handler, command, data, handler_args,
+    codec, slot, read_time):
+    # Runs in an executor process. The responses are encoded there,
+    # so that the event loop only has to copy bytes to the socket.
+    # Returns the list of the shared responses (without a request
+    # id, see codec.py), or the bytes of the one response if codec
+    # is None, which stands for the original protocol. The request
+    # is cancelled once the flag of its slot (if it has one) is set.
+    # read_time is the monotonic() time at which the event loop read
+    # the request.
+    if _metrics is not None:
+        _metrics.observe(command,
+            [('dispatch', monotonic() - read_time)])
+
+    if slot is None:
+        cancelled = None
+    else:
+        cancelled = lambda: _cancel_flags[slot] != 0
+
+    responses = request_handler(command, data, *handler_args,
+        cancelled)
+
+    if codec is None:
+        successful, response = next(iter(responses))
+        start = monotonic()
+        shared = dumps(successful) + dumps(response)
+        encoding = monotonic() - start
+    else:
+        shared = []
+        encoding = 0.0
+        for successful, response in responses:
+            if cancelled is not None and cancelled():
+                break
+            start = monotonic()
+            shared.append(codec.encode_shared_response(command,
+                successful, response))
+            encoding += monotonic() - start
+
+    if _metrics is not None:
+        _metrics.observe(command, [('encode', encoding)])
+    return shared
+
+#-----------------------------------------------------------------------
+
+async def _read_legacy_request(reader, buffer):
+    # A request is two pickles (is_search, then the payload) without
+    # any framing, so keep reading until both can be unpickled.
+    while True:
+        chunk = await reader.read(READ_SIZE)
+        if not chunk:
+            raise EOFError("client closed the connection before "\
+                + "sending a complete request")
+
+        buffer += chunk
+        if len(buffer) > MAX_REQUEST_SIZE:
+            raise ValueError("request is larger than "\
+                + str(MAX_REQUEST_SIZE) + " bytes")
+
+        try:
+            read_flo = BytesIO(buffer)
+            request_type_is_search = load(read_flo)
+            data = load(read_flo)
+            return (legacy_command(request_type_is_search), data)
+        except (EOFError, UnpicklingError):
+            continue # truncated, wait for the rest
+
+#-----------------------------------------------------------------------
+
+class _Flight:
+    """
+    One execution of a request in an executor process, which the
+    identical requests (those with the same coalescing key) that
+    arrive before it finishes share. waiters is the number of its
+    requests that have not been cancelled; once there are none, the
+    execution is cancelled too.
+    """
+
+    def __init__(self, key, slot):
+        self.key = key
+        self.slot = slot
+        self.task = None
+        self.waiters = 1
+
+#-----------------------------------------------------------------------
+
+class AsyncServer:
+    """
+    Serves the registrar protocol on an already listening server
+    socket from an asyncio event loop. Each request is answered by
+    calling request_handler(command, data, *handler_args, cancelled)
+    in one of workers executor processes, where cancelled is a
+    function that tells whether the client has cancelled the
+    request (or None). request_handler must return an iterable of
+    (successful, response) tuples, which are sent in order (only
+    the first one to clients of the original protocol). The
+    responses of one request are computed together, so a streamed
+    response is only sent in chunks, not produced in them.
+
+    Persistent connections that stay idle for idle_timeout seconds
+    are closed. Clients that send pickles are refused unless
+    allow_pickle is set. If an initializer is given, every executor
+    process calls initializer(*initargs) once before it executes
+    any requests. If metrics is given, the spans of every request
+    and connection are recorded there (see metrics.py); it must be
+    created with get_executor_context().
+
+    At most max_running requests (by default, one per executor
+    process) are in the executor at once; the others wait in a
+    RequestQueue of max_pending requests shared by all connections,
+    which admits the most urgent request whenever one finishes and
+    sheds requests with SERVER_BUSY_MESSAGE once it is full.
+
+    If coalesce_key is given, coalesce_key(command, data) returns a
+    hashable key that identical requests share, or None for requests
+    that must always be executed on their own. A request whose key
+    (and codec) matches that of a request still in flight is not
+    executed again: it waits for the responses of that request,
+    which are encoded once and sent to every waiter with its own
+    request id.
+    """
+
+    def __init__(self, server_sock, workers, idle_timeout,
+        allow_pickle, request_handler, handler_args=(),
+        initializer=None, initargs=(), metrics=None, max_running=None,
+        max_pending=MAX_PENDING, coalesce_key=None):
+        self._server_sock = server_sock
+        self._workers = workers
+        self._idle_timeout = idle_timeout
+        self._allow_pickle = allow_pickle
+        self._request_handler = request_handler
+        self._handler_args = tuple(handler_args)
+        self._initializer = initializer
+        self._initargs = tuple(initargs)
+        self._metrics = metrics
+        self._max_running = max_running or workers
+        self._running = 0
+        self._pending = RequestQueue(max_pending)
+        self._executor = None
+
+        # the executor futures of the requests submitted and not yet
+        # finished
+        self._submitted = set()
+
+        self._stopping = None
+        self._connections = set()
+        self._cancel_flags = None
+        self._free_slots = list(range(CANCEL_SLOTS))
+        self._coalesce_key = coalesce_key
+
+        # (codec, coalescing key) -> _Flight of every request in
+        # flight that other requests may join
+        self._flights = {}
+
+    def run(self):
+        """
+        Runs the event loop until SIGTERM or Ctrl-C, then stops
+        accepting connections and drains the ones in flight.
+        """
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self._stopping.set)
+            except NotImplementedError:
+                pass # not on Windows; Ctrl-C still interrupts run()
+
+        self._cancel_flags = get_executor_context().Array('b',
+            CANCEL_SLOTS, lock=False)
+        self._executor = self._create_executor()
+
+        try:
+            server = await asyncio.start_server(
+                self._handle_connection, sock=self._server_sock,
+                backlog=SOMAXCONN)
+            print('Serving connections from an asyncio event loop '\
+                + 'with ' + str(self._workers) + ' executor processes')
+
+            await self._stopping.wait()
+
+            print('Draining connections')
+            server.close()
+            if self._connections:
+                _, pending = await asyncio.wait(set(self._connections),
+                    timeout=DRAIN_TIMEOUT)
+                for task in pending:
+                    task.cancel()
+            await server.wait_closed()
+        finally:
+            # requests that no executor process has started are
+            # dropped (shutdown's cancel_futures needs Python 3.9)
+            for future in self._submitted:
+                future.cancel()
+            self._executor.shutdown()
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(self._workers,
+            mp_context=get_executor_context(),
+            initializer=_init_executor_process,
+            initargs=(self._initializer, self._initargs,
+                self._cancel_flags, self._metrics))
+
+    def _observe(self, command, spans):
+        if self._metrics is not None:
+            self._metrics.observe(command, spans)
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+
+        address = writer.get_extra_info('peername')
+        print('Accepted connection, opened socket for ' + str(address))
+        accepted = monotonic()
+
+        try:
+            first = await asyncio.wait_for(reader.read(1),
+                REQUEST_TIMEOUT)
+
+            if is_framed(first):
+                magic = first + await asyncio.wait_for(
+                    reader.readexactly(MAGIC_SIZE - 1), REQUEST_TIMEOUT)
+                self._observe(None,
+                    [('accept', monotonic() - accepted)])
+                codec = get_codec(magic, self._allow_pickle)
+                await self._handle_framed_requests(reader, writer,
+                    codec)
+            elif not self._allow_pickle:
+                print('Refused client of the original protocol',
+                    file=stderr)
+            else:
+                self._observe(None,
+                    [('accept', monotonic() - accepted)])
+                command, data = await asyncio.wait_for(
+                    _read_legacy_request(reader, first),
+                    REQUEST_TIMEOUT)
+                read_time = monotonic()
+                flight = self._join_flight(command, data, None,
+                    read_time)
+                writer.write(await asyncio.shield(flight.task))
+                start = monotonic()
+                await writer.drain()
+                self._observe(command, [('send', monotonic() - start),
+                    ('total', monotonic() - read_time)])
+
+        except Exception as ex:
+            # one bad connection must not take the server down
+            print(ex, file=stderr)
+
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            print('Closed socket for ' + str(address))
+
+    async def _handle_framed_requests(self, reader, writer, codec):
+        requests = set()
+
+        # request id -> _Flight of the request, for every request in
+        # flight, and the ids of the requests the client has cancelled
+        flights = {}
+        cancelled = set()
+
+        async def answer(request_id, command, data, read_time):
+            flight = self._join_flight(command, data, codec, read_time)
+            flights[request_id] = flight
+
+            try:
+                # the flight goes on for its other requests if this
+                # connection is dropped
+                shared = await asyncio.shield(flight.task)
+            finally:
+                del flights[request_id]
+
+            if request_id in cancelled:
+                cancelled.discard(request_id)
+                return
+
+            start = monotonic()
+            for response in shared:
+                writer.write(encode_frame(codec.bind_response(response,
+                    request_id)))
+                await writer.drain()
+            self._observe(command, [('send', monotonic() - start),
+                ('total', monotonic() - read_time)])
+
+        try:
+            while True:
+                # the idle timeout only applies while nothing is being
+                # worked on for this connection; readexactly() keeps
+                # partial data buffered when it times out
+                try:
+                    header = await asyncio.wait_for(
+                        reader.readexactly(HEADER.size),
+                        self._idle_timeout)
+                except asyncio.TimeoutError:
+                    if requests:
+                        continue
+                    print('Closing idle connection')
+                    return
+                except asyncio.IncompleteReadError as ex:
+                    if ex.partial:
+                        raise
+                    return # closed between frames
+
+                body = await asyncio.wait_for(
+                    reader.readexactly(decode_frame_length(header)),
+                    REQUEST_TIMEOUT)
+                read_time = monotonic()
+                try:
+                    request_id, command, data = codec.decode_request(
+                        body)
+                except MalformedRequestError as ex:
+                    # answered under the id it was sent with, if any
+                    print(ex, file=stderr)
+                    writer.write(encode_frame(codec.encode_response(
+                        ex.request_id, ex.command, False, str(ex))))
+                    await writer.drain()
+                    continue
+                self._observe(command,
+                    [('decode', monotonic() - read_time)])
+
+                if command == CANCEL:
+                    # nothing more is sent for the request, and its
+                    # execution is cancelled unless other requests
+                    # share it
+                    if data in flights and data not in cancelled:
+                        print('Cancelled request')
+                        cancelled.add(data)
+                        self._leave_flight(flights[data])
+                    continue
+
+                answer_task = asyncio.create_task(answer(request_id,
+                    command, data, read_time))
+                requests.add(answer_task)
+                answer_task.add_done_callback(requests.discard)
+        finally:
+            # let the requests that were already read finish, since
+            # the client may only have closed its sending side
+            if requests:
+                await asyncio.wait(set(requests))
+
+    def _join_flight(self, command, data, codec, read_time):
+        # Returns the _Flight of an identical request in flight after
+        # adding a waiter to it, or else starts a new one.
+        key = None
+        if self._coalesce_key is not None:
+            key = self._coalesce_key(command, data)
+
+        if key is not None:
+            key = (codec, key)
+            flight = self._flights.get(key)
+            if flight is not None:
+                print('Coalesced request')
+                flight.waiters += 1
+                return flight
+
+        slot = self._free_slots.pop() if self._free_slots else None
+        flight = _Flight(key, slot)
+        flight.task = asyncio.create_task(self._run_flight(flight,
+            command, data, codec, read_time))
+        if key is not None:
+            self._flights[key] = flight
+        return flight
+
+    def _leave_flight(self, flight):
+        # Removes a cancelled waiter from flight; once none are left,
+        # the executor process stops working on the request as soon
+        # as it notices the flag of its slot.
+        flight.waiters -= 1
+        if flight.waiters > 0:
+            return
+
+        # later identical requests need an execution of their own
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        if flight.slot is not None:
+            self._cancel_flags[flight.slot] = 1
+
+    async def _run_flight(self, flight, command, data, codec,
+        read_time):
+        try:
+            return await self._execute(command, data, codec,
+                flight.slot, read_time)
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+            # the executor process is done with the slot
+            if flight.slot is not None:
+                self._cancel_flags[flight.slot] = 0
+                self._free_slots.append(flight.slot)
+
+    async def _execute(self, command, data, codec, slot, read_time):
+        if not await self._admit(command):
+            print('Server busy, shed request')
+            if codec is None:
+                return dumps(False) + dumps(SERVER_BUSY_MESSAGE)
+            return [codec.encode_shared_response(command, False,
+                SERVER_BUSY_MESSAGE)]
+
+        try:
+            executor = self._executor
+
+            try:
+                future = executor.submit(_execute_and_encode,
+                    self._request_handler, command, data,
+                    self._handler_args, codec, slot, read_time)
+                self._submitted.add(future)
+                try:
+                    return await asyncio.wrap_future(future)
+                finally:
+                    self._submitted.discard(future)
+
+            except BrokenProcessPool:
+                # an executor process died; replace the whole pool,
+                # since a broken ProcessPoolExecutor refuses all
+                # further work
+                if executor is self._executor:
+                    executor.shutdown(wait=False)
+                    self._executor = self._create_executor()
+                raise
+        finally:
+            self._release()
+
+    async def _admit(self, command):
+        # Waits until a request of command may run in the executor,
+        # and returns True then, or False if it was shed.
+        if self._running < self._max_running:
+            self._running += 1
+            return True
+
+        # a ticket is resolved with True when a finishing request
+        # hands its place over, or with False when it is shed
+        ticket = asyncio.get_running_loop().create_future()
+        shed = self._pending.put(ticket, get_priority(command))
+        if shed is not None and not shed.done():
+            shed.set_result(False)
+        return await ticket
+
+    def _release(self):
+        # Hands the place of a finished request over to the most
+        # urgent waiting one; tickets of requests whose connection
+        # is gone are skipped.
+        while True:
+            ticket = self._pending.get_nowait()
+            if ticket is None:
+                self._running -= 1
+                return
+            if not ticket.done():
+                ticket.set_result(True)
+                return
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# benchclasses.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Benchmarks the objects that hold query results (see regclass.py and
+regclassdetails.py) against the dictionary-backed classes they
+replaced: the time to build them from database rows, the memory they
+take and the size of their pickles, for the full unfiltered class
+list and for a batch of class details.
+"""
+
+import argparse
+import sys
+import pickle
+import tracemalloc
+from sys import argv, stderr
+from time import perf_counter
+from statistics import median
+from database import create_condition_and_prepared_values,\
+    get_classes_with_condition, get_classes_details, MAX_DETAILS_BATCH
+from regclass import RegClass
+from regclassdetails import RegClassDetails
+from search import Search
+
+#-----------------------------------------------------------------------
+
+class _DictRegClass:
+    # RegClass as it was: five attributes in a per-object dictionary,
+    # built from a list of str() of each column
+    def __init__(self, class_details):
+        self._class_id = class_details[0]
+        self._dept = class_details[1]
+        self._course_num = class_details[2]
+        self._area = class_details[3]
+        self._title = class_details[4]
+
+#-----------------------------------------------------------------------
+
+class _DictRegClassDetails:
+    # RegClassDetails as it was, without slots
+    def __init__(self, class_details, cl_details,
+        course_details, prof_details):
+        self._class_details = class_details
+        self._cl_details = cl_details
+        self._course_details = course_details
+        self._prof_details = prof_details
+
+#-----------------------------------------------------------------------
+
+def main():
+    """
+    Parses the command-line arguments (the number of repetitions),
+    builds each kind of object from the same rows that many times and
+    prints the median build time, the memory the objects take and
+    the size of their pickles.
+    """
+
+    try:
+        parser = argparse.ArgumentParser(allow_abbrev=False,
+        description="Benchmark of the objects of query results")
+        parser.add_argument("--repeat", type=int, default=20,
+        help = "the number of times to build each list of objects\
+            (default: 20)")
+
+        args = parser.parse_args()
+
+        db_values = create_condition_and_prepared_values(
+            Search('', '', '', ''))
+        rows = [tuple(regclass) for regclass\
+            in get_classes_with_condition(db_values[0], db_values[1])]
+        details_rows = [(details.get_class_data(),
+            details.get_cl_data(), details.get_courses_data(),
+            details.get_prof_data()) for details\
+            in get_classes_details([row[0] for row\
+            in rows[:MAX_DETAILS_BATCH]]) if details is not None]
+
+        builds = [
+            ('overviews (' + str(len(rows)) + ')', 'dict',
+                lambda: [_DictRegClass([str(row[0]), str(row[1]),
+                str(row[2]), str(row[3]), str(row[4])])\
+                for row in rows]),
+            ('overviews (' + str(len(rows)) + ')', 'tuple',
+                lambda: [RegClass(row) for row in rows]),
+            ('details (' + str(len(details_rows)) + ')', 'dict',
+                lambda: [_DictRegClassDetails(*row)\
+                for row in details_rows]),
+            ('details (' + str(len(details_rows)) + ')', 'slots',
+                lambda: [RegClassDetails(*row)\
+                for row in details_rows])]
+
+        print('{:<18}{:<8}{:>13}{:>13}{:>13}'.format('objects', 'kind',
+            'build (ms)', 'memory (B)', 'pickle (B)'))
+
+        for name, kind, build in builds:
+            times = []
+            for _ in range(args.repeat):
+                start = perf_counter()
+                build()
+                times.append((perf_counter() - start) * 1000)
+
+            # the strings are shared with the rows, so only the
+            # objects (and their dictionaries) are counted
+            tracemalloc.start()
+            objects = build()
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            print('{:<18}{:<8}{:>13.3f}{:>13}{:>13}'.format(name, kind,
+                median(times), memory, len(pickle.dumps(objects))))
+
+    except argparse.ArgumentError as ex:
+        print(argv[0] + ": " + str(ex), file=stderr)
+        sys.exit(2)
+
+#-----------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
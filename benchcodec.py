@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# benchcodec.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Benchmarks the encodings of the framed protocol (see codec.py): the
+time to encode and decode responses and their size on the wire, for
+the full unfiltered class list that reg.py asks for at startup and
+for a get_details response of one screenful of classes.
+"""
+
+import argparse
+import sys
+from sys import argv, stderr
+from time import perf_counter
+from statistics import median
+from database import create_condition_and_prepared_values,\
+    get_classes_with_condition, get_classes_details
+from protocol import PICKLE_MAGIC, JSON_MAGIC, GET_OVERVIEWS,\
+    GET_DETAILS
+from codec import get_codec
+from search import Search
+
+#-----------------------------------------------------------------------
+
+def main():
+    """
+    Parses the command-line arguments (the number of repetitions),
+    encodes and decodes each response with each codec that many
+    times and prints the median times and the encoded sizes.
+    """
+
+    try:
+        parser = argparse.ArgumentParser(allow_abbrev=False,
+        description="Benchmark of the encodings of the protocol")
+        parser.add_argument("--repeat", type=int, default=50,
+        help = "the number of times to encode and decode each\
+            response (default: 50)")
+
+        args = parser.parse_args()
+
+        db_values = create_condition_and_prepared_values(
+            Search('', '', '', ''))
+        classes = get_classes_with_condition(db_values[0],
+            db_values[1])
+        details = get_classes_details([regclass.get_class_id()\
+            for regclass in classes[:40]])
+
+        responses = [('overviews (' + str(len(classes)) + ')',
+            GET_OVERVIEWS, classes),
+            ('details (' + str(len(details)) + ')', GET_DETAILS,
+            details)]
+        codecs = [('pickle (v1)', get_codec(PICKLE_MAGIC)),
+            ('JSON (v2)', get_codec(JSON_MAGIC))]
+
+        print('{:<18}{:<13}{:>10}{:>13}{:>13}'.format('response',
+            'codec', 'bytes', 'encode (ms)', 'decode (ms)'))
+
+        for response_name, command, data in responses:
+            for codec_name, codec in codecs:
+                encode_times = []
+                decode_times = []
+
+                for _ in range(args.repeat):
+                    start = perf_counter()
+                    body = codec.encode_response(0, command, True, data)
+                    encode_times.append((perf_counter() - start) * 1000)
+
+                    start = perf_counter()
+                    _, _, decoded = codec.decode_response(body)
+                    decode_times.append((perf_counter() - start) * 1000)
+
+                if [str(item) for item in decoded]\
+                    != [str(item) for item in data]:
+                    print(codec_name + ' changed the ' + response_name\
+                        + ' response', file=stderr)
+                    sys.exit(1)
+
+                print('{:<18}{:<13}{:>10}{:>13.3f}{:>13.3f}'.format(
+                    response_name, codec_name, len(body),
+                    median(encode_times), median(decode_times)))
+
+    except argparse.ArgumentError as ex:
+        print(argv[0] + ": " + str(ex), file=stderr)
+        sys.exit(2)
+
+#-----------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
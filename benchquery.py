@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# benchquery.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Checks and benchmarks how database.py turns a Search into a SQL
+query. Random searches, many of them with LIKE wildcards, the escape
+character and mixed case, are checked to return exactly the classes
+whose fields contain the search text (ignoring the case of ASCII
+letters), and searches the original escaping handled correctly are
+checked to get the same patterns as before. Then the time to escape
+a field and to build a statement is compared with the original code.
+"""
+
+import argparse
+import random
+import sys
+from sys import argv, stderr
+from time import perf_counter
+from statistics import median
+from database import create_condition_and_prepared_values,\
+    get_classes_with_condition, get_classes_statement,\
+    replace_wildcards_with_escape_chars
+from likepattern import fold_case
+from search import Search
+
+# Characters that the random searches add to the text of a field.
+_SPECIAL_CHARS = '_%\\'
+
+#-----------------------------------------------------------------------
+
+def main():
+    """
+    Parses the command-line arguments (the number of random searches
+    and a random seed), checks every random search, and prints the
+    median times of the original and current escaping and statement
+    building.
+    """
+
+    try:
+        parser = argparse.ArgumentParser(allow_abbrev=False,
+        description="Check and benchmark of the queries of searches")
+        parser.add_argument("--searches", type=int, default=500,
+        help = "the number of random searches to check (default: 500)")
+        parser.add_argument("--seed", type=int, default=333,
+        help = "the seed of the random search generator")
+
+        args = parser.parse_args()
+
+        rand = random.Random(args.seed)
+        all_classes = __search(Search('', '', '', ''))
+
+        for _ in range(args.searches):
+            search = __create_search(rand, all_classes)
+            expected = [str(regclass) for regclass in all_classes\
+                if __contains(regclass, search)]
+
+            if [str(regclass) for regclass in __search(search)]\
+                != expected:
+                print('wrong classes for ' + str(search.get_key()),
+                    file=stderr)
+                sys.exit(1)
+
+            for text in search.get_key():
+                if __was_escaped_correctly(text)\
+                    and replace_wildcards_with_escape_chars(text)\
+                    != __original_escape(text):
+                    print('new pattern for ' + text, file=stderr)
+                    sys.exit(1)
+
+        print(str(args.searches) + ' random searches checked')
+
+        texts = [''.join(rand.choice('ab_%') for _ in range(length))\
+            for length in (8, 64, 512)]
+        search = Search('COS', '3', '', 'program')
+
+        timings = [('escape (8 chars)', __original_escape,
+            replace_wildcards_with_escape_chars, texts[0]),
+            ('escape (64 chars)', __original_escape,
+            replace_wildcards_with_escape_chars, texts[1]),
+            ('escape (512 chars)', __original_escape,
+            replace_wildcards_with_escape_chars, texts[2]),
+            ('statement', __original_statement,
+            __current_statement, search)]
+
+        print('{:<22}{:>15}{:>15}'.format('(us)', 'original',
+            'current'))
+
+        for name, original, current, argument in timings:
+            print('{:<22}{:>15.3f}{:>15.3f}'.format(name,
+                __time(original, argument), __time(current, argument)))
+
+    except argparse.ArgumentError as ex:
+        print(argv[0] + ": " + str(ex), file=stderr)
+        sys.exit(2)
+
+#-----------------------------------------------------------------------
+
+def __search(search):
+    db_values = create_condition_and_prepared_values(search)
+    return get_classes_with_condition(db_values[0], db_values[1])
+
+#-----------------------------------------------------------------------
+
+def __create_search(rand, all_classes):
+    # A piece of a field of a random class, sometimes with its case
+    # changed and special characters added, in each field of the
+    # search with some probability.
+    regclass = rand.choice(all_classes)
+    fields = [regclass.get_dept(), regclass.get_course_num(),
+        regclass.get_area(), regclass.get_title()]
+
+    texts = []
+    for field in fields:
+        if rand.random() < 0.5:
+            texts.append('')
+            continue
+
+        start = rand.randrange(len(field) + 1)
+        text = field[start:start + rand.randrange(1, 5)]
+
+        if rand.random() < 0.3:
+            text = text.swapcase()
+        while rand.random() < 0.4:
+            position = rand.randrange(len(text) + 1)
+            text = text[:position] + rand.choice(_SPECIAL_CHARS)\
+                + text[position:]
+        texts.append(text)
+
+    return Search(*texts)
+
+#-----------------------------------------------------------------------
+
+def __contains(regclass, search):
+    return all(fold_case(text) in fold_case(field)\
+        for text, field in zip(search.get_key(), (regclass.get_dept(),
+        regclass.get_course_num(), regclass.get_area(),
+        regclass.get_title())))
+
+#-----------------------------------------------------------------------
+
+def __was_escaped_correctly(text):
+    # The original escaping inserted characters while it kept reading
+    # positions of the unchanged text, so it went wrong after the
+    # first wildcard, and it did not escape the escape character.
+    return '\\' not in text\
+        and text.count('_') + text.count('%') <= 1
+
+#-----------------------------------------------------------------------
+
+def __original_escape(text):
+    new_text = text
+
+    for index, char in enumerate(text):
+        if char == "_":
+            new_text = new_text[:index] + r"\_" + new_text[index + 1:]
+        elif char == "%":
+            new_text = new_text[:index] + r"\%" + new_text[index + 1:]
+
+    return new_text
+
+#-----------------------------------------------------------------------
+
+def __original_statement(search):
+    condition = ""
+    escape = r"ESCAPE '\' "
+
+    prepared_values = []
+
+    for column, text in (("crosslistings.dept", search.get_dept()),
+        ("crosslistings.coursenum", search.get_number()),
+        ("courses.area", search.get_area()),
+        ("courses.title", search.get_title())):
+        condition += "AND " + column + " LIKE ? "
+        prepared_values.append("%" + __original_escape(text) + "%")
+        condition += escape
+
+    stmt_str = "SELECT classes.classid, classes.courseid, "
+    stmt_str += "courses.courseid, courses.area, courses.title"
+    stmt_str += ", crosslistings.courseid, crosslistings.dept, "
+    stmt_str += "crosslistings.coursenum "
+    stmt_str += "FROM classes, courses, crosslistings "
+    stmt_str += "WHERE classes.courseid = courses.courseid "
+    stmt_str += "AND courses.courseid = crosslistings.courseid "
+    stmt_str += condition + " "
+    stmt_str += "ORDER BY crosslistings.dept, "
+    stmt_str += "crosslistings.coursenum, classes.classid ASC"
+
+    return stmt_str, prepared_values
+
+#-----------------------------------------------------------------------
+
+def __current_statement(search):
+    condition, prepared_values =\
+        create_condition_and_prepared_values(search)
+    return get_classes_statement(condition), prepared_values
+
+#-----------------------------------------------------------------------
+
+def __time(function, argument):
+    # median microseconds of a call, over batches of calls
+    times = []
+    for _ in range(20):
+        start = perf_counter()
+        for _ in range(200):
+            function(argument)
+        times.append((perf_counter() - start) / 200 * 1000000)
+    return median(times)
+
+#-----------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# benchqueue.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Benchmarks the queue that hands results from worker threads to the
+GUI thread of reg.py (see safequeue.py) against queue.Queue and a
+collections.deque polled on a timer, as reg.py used to: the time to
+pass a burst of items from one thread to another, and the latency of
+single items that arrive while the consumer is idle.
+"""
+
+import argparse
+import sys
+from sys import argv, stderr
+from time import perf_counter, sleep
+from statistics import median
+from threading import Thread, Event
+from collections import deque
+from queue import Queue
+from safequeue import SafeQueue
+
+# Marks the end of the items of a run.
+_STOP = object()
+
+#-----------------------------------------------------------------------
+
+def main():
+    """
+    Parses the command-line arguments, runs each consumer on a burst
+    of items and on items that arrive one at a time, and prints the
+    time each burst took and the median and maximum latency.
+    """
+
+    try:
+        parser = argparse.ArgumentParser(allow_abbrev=False,
+        description="Benchmark of the queue of the client")
+        parser.add_argument("--items", type=int, default=100000,
+        help = "the number of items of a burst (default: 100000)")
+        parser.add_argument("--singles", type=int, default=50,
+        help = "the number of items sent one at a time\
+            (default: 50)")
+        parser.add_argument("--poll-interval", type=float, default=0.1,
+        help = "the seconds between polls of the deque\
+            (default: 0.1, the timer reg.py used)")
+
+        args = parser.parse_args()
+
+        consumers = [('SafeQueue get', __create_safequeue_get),
+            ('SafeQueue wakeup', __create_safequeue_wakeup),
+            ('queue.Queue', __create_queue),
+            ('deque polled', lambda: __create_deque(
+                args.poll_interval))]
+
+        print('{:<18}{:>11}{:>15}{:>15}'.format('consumer', 'burst (s)',
+            'latency (ms)', 'max (ms)'))
+
+        for name, create in consumers:
+            burst = __run(create, [0.0] * args.items, 0)
+            latencies = __run(create, [0.0] * args.singles, 0.01)
+
+            if len(burst) != args.items\
+                or len(latencies) != args.singles:
+                print(name + ' lost items', file=stderr)
+                sys.exit(1)
+
+            print('{:<18}{:>11.3f}{:>15.3f}{:>15.3f}'.format(name,
+                max(burst), median(latencies) * 1000,
+                max(latencies) * 1000))
+
+    except argparse.ArgumentError as ex:
+        print(argv[0] + ": " + str(ex), file=stderr)
+        sys.exit(2)
+
+#-----------------------------------------------------------------------
+
+def __run(create, items, gap):
+    # Puts items in a queue from this thread, gap seconds apart, and
+    # returns the seconds between the start of the run (for a burst)
+    # or the put (otherwise) and the get of each item.
+    put, consume = create()
+    delays = []
+
+    consumer = Thread(target=consume, args=(delays,))
+    consumer.start()
+
+    start = perf_counter()
+    for _ in items:
+        if gap:
+            sleep(gap)
+            start = perf_counter()
+        put(start)
+    put(_STOP)
+
+    consumer.join()
+    return delays
+
+#-----------------------------------------------------------------------
+
+def __create_safequeue_get():
+    queue = SafeQueue()
+
+    def consume(delays):
+        while True:
+            item = queue.get(True)
+            if item is _STOP:
+                return
+            delays.append(perf_counter() - item)
+
+    return queue.put, consume
+
+#-----------------------------------------------------------------------
+
+def __create_safequeue_wakeup():
+    # as reg.py does, with an Event in place of the Qt event loop
+    wakeup = Event()
+    queue = SafeQueue(wakeup=wakeup.set)
+
+    def consume(delays):
+        while True:
+            wakeup.wait()
+            wakeup.clear()
+            for item in queue.drain():
+                if item is _STOP:
+                    return
+                delays.append(perf_counter() - item)
+
+    return queue.put, consume
+
+#-----------------------------------------------------------------------
+
+def __create_queue():
+    queue = Queue()
+
+    def consume(delays):
+        while True:
+            item = queue.get()
+            if item is _STOP:
+                return
+            delays.append(perf_counter() - item)
+
+    return queue.put, consume
+
+#-----------------------------------------------------------------------
+
+def __create_deque(poll_interval):
+    items = deque()
+
+    def consume(delays):
+        while True:
+            while items:
+                item = items.popleft()
+                if item is _STOP:
+                    return
+                delays.append(perf_counter() - item)
+            sleep(poll_interval)
+
+    return items.append, consume
+
+#-----------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# benchsearch.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Benchmarks the latency of class searches on the server side without
+any networking: the original LIKE queries, the LIKE queries narrowed
+by the n-gram search index, the LIKE queries with refinement of
+earlier results, the in-memory catalog and the memory-mapped
+snapshot image. The searches are the prefixes a user produces while
+typing dept, course numbers and title words of random classes, and
+every path is checked to return the same classes as the LIKE
+queries.
+"""
+
+import argparse
+import random
+import sys
+from sys import argv, stderr
+from sqlite3 import connect
+from contextlib import closing
+from time import perf_counter
+from statistics import mean, quantiles
+from database import DATABASE_URL, build_search_index,\
+    use_search_index, create_condition_and_prepared_values,\
+    get_classes_with_condition
+from os.path import join
+from tempfile import TemporaryDirectory
+from catalog import load_catalog
+from snapshot import Snapshot, build_snapshot
+from refiner import Refiner
+from regserver import REFINE_HISTORY
+from search import Search
+
+#-----------------------------------------------------------------------
+
+def main():
+    """
+    Parses the command-line arguments (the number of typing sessions
+    and a random seed), runs every search of those sessions through
+    each search path and prints latency statistics per path.
+    """
+
+    try:
+        parser = argparse.ArgumentParser(allow_abbrev=False,
+        description="Benchmark of class search latency")
+        parser.add_argument("--sessions", type=int, default=200,
+        help = "the number of simulated typing sessions\
+            (default: 200)")
+        parser.add_argument("--seed", type=int, default=333,
+        help = "the seed of the random session generator")
+
+        args = parser.parse_args()
+
+        catalog = load_catalog()
+
+        snapshot_dir = TemporaryDirectory()
+        snapshot_path = join(snapshot_dir.name, 'reg.snapshot')
+        build_snapshot(snapshot_path)
+        snapshot = Snapshot(snapshot_path)
+        search_index = build_search_index()
+        searches = __create_searches(args.sessions,
+            random.Random(args.seed))
+
+        def like(search):
+            use_search_index(None)
+            db_values = create_condition_and_prepared_values(search)
+            return get_classes_with_condition(db_values[0],
+                db_values[1])
+
+        def like_with_index(search):
+            use_search_index(search_index)
+            db_values = create_condition_and_prepared_values(search)
+            return get_classes_with_condition(db_values[0],
+                db_values[1])
+
+        refiner = Refiner(REFINE_HISTORY)
+
+        def like_with_refiner(search):
+            return refiner.search(search, lambda: like(search))
+
+        paths = [('LIKE', like),
+            ('LIKE + n-gram index', like_with_index),
+            ('LIKE + refiner', like_with_refiner),
+            ('catalog', catalog.search),
+            ('snapshot', snapshot.search)]
+
+        expected = [[str(regclass) for regclass in like(search)]\
+            for search in searches]
+
+        print(str(len(searches)) + ' searches')
+        print('{:<22}{:>9}{:>9}{:>9}{:>9}'.format('path (ms)', 'mean',
+            'p50', 'p95', 'p99'))
+
+        for path_name, path in paths:
+            latencies = []
+            for search, classes in zip(searches, expected):
+                start = perf_counter()
+                result = path(search)
+                latencies.append((perf_counter() - start) * 1000)
+
+                if [str(regclass) for regclass in result] != classes:
+                    print(path_name + ' returned different classes '\
+                        + 'for ' + str(search), file=stderr)
+                    sys.exit(1)
+
+            cut_points = quantiles(latencies, n=100)
+            print('{:<22}{:>9.3f}{:>9.3f}{:>9.3f}{:>9.3f}'.format(
+                path_name, mean(latencies), cut_points[49],
+                cut_points[94], cut_points[98]))
+
+    except argparse.ArgumentError as ex:
+        print(argv[0] + ": " + str(ex), file=stderr)
+        sys.exit(2)
+
+#-----------------------------------------------------------------------
+
+def __create_searches(sessions, rand):
+    # Each session types one field of a random class one character at
+    # a time, like a user of reg.py does, starting from the empty
+    # search that reg.py runs at startup.
+    with connect(DATABASE_URL, uri=True) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute("SELECT crosslistings.dept, "\
+                + "crosslistings.coursenum, courses.title "\
+                + "FROM classes, courses, crosslistings "\
+                + "WHERE classes.courseid = courses.courseid "\
+                + "AND courses.courseid = crosslistings.courseid")
+            rows = cursor.fetchall()
+
+    searches = [Search('', '', '', '')]
+
+    for _ in range(sessions):
+        dept, number, title = rand.choice(rows)
+
+        field = rand.choice(['dept', 'number', 'title'])
+        if field == 'dept':
+            text = dept
+        elif field == 'number':
+            text = number
+        else:
+            words = title.split()
+            text = ' '.join(words[rand.randrange(len(words)):][:2])
+
+        for length in range(1, len(text) + 1):
+            prefix = text[:length]
+            searches.append(Search(prefix if field == 'dept' else '',
+                prefix if field == 'number' else '', '',
+                prefix if field == 'title' else ''))
+
+    return searches
+
+#-----------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
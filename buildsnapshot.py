@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# buildsnapshot.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Command-line tool for operators of the registrar server. Rebuilds the
+snapshot image of the class overviews (see snapshot.py) from the
+registrar database, or checks whether the image is current. Servers
+started with --snapshot map the new image when their workers start.
+"""
+
+import argparse
+import sys
+from sys import argv, stderr
+from database import DATABASE_PATH
+from snapshot import SNAPSHOT_PATH, Snapshot, build_snapshot
+
+#-----------------------------------------------------------------------
+
+def main():
+    """
+    Parses the command-line arguments (the paths of the database and
+    the image), then either checks the image, exiting with status 1
+    if it is stale or damaged, or rebuilds it.
+    """
+
+    try:
+        parser = argparse.ArgumentParser(allow_abbrev=False,
+        description="Builds the snapshot image of the class overviews")
+        parser.add_argument("--database", type=str,
+        default=DATABASE_PATH,
+        help = "the path of the registrar database (default: "\
+            + DATABASE_PATH + ")")
+        parser.add_argument("--output", type=str, default=SNAPSHOT_PATH,
+        help = "the path of the image (default: " + SNAPSHOT_PATH + ")")
+        parser.add_argument("--check", action="store_true",
+        help = "only check that the image is current and intact")
+
+        args = parser.parse_args()
+
+        try:
+            if args.check:
+                snapshot = Snapshot(args.output, args.database)
+                print(args.output + ': ' + str(len(snapshot))\
+                    + ' classes, current')
+                snapshot.close()
+            else:
+                rows = build_snapshot(args.output, args.database)
+                print(args.output + ': ' + str(rows) + ' classes')
+        except (OSError, ValueError) as ex:
+            print(argv[0] + ": " + str(ex), file=stderr)
+            sys.exit(1)
+
+    except argparse.ArgumentError as ex:
+        print(argv[0] + ": " + str(ex), file=stderr)
+        sys.exit(2)
+
+#-----------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
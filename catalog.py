@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# catalog.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Holds an in-memory copy of the class
+overviews (the join of classes, courses and crosslistings) so that a
+search is a scan over a few column lists instead of a SQL query.
+An n-gram index over each searchable column narrows that scan to
+the rows that can possibly match. Searches return exactly what
+database.get_classes_with_condition returns for the same Search,
+in the same order.
+"""
+
+from sqlite3 import connect
+from contextlib import closing
+from regclass import RegClass
+from database import DATABASE_URL, create_like_pattern
+from likepattern import fold_case, create_like_matcher
+from ngramindex import NgramIndex
+
+#-----------------------------------------------------------------------
+
+class Catalog:
+    """
+    The class overviews of the registrar database, given as
+    parallel column lists (one entry per class and crosslisting)
+    that are sorted by dept, course number and class id, like the
+    results of get_classes_with_condition, and stored as a list of
+    RegClass objects. Each searchable column also has a case-folded
+    copy for matching and an NgramIndex of its row numbers.
+    """
+
+    def __init__(self, class_ids, depts, course_nums, areas, titles):
+        # RegClass objects are immutable, so every search result
+        # shares the same ones
+        self._classes = [RegClass(fields) for fields in zip(class_ids,
+            depts, course_nums, areas, titles)]
+
+        self._folded_depts = [fold_case(dept) for dept in depts]
+        self._folded_course_nums =\
+            [fold_case(course_num) for course_num in course_nums]
+        self._folded_areas = [fold_case(area) for area in areas]
+        self._folded_titles = [fold_case(title) for title in titles]
+
+        self._indexes = [NgramIndex(enumerate(column))\
+            for column in (self._folded_depts, self._folded_course_nums,
+                self._folded_areas, self._folded_titles)]
+
+    def __len__(self):
+        return len(self._classes)
+
+    def search(self, search):
+        """
+        Returns the classes that match search as a list of RegClass
+        objects, in the order of get_classes_with_condition.
+
+        Keyword arguments:
+        search -- a Search object that contains all relevant search
+        fields (e.g. area)
+        """
+        rows = self.match(search)
+
+        classes = self._classes
+        return [classes[row] for row in rows]
+
+    def match(self, search):
+        """
+        Returns the sorted list of row numbers of the classes that
+        match search.
+
+        Keyword arguments:
+        search -- a Search object that contains all relevant search
+        fields (e.g. area)
+        """
+        filters = []
+
+        for column, index, text in zip((self._folded_depts,
+            self._folded_course_nums, self._folded_areas,
+            self._folded_titles), self._indexes, (search.get_dept(),
+            search.get_number(), search.get_area(),
+            search.get_title())):
+
+            # no filter, or LIKE '%%', which matches every row that
+            # has a value
+            if not text:
+                continue
+
+            filters.append((column, index, create_like_pattern(text)))
+
+        candidates = None
+        for _, index, pattern in filters:
+            keys = index.candidates(pattern)
+            if keys is not None:
+                candidates = keys if candidates is None\
+                    else candidates & keys
+
+        if candidates is None:
+            rows = range(len(self._classes))
+        else:
+            rows = sorted(candidates)
+
+        # the index only narrows the search; check the exact patterns
+        for column, _, pattern in filters:
+            matches = create_like_matcher(pattern)
+            rows = [row for row in rows if matches(column[row])]
+
+        return list(rows)
+
+#-----------------------------------------------------------------------
+
+def load_catalog(database_url=DATABASE_URL):
+    """
+    Reads the class overviews from the registrar database and
+    returns them as a Catalog.
+
+    Keyword arguments:
+    database_url -- the SQLite URI of the registrar database
+    """
+
+    return Catalog(*read_overviews(database_url))
+
+#-----------------------------------------------------------------------
+
+def read_overviews(database_url=DATABASE_URL):
+    """
+    Reads the class overviews from the registrar database and
+    returns them as a tuple of parallel lists of strings (class ids,
+    depts, course numbers, areas and titles), sorted like the
+    results of get_classes_with_condition.
+
+    Keyword arguments:
+    database_url -- the SQLite URI of the registrar database
+    """
+
+    with connect(database_url, uri=True) as connection:
+        with closing(connection.cursor()) as cursor:
+
+            # Sorting with SQLite's own ORDER BY guarantees the same
+            # order (and collation) as get_classes_with_condition.
+            # Rows with a NULL field are left out because LIKE never
+            # matches NULL, and every Search filters on all fields.
+            stmt_str = "SELECT classes.classid, crosslistings.dept, "
+            stmt_str += "crosslistings.coursenum, courses.area, "
+            stmt_str += "courses.title "
+            stmt_str += "FROM classes, courses, crosslistings "
+            stmt_str += "WHERE classes.courseid = courses.courseid "
+            stmt_str += "AND courses.courseid = crosslistings.courseid "
+            stmt_str += "AND crosslistings.dept IS NOT NULL "
+            stmt_str += "AND crosslistings.coursenum IS NOT NULL "
+            stmt_str += "AND courses.area IS NOT NULL "
+            stmt_str += "AND courses.title IS NOT NULL "
+            stmt_str += "ORDER BY crosslistings.dept, "
+            stmt_str += "crosslistings.coursenum, classes.classid ASC"
+
+            cursor.execute(stmt_str)
+
+            columns = ([], [], [], [], [])
+
+            # the same dept, area or title is repeated on many rows;
+            # keep one copy of each distinct string
+            strings = {}
+
+            for row in cursor:
+                for column, value in zip(columns, row):
+                    value = str(value)
+                    column.append(strings.setdefault(value, value))
+
+            return columns
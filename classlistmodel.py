@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# classlistmodel.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the client side. The model behind the class list of
+reg.py: a plain list of RegClass objects shown by a QListView, which
+only formats the rows it paints, each of them once. A new search
+result is merged into the list, chunk by chunk, so that only the rows
+that differ from the previous result are inserted or removed. A
+search result may also be shown a page at a time (see page.py): the
+list then asks for the next page when the view is scrolled to its
+end.
+"""
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, pyqtSignal
+
+#-----------------------------------------------------------------------
+
+# Most formatted rows the model keeps, far more than there are
+# classes; beyond that, the texts of classes that are no longer in
+# the database are dropped along with the others.
+MAX_TEXTS = 20000
+
+#-----------------------------------------------------------------------
+
+class ClassListModel(QAbstractListModel):
+    """
+    A list model of RegClass objects. The display role of a row is
+    the string of its RegClass and the user role its class id. The
+    string of a class is only formatted the first time it is shown,
+    and is kept for every later search result that contains the
+    same class.
+
+    A search result replaces the list through start_update followed
+    by merge_chunk for each chunk of the result. Search results are
+    sorted by dept, course number and class id, so the merge walks
+    the old and new lists together like a merge sort: classes only
+    in the old list are removed, classes only in the new list are
+    inserted, and classes in both stay where they are. The result
+    is always the new list, even if it is not sorted; sorting only
+    keeps the number of changed rows small.
+
+    A paged search result is shown with show_page, which merges its
+    first page the same way. While more pages follow the last one
+    shown, the view asks the model to fetch more rows once it is
+    scrolled to the end, and the model emits fetch_requested with
+    the PageQuery of the next page, whose Page must then be given to
+    show_page (or the query to fetch_failed).
+    """
+
+    fetch_requested = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        QAbstractListModel.__init__(self, parent)
+
+        self._classes = []
+
+        # RegClass -> its string
+        self._texts = {}
+
+        # rows before this one hold the new result merged so far;
+        # rows from it on are what is left of the old result
+        self._merged_rows = 0
+
+        # the PageQuery of the page that follows the list, or None,
+        # and whether it has been requested
+        self._next_query = None
+        self._fetching = False
+
+    def rowCount(self, parent=QModelIndex()):
+        """
+        Returns the number of classes in the list (Qt override).
+        """
+        if parent.isValid():
+            return 0
+        return len(self._classes)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        """
+        Returns the text or the class id of a row (Qt override).
+        """
+        if not index.isValid() or index.row() >= len(self._classes):
+            return None
+
+        regclass = self._classes[index.row()]
+
+        if role == QtCore.Qt.DisplayRole:
+            text = self._texts.get(regclass)
+            if text is None:
+                text = str(regclass)
+                self._texts[regclass] = text
+            return text
+        if role == QtCore.Qt.UserRole:
+            return regclass.get_class_id()
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        """
+        Returns whether more pages follow the list and none has been
+        requested yet (Qt override).
+        """
+        return not parent.isValid() and self._next_query is not None\
+            and not self._fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        """
+        Asks for the page that follows the list by emitting
+        fetch_requested (Qt override).
+        """
+        if self.canFetchMore(parent):
+            self._fetching = True
+            self.fetch_requested.emit(self._next_query)
+
+    def get_class_id(self, row):
+        """
+        Returns the class id of the class in row.
+
+        Keyword arguments:
+            row -- a row number of the list
+        """
+        return self._classes[row].get_class_id()
+
+    def start_update(self):
+        """
+        Starts merging a new search result into the list. Until its
+        last chunk has been merged, the list holds the part of the
+        new result merged so far followed by the rest of the old one.
+        """
+        self._merged_rows = 0
+
+        if len(self._texts) > MAX_TEXTS:
+            self._texts.clear()
+
+    def merge_chunk(self, classes, last):
+        """
+        Merges the next chunk of the new search result into the list,
+        inserting and removing as few rows as it can.
+
+        Keyword arguments:
+            classes -- the list of RegClass objects of the chunk
+            last -- whether this is the last chunk of the result,
+                after which the rest of the old result is removed
+        """
+        position = 0
+
+        while position < len(classes):
+            key = _order_key(classes[position])
+
+            # old classes that sort before the next new one are gone
+            end = self._merged_rows
+            while end < len(self._classes)\
+                and _order_key(self._classes[end]) < key:
+                end += 1
+            self._remove_rows(self._merged_rows, end)
+
+            if self._merged_rows < len(self._classes)\
+                and _order_key(self._classes[self._merged_rows]) == key:
+                self._replace_row(self._merged_rows, classes[position])
+                self._merged_rows += 1
+                position += 1
+                continue
+
+            # new classes that sort before the next old one are added
+            end = position + 1
+            while end < len(classes)\
+                and (self._merged_rows == len(self._classes)\
+                or _order_key(classes[end])\
+                < _order_key(self._classes[self._merged_rows])):
+                end += 1
+            self._insert_rows(self._merged_rows, classes[position:end])
+            self._merged_rows += end - position
+            position = end
+
+        if last:
+            self._remove_rows(self._merged_rows, len(self._classes))
+
+    def show_page(self, query, page):
+        """
+        Shows a page of a search result. The first page of a search
+        replaces the list, merged into it like a whole result; a
+        later page is appended if it is the one the list asked for
+        last, and dropped otherwise (e.g. because the list has been
+        replaced by a newer search since).
+
+        Keyword arguments:
+            query -- the PageQuery of the page
+            page -- the Page that answered query
+        """
+        if query.get_after() is None:
+            self.start_update()
+            self.merge_chunk(page.get_classes(), True)
+        elif query is not self._next_query:
+            return
+        elif page.get_classes():
+            self._insert_rows(len(self._classes), page.get_classes())
+
+        self._next_query = query.get_next(page)
+        self._fetching = False
+
+    def fetch_failed(self, query):
+        """
+        Lets the list ask again, the next time the view is scrolled
+        to its end, for a page that could not be fetched.
+
+        Keyword arguments:
+            query -- the PageQuery of the page
+        """
+        if query is self._next_query:
+            self._fetching = False
+
+    def _insert_rows(self, row, classes):
+        self.beginInsertRows(QModelIndex(), row, row + len(classes) - 1)
+        self._classes[row:row] = classes
+        self.endInsertRows()
+
+    def _remove_rows(self, first, end):
+        if first >= end:
+            return
+        self.beginRemoveRows(QModelIndex(), first, end - 1)
+        del self._classes[first:end]
+        self.endRemoveRows()
+
+    def _replace_row(self, row, regclass):
+        # the same class may have changed (e.g. a new title)
+        old = self._classes[row]
+        self._classes[row] = regclass
+        if old != regclass:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+#-----------------------------------------------------------------------
+
+def _order_key(regclass):
+    # The order of search results: dept, course number, then class
+    # id as a number. Class ids are non-negative integers, and those
+    # sort like (number of digits, digits) without any conversion.
+    class_id = regclass.get_class_id()
+    return (regclass.get_dept(), regclass.get_course_num(),
+        len(class_id), class_id)
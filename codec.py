@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# codec.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module shared by the client and the server. Encodes the messages of
+the framed protocol (see protocol.py). Each version of the protocol
+has a codec, chosen by the magic number a connection starts with.
+
+Version 2 (JSON_MAGIC) encodes messages as compact UTF-8 JSON with
+a fixed schema, so decoding a message never runs code and class
+lists cost a few bytes per field. A request is an object
+
+    {"id": request id, "command": command, "payload": payload}
+
+where the request id is an integer, the command a string, the
+payload of get_overviews and stream_overviews is an object with
+the dept, number, area and title strings of the Search, the
+payload of get_overviews_page is the same object with the "after"
+cursor of the PageQuery (a [dept, coursenum, classid] list, or
+null), its "limit" and whether to count the "total", the payload
+of get_detail is a class id string, the payload of get_details a
+list of class id strings and the payload of cancel the id of the
+request to cancel. A response is an object
+
+    {"id": request id, "command": command, "ok": successful,
+        "data": data}
+
+where data is the error message if ok is false. Otherwise, the
+class list of get_overviews is sent column by column, as an object
+of "classid", "dept", "coursenum", "area" and "title" lists (plus
+a boolean "last" for each chunk of stream_overviews, or a boolean
+"more" and the "total" number or null for a page of
+get_overviews_page); class details are objects whose keys are the
+names of their database columns (with "depts", "coursenums" and
+"profs" lists); and get_details sends a list of class details or
+nulls.
+
+Version 1 (PICKLE_MAGIC) pickles the message tuples. It is only
+kept for clients that predate version 2.
+"""
+
+import json
+from pickle import dumps, loads
+from protocol import PICKLE_MAGIC, JSON_MAGIC, GET_OVERVIEWS,\
+    GET_OVERVIEWS_PAGE, STREAM_OVERVIEWS, GET_DETAIL, GET_DETAILS,\
+    CANCEL
+from search import Search
+from page import PageQuery, Page
+from regclass import RegClass
+from regclassdetails import RegClassDetails
+
+#-----------------------------------------------------------------------
+
+_CLASS_FIELDS = ('courseid', 'days', 'starttime', 'endtime', 'bldg',
+    'roomnum')
+_COURSE_FIELDS = ('area', 'title', 'descrip', 'prereqs')
+
+#-----------------------------------------------------------------------
+
+class MalformedRequestError(ValueError):
+    """
+    Raised when the body of a request does not follow the schema of
+    the protocol. Holds the request_id and the command of the
+    request, or None for each that could not be decoded, so that a
+    server can answer the request with the error and go on serving
+    the connection.
+    """
+
+    def __init__(self, message, request_id=None, command=None):
+        super().__init__(message)
+        self.request_id = request_id
+        self.command = command
+
+#-----------------------------------------------------------------------
+
+class PickleCodec:
+    """
+    Version 1 of the framed protocol: pickled message tuples.
+    Unpickling runs code chosen by the sender, so servers should
+    only accept it from trusted clients.
+    """
+
+    def encode_request(self, request_id, command, payload):
+        """
+        Returns the body of the frame of a request.
+
+        Keyword arguments:
+            request_id -- the id that the response will carry
+            command -- one of the commands in protocol.py
+            payload -- the data the command needs
+        """
+        return dumps((request_id, command, payload))
+
+    def decode_request(self, body):
+        """
+        Returns the (request_id, command, payload) tuple held in the
+        body of the frame of a request.
+
+        Keyword arguments:
+            body -- the bytes that follow a frame header
+        """
+        return loads(body)
+
+    def encode_response(self, request_id, command, successful, data):
+        """
+        Returns the body of the frame of a response.
+
+        Keyword arguments:
+            request_id -- the id of the request
+            command -- the command of the request
+            successful -- whether the request succeeded
+            data -- the requested data, or the error message
+        """
+        return dumps((request_id, successful, data))
+
+    def encode_shared_response(self, command, successful, data):
+        """
+        Returns a response without a request id, which bind_response
+        turns into the body of the frame of the response of any
+        request of command with the same result.
+
+        Keyword arguments:
+            command -- the command of the request
+            successful -- whether the request succeeded
+            data -- the requested data, or the error message
+        """
+        return dumps((successful, data))
+
+    def bind_response(self, shared, request_id):
+        """
+        Returns the body of the frame of the response to the request
+        with request_id made from shared. A pickle cannot be spliced,
+        so this unpickles shared and pickles it again.
+
+        Keyword arguments:
+            shared -- a response of encode_shared_response
+            request_id -- the id of the request
+        """
+        return dumps((request_id,) + loads(shared))
+
+    def decode_response(self, body):
+        """
+        Returns the (request_id, successful, data) tuple held in the
+        body of the frame of a response.
+
+        Keyword arguments:
+            body -- the bytes that follow a frame header
+        """
+        return loads(body)
+
+#-----------------------------------------------------------------------
+
+class JsonCodec:
+    """
+    Version 2 of the framed protocol: JSON messages with the schema
+    described in the docstring of this module. Malformed messages
+    raise ValueError (MalformedRequestError for requests).
+    """
+
+    def encode_request(self, request_id, command, payload):
+        """
+        Returns the body of the frame of a request.
+
+        Keyword arguments:
+            request_id -- the id that the response will carry
+            command -- one of the commands in protocol.py
+            payload -- the data the command needs
+        """
+        if command in (GET_OVERVIEWS, STREAM_OVERVIEWS):
+            payload = _encode_search(payload)
+        elif command == GET_OVERVIEWS_PAGE:
+            query = payload
+            payload = _encode_search(query.get_search())
+            payload['after'] = query.get_after()
+            payload['limit'] = query.get_limit()
+            payload['total'] = query.get_count_total()
+
+        return _dump_json({'id': request_id, 'command': command,
+            'payload': payload})
+
+    def decode_request(self, body):
+        """
+        Returns the (request_id, command, payload) tuple held in the
+        body of the frame of a request. Raises MalformedRequestError
+        if the request does not follow the schema.
+
+        Keyword arguments:
+            body -- the bytes that follow a frame header
+        """
+        try:
+            message = _load_json(body)
+        except ValueError as ex:
+            raise MalformedRequestError("malformed request: "\
+                + str(ex)) from ex
+
+        request_id = message.get('id')
+        if not _is_int(request_id):
+            raise MalformedRequestError("malformed request: the "\
+                + "request id must be an integer")
+
+        command = message.get('command')
+        if not isinstance(command, str):
+            raise MalformedRequestError("malformed request: the "\
+                + "command must be a string", request_id)
+
+        try:
+            payload = message['payload']
+
+            if command in (GET_OVERVIEWS, STREAM_OVERVIEWS):
+                payload = _decode_search(payload)
+            elif command == GET_OVERVIEWS_PAGE:
+                # PageQuery raises ValueError if the rest is wrong
+                payload = PageQuery(_decode_search(payload),
+                    payload['after'], payload['limit'],
+                    payload['total'])
+            elif command == GET_DETAIL:
+                if not isinstance(payload, str):
+                    raise TypeError("the class id must be a string")
+            elif command == GET_DETAILS:
+                if not isinstance(payload, list) or not all(
+                    isinstance(class_id, str) for class_id in payload):
+                    raise TypeError("the class ids must be a list of "\
+                        + "strings")
+            elif command == CANCEL:
+                if not _is_int(payload):
+                    raise TypeError("the id of the request to cancel "\
+                        + "must be an integer")
+
+            return (request_id, command, payload)
+
+        except (KeyError, TypeError, ValueError) as ex:
+            raise MalformedRequestError("malformed request: "\
+                + str(ex), request_id, command) from ex
+
+    def encode_response(self, request_id, command, successful, data):
+        """
+        Returns the body of the frame of a response.
+
+        Keyword arguments:
+            request_id -- the id of the request
+            command -- the command of the request
+            successful -- whether the request succeeded
+            data -- the requested data, or the error message
+        """
+        return self.bind_response(self.encode_shared_response(command,
+            successful, data), request_id)
+
+    def encode_shared_response(self, command, successful, data):
+        """
+        Returns a response without a request id, which bind_response
+        turns into the body of the frame of the response of any
+        request of command with the same result.
+
+        Keyword arguments:
+            command -- the command of the request
+            successful -- whether the request succeeded
+            data -- the requested data, or the error message
+        """
+        if successful:
+            if command == GET_OVERVIEWS:
+                data = _encode_classes(data)
+            elif command == GET_OVERVIEWS_PAGE:
+                page = data
+                data = _encode_classes(page.get_classes())
+                data['more'] = page.has_more()
+                data['total'] = page.get_total()
+            elif command == STREAM_OVERVIEWS:
+                classes, last = data
+                data = _encode_classes(classes)
+                data['last'] = last
+            elif command == GET_DETAIL:
+                data = _encode_details(data)
+            elif command == GET_DETAILS:
+                data = [None if details is None\
+                    else _encode_details(details) for details in data]
+
+        return _dump_json({'command': command, 'ok': successful,
+            'data': data})
+
+    def bind_response(self, shared, request_id):
+        """
+        Returns the body of the frame of the response to the request
+        with request_id made from shared, by splicing the id into the
+        JSON object without decoding it.
+
+        Keyword arguments:
+            shared -- a response of encode_shared_response
+            request_id -- the id of the request
+        """
+        return b'{"id":' + _dump_json(request_id) + b',' + shared[1:]
+
+    def decode_response(self, body):
+        """
+        Returns the (request_id, successful, data) tuple held in the
+        body of the frame of a response.
+
+        Keyword arguments:
+            body -- the bytes that follow a frame header
+        """
+        message = _load_json(body)
+
+        try:
+            command = message['command']
+            successful = message['ok']
+            data = message['data']
+
+            if successful:
+                if command == GET_OVERVIEWS:
+                    data = _decode_classes(data)
+                elif command == GET_OVERVIEWS_PAGE:
+                    data = Page(_decode_classes(data), data['more'],
+                        data['total'])
+                elif command == STREAM_OVERVIEWS:
+                    data = (_decode_classes(data), data['last'])
+                elif command == GET_DETAIL:
+                    data = _decode_details(data)
+                elif command == GET_DETAILS:
+                    data = [None if details is None\
+                        else _decode_details(details)\
+                        for details in data]
+
+            return (message['id'], successful, data)
+
+        except (KeyError, TypeError) as ex:
+            raise ValueError("malformed response: " + str(ex)) from ex
+
+#-----------------------------------------------------------------------
+
+_CODECS = {PICKLE_MAGIC: PickleCodec(), JSON_MAGIC: JsonCodec()}
+
+#-----------------------------------------------------------------------
+
+def get_codec(magic, allow_pickle=True):
+    """
+    Returns the codec of the version of the protocol that magic
+    stands for, raising ValueError if there is none, or if it is
+    version 1 and allow_pickle is not set.
+
+    Keyword arguments:
+    magic -- the magic number a framed connection starts with
+    allow_pickle -- whether to accept version 1 (pickles)
+    """
+    codec = _CODECS.get(magic)
+    if codec is None:
+        raise ValueError("unknown protocol")
+    if magic == PICKLE_MAGIC and not allow_pickle:
+        raise ValueError("refused client of version 1 (pickles) of "\
+            + "the framed protocol")
+    return codec
+
+#-----------------------------------------------------------------------
+
+def _dump_json(message):
+    return json.dumps(message, ensure_ascii=False,
+        separators=(',', ':')).encode('utf-8')
+
+#-----------------------------------------------------------------------
+
+def _load_json(body):
+    # JSONDecodeError and UnicodeDecodeError are ValueErrors
+    message = json.loads(body)
+
+    if not isinstance(message, dict):
+        raise ValueError("message is not a JSON object")
+    return message
+
+#-----------------------------------------------------------------------
+
+def _is_int(value):
+    # bool is a subclass of int, but true and false are not ids
+    return isinstance(value, int) and not isinstance(value, bool)
+
+#-----------------------------------------------------------------------
+
+def _encode_search(search):
+    return {'dept': search.get_dept(), 'number': search.get_number(),
+        'area': search.get_area(), 'title': search.get_title()}
+
+#-----------------------------------------------------------------------
+
+def _decode_search(payload):
+    if not isinstance(payload, dict):
+        raise TypeError("the search must be a JSON object")
+    fields = [payload[name] for name in ('dept', 'number', 'area',
+        'title')]
+    if not all(isinstance(field, str) for field in fields):
+        raise TypeError("search fields must be strings")
+    return Search(*fields)
+
+#-----------------------------------------------------------------------
+
+def _encode_classes(classes):
+    return {'classid': [cls.get_class_id() for cls in classes],
+        'dept': [cls.get_dept() for cls in classes],
+        'coursenum': [cls.get_course_num() for cls in classes],
+        'area': [cls.get_area() for cls in classes],
+        'title': [cls.get_title() for cls in classes]}
+
+#-----------------------------------------------------------------------
+
+def _decode_classes(columns):
+    return [RegClass(row) for row in zip(columns['classid'],
+        columns['dept'], columns['coursenum'], columns['area'],
+        columns['title'])]
+
+#-----------------------------------------------------------------------
+
+def _encode_details(details):
+    encoded = dict(zip(_CLASS_FIELDS, details.get_class_data()))
+    encoded.update(zip(_COURSE_FIELDS, details.get_courses_data()))
+
+    depts, course_nums = details.get_cl_data()
+    encoded['depts'] = depts
+    encoded['coursenums'] = course_nums
+    encoded['profs'] = details.get_prof_data()
+
+    return encoded
+
+#-----------------------------------------------------------------------
+
+def _decode_details(encoded):
+    return RegClassDetails(
+        [encoded[field] for field in _CLASS_FIELDS],
+        [encoded['depts'], encoded['coursenums']],
+        [encoded[field] for field in _COURSE_FIELDS],
+        encoded['profs'])
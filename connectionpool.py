@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# connectionpool.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Keeps read-only SQLite connections to the
+registrar database open between queries, so that a query neither pays
+for opening the database and reading its schema nor starts with an
+empty page cache.
+"""
+
+import sqlite3
+from os import getpid
+from threading import Lock
+from time import monotonic
+from contextlib import contextmanager
+
+#-----------------------------------------------------------------------
+
+# Most idle connections a pool keeps open by default. A worker
+# process runs one query at a time, except while a class list is
+# being streamed.
+POOL_SIZE = 4
+
+# Seconds a connection may stay idle before it is checked again when
+# it is taken from the pool.
+HEALTH_CHECK_INTERVAL = 30.0
+
+#-----------------------------------------------------------------------
+
+class ConnectionPool:
+    """
+    A thread-safe pool of connections to a SQLite database, opened
+    read-only with query_only set. Idle connections are reused most
+    recently used first, since those have the warmest page caches.
+
+    Every connection gets a page cache of cache_size kibibytes and,
+    if mmap_size is not 0, reads up to mmap_size bytes of the
+    database through a memory map instead of read calls. If
+    immutable is set, SQLite assumes that nothing changes the
+    database file, and skips locking it and checking for changes;
+    the file must then really not change while the pool is in use.
+
+    A connection that raised sqlite3.DatabaseError is closed instead
+    of being reused, and a connection that has been idle for longer
+    than HEALTH_CHECK_INTERVAL is checked with a trivial query before
+    it is reused; either way the next query opens a new one.
+    Connections are never shared with a forked child process.
+    """
+
+    def __init__(self, database_url, size=POOL_SIZE, cache_size=2048,
+        mmap_size=0, immutable=False):
+        if immutable:
+            database_url += '&immutable=1' if '?' in database_url\
+                else '?immutable=1'
+
+        self._database_url = database_url
+        self._size = size
+        self._cache_size = cache_size
+        self._mmap_size = mmap_size
+
+        self._lock = Lock()
+        self._pid = getpid()
+
+        # (connection, time it was returned), most recently used last
+        self._idle = []
+
+    @contextmanager
+    def connection(self):
+        """
+        Returns a context manager that takes a connection from the
+        pool (or opens one), gives it to the with block and returns
+        it to the pool afterwards.
+        """
+        connection = self._take()
+        broken = False
+
+        try:
+            yield connection
+        except sqlite3.DatabaseError:
+            broken = True
+            raise
+        finally:
+            if broken:
+                connection.close()
+            else:
+                self._give_back(connection)
+
+    def close(self):
+        """
+        Closes every idle connection of the pool. Connections in use
+        are closed when they are given back.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            self._size = 0
+
+        for connection, _ in idle:
+            connection.close()
+
+    def _take(self):
+        with self._lock:
+            if self._pid != getpid():
+                # inherited through fork; the parent still uses them
+                self._pid = getpid()
+                self._idle = []
+
+            idle = self._idle.pop() if self._idle else None
+
+        if idle is not None:
+            connection, returned = idle
+            if monotonic() - returned < HEALTH_CHECK_INTERVAL\
+                or _is_healthy(connection):
+                return connection
+            connection.close()
+
+        return self._open()
+
+    def _give_back(self, connection):
+        with self._lock:
+            if self._pid == getpid() and len(self._idle) < self._size:
+                self._idle.append((connection, monotonic()))
+                return
+
+        connection.close()
+
+    def _open(self):
+        connection = sqlite3.connect(self._database_url, uri=True,
+            check_same_thread=False)
+
+        try:
+            connection.execute('PRAGMA query_only = ON')
+            # a negative cache_size is in kibibytes, not pages
+            connection.execute('PRAGMA cache_size = '\
+                + str(-int(self._cache_size)))
+            connection.execute('PRAGMA mmap_size = '\
+                + str(int(self._mmap_size)))
+        except sqlite3.Error:
+            connection.close()
+            raise
+
+        return connection
+
+#-----------------------------------------------------------------------
+
+def _is_healthy(connection):
+    # reads the first page of the database, like every query does
+    try:
+        connection.execute('SELECT count(*) FROM sqlite_master')\
+            .fetchone()
+        return True
+    except sqlite3.Error:
+        return False
@@ -12,12 +12,104 @@ and create SQLite statements.
 
 from sqlite3 import connect
 from contextlib import closing
+from urllib.parse import quote
 from regclass import RegClass
 from regclassdetails import RegClassDetails
+from ngramindex import NgramIndex
+from connectionpool import ConnectionPool
 
 #-----------------------------------------------------------------------
 
-DATABASE_URL = 'file:reg.sqlite?mode=ro'
+DATABASE_PATH = 'reg.sqlite'
+
+# N-gram indexes (dept, coursenum, area, title) of course ids used to
+# narrow searches before the LIKE conditions are checked, if one has
+# been installed with use_search_index.
+_search_index = None
+
+# The pool of connections that the queries of requests use, if one
+# has been installed with use_connection_pool; otherwise a pool with
+# the default settings is created on first use.
+_pool = None
+
+# Narrowing only pays off if it rules out most courses; a long list of
+# candidates is slower to look up than scanning every course.
+MAX_CANDIDATE_FRACTION = 0.4
+
+# Most course ids a search is narrowed to, each bound as a parameter
+# of its own, which keeps the statement well within the 999
+# parameters SQLite builds before 3.32 allow. A power of two, since
+# the ids are padded to one (see __find_candidate_course_ids).
+MAX_CANDIDATE_IDS = 512
+
+# Most class details that get_classes_details looks up at once. Each
+# class takes two parameters, and SQLite builds before 3.32 allow at
+# most 999 parameters per statement.
+MAX_DETAILS_BATCH = 499
+
+# Number of rows iter_classes_with_condition fetches from the cursor
+# at a time by default.
+FETCH_SIZE = 256
+
+# The LIKE condition of each searchable field, in the order of the
+# fields of a Search (dept, number, area, title).
+_FIELD_CONDITIONS = (r"AND crosslistings.dept LIKE ? ESCAPE '\' ",
+    r"AND crosslistings.coursenum LIKE ? ESCAPE '\' ",
+    r"AND courses.area LIKE ? ESCAPE '\' ",
+    r"AND courses.title LIKE ? ESCAPE '\' ")
+
+# The condition of every shape of search, where bit i of the shape is
+# set if the search has field i.
+_CONDITIONS = tuple("".join(field_condition\
+    for bit, field_condition in enumerate(_FIELD_CONDITIONS)\
+    if shape & (1 << bit)) for shape in range(1 << 4))
+
+# (shape, number of ids) -> the condition of that shape narrowed to
+# the courses whose ids are given in that many more prepared values
+_INDEXED_CONDITIONS = {}
+
+# condition -> statement of iter_classes_with_condition
+_CLASSES_STATEMENTS = {}
+
+# Narrows a condition to the classes after a keyset cursor, in the
+# order of the results (see page.py).
+_AFTER_CONDITION = "AND (crosslistings.dept, crosslistings.coursenum, "\
+    + "classes.classid) > (?, ?, ?) "
+
+# Makes the LIKE wildcards and the escape character literal.
+_LIKE_ESCAPES = str.maketrans({"\\": r"\\", "_": r"\_", "%": r"\%"})
+
+#-----------------------------------------------------------------------
+
+def create_database_url(database_path):
+    """
+    Returns the SQLite URI that opens a database file read-only.
+
+    Keyword arguments:
+    database_path -- the path of the database file
+    """
+    return 'file:' + quote(database_path) + '?mode=ro'
+
+DATABASE_URL = create_database_url(DATABASE_PATH)
+
+#-----------------------------------------------------------------------
+
+def count_classes(database_url=DATABASE_URL):
+    """
+    Returns the number of class overviews (one per class and
+    crosslisting) in a registrar database, which checks that it can
+    be queried. Raises sqlite3.DatabaseError if it cannot.
+
+    Keyword arguments:
+    database_url -- the SQLite URI of the registrar database
+    """
+
+    with closing(connect(database_url, uri=True)) as connection:
+        return connection.execute("SELECT count(*) FROM classes, "\
+            + "courses, crosslistings "\
+            + "WHERE classes.courseid = courses.courseid "\
+            + "AND courses.courseid = crosslistings.courseid")\
+            .fetchone()[0]
 
 #-----------------------------------------------------------------------
 
@@ -26,69 +118,173 @@ def create_condition_and_prepared_values(search):
     Use the passed-in search to create a specific condition to be
     attached to the SQL query to ensure the proper query is carried
     out, and an list of the prepared values to accompany that condition.
-    Returns a tuple with (condition, prepared_values).
+    Returns a tuple with (condition, prepared_values). The condition
+    is one of a few precomputed ones, which only depends on the
+    fields the search has, so that the statements built from it can
+    be reused.
 
     Keyword arguments:
     search -- a Search object that contains all relevant search fields
     (e.g. area)
     """
-    condition = ""
-    escape = r"ESCAPE '\' "
+    fields = (search.get_dept(), search.get_number(), search.get_area(),
+        search.get_title())
 
+    shape = 0
     prepared_values = []
 
-    if search.get_dept() is not None:
-        dept = replace_wildcards_with_escape_chars(search.get_dept())
+    for bit, text in enumerate(fields):
+        if text is not None:
+            shape |= 1 << bit
+            prepared_values.append(create_like_pattern(text))
 
-        condition += "AND crosslistings.dept LIKE ? "
-        prepared_values.append("%" + dept + "%")
-        condition += escape
+    condition = _CONDITIONS[shape]
 
-    if search.get_number() is not None:
-        num = replace_wildcards_with_escape_chars(search.get_number())
+    if _search_index is not None:
+        course_ids = __find_candidate_course_ids(fields)
+        if course_ids is not None:
+            condition = __get_indexed_condition(shape,
+                len(course_ids))
+            prepared_values.extend(course_ids)
 
-        condition += "AND crosslistings.coursenum LIKE ? "
-        prepared_values.append("%" + num + "%")
-        condition += escape
+    return (condition, prepared_values)
 
-    if search.get_area() is not None:
-        area = replace_wildcards_with_escape_chars(search.get_area())
+#-----------------------------------------------------------------------
 
-        condition += "AND courses.area LIKE ? "
-        prepared_values.append("%" + area + "%")
-        condition += escape
+def __find_candidate_course_ids(fields):
+    # Returns the ids of the courses that the search index finds for
+    # the fields of a search, as a list, or None if the index does
+    # not narrow the search enough to be worth it.
+    course_ids = None
+
+    for index, text in zip(_search_index, fields):
+        if text is None:
+            continue
+
+        keys = index.candidates(create_like_pattern(text))
+        if keys is not None:
+            course_ids = keys if course_ids is None\
+                else course_ids & keys
+
+    if course_ids is None or len(course_ids) > MAX_CANDIDATE_IDS\
+        or len(course_ids) > MAX_CANDIDATE_FRACTION\
+        * max(len(index) for index in _search_index):
+        return None
+
+    # Padded to a power of two by repeating the last id, so searches
+    # share a few statements instead of one for every number of ids.
+    course_ids = sorted(course_ids)
+    size = 1
+    while size < len(course_ids):
+        size *= 2
+    return course_ids + course_ids[-1:] * (size - len(course_ids))
 
-    if search.get_title() is not None:
-        title = replace_wildcards_with_escape_chars(search.get_title())
+#-----------------------------------------------------------------------
 
-        condition += "AND courses.title LIKE ? "
-        prepared_values.append("%" + title + "%")
-        condition += escape
+def __get_indexed_condition(shape, count):
+    # Returns the condition of a shape of search narrowed to the
+    # courses whose ids are given in count more prepared values.
+    condition = _INDEXED_CONDITIONS.get((shape, count))
+    if condition is None:
+        condition = _CONDITIONS[shape]\
+            + "AND courses.courseid IN ("\
+            + ", ".join(["?"] * count) + ") "
+        _INDEXED_CONDITIONS[(shape, count)] = condition
+    return condition
 
-    return (condition, prepared_values)
+#-----------------------------------------------------------------------
+
+def build_search_index(database_url=DATABASE_URL):
+    """
+    Reads the searchable fields of every course from the database
+    and returns a tuple of NgramIndex objects of course ids for the
+    dept, coursenum, area and title fields, in that order, to be
+    installed with use_search_index.
+
+    Keyword arguments:
+    database_url -- the SQLite URI of the registrar database
+    """
+
+    with connect(database_url, uri=True) as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute("SELECT courseid, dept, coursenum "\
+                + "FROM crosslistings")
+            crosslistings = cursor.fetchall()
+
+            cursor.execute("SELECT courseid, area, title FROM courses")
+            courses = cursor.fetchall()
+
+    # NULL values never match LIKE, so they are left out
+    return tuple(NgramIndex((row[0], row[field]) for row in rows\
+            if row[field] is not None)\
+        for rows, field in ((crosslistings, 1), (crosslistings, 2),
+            (courses, 1), (courses, 2)))
 
 #-----------------------------------------------------------------------
 
-def replace_wildcards_with_escape_chars(text):
+def use_search_index(search_index):
     """
-    Adds escape character for wildcards (_ or %) to ensure that
-    they are interpreted as characters and not wildcards.
-    Returns the text created by adding escape character before
-    wildcards.
+    Makes create_condition_and_prepared_values narrow every search
+    to the courses that search_index finds, or stops narrowing if
+    search_index is None.
 
     Keyword arguments:
-    text -- string to be used with LIKE SQL command
+    search_index -- a tuple from build_search_index, or None
     """
+    global _search_index
+    _search_index = search_index
+
+#-----------------------------------------------------------------------
 
-    new_text = text
+def use_connection_pool(pool):
+    """
+    Makes the queries of requests take their connections from pool,
+    closing the idle connections of the pool used until now.
 
-    for index, char in enumerate(text):
-        if char == "_":
-            new_text = new_text[:index] + r"\_" + new_text[index + 1:]
-        elif char == "%":
-            new_text = new_text[:index] + r"\%" + new_text[index + 1:]
+    Keyword arguments:
+    pool -- a ConnectionPool of the registrar database
+    """
+    global _pool
+
+    if _pool is not None:
+        _pool.close()
+    _pool = pool
+
+#-----------------------------------------------------------------------
+
+def __get_pool():
+    global _pool
+
+    if _pool is None:
+        _pool = ConnectionPool(DATABASE_URL)
+    return _pool
+
+#-----------------------------------------------------------------------
+
+def create_like_pattern(text):
+    """
+    Returns the LIKE pattern (to be used with ESCAPE '\\') that
+    matches every value containing text.
+
+    Keyword arguments:
+    text -- one field of a Search
+    """
+    return "%" + replace_wildcards_with_escape_chars(text) + "%"
+
+#-----------------------------------------------------------------------
+
+def replace_wildcards_with_escape_chars(text):
+    """
+    Adds escape character for wildcards (_ or %), and for the escape
+    character itself, to ensure that they are interpreted as
+    characters and not wildcards. Returns the text created by adding
+    escape character before them, in one pass over text.
+
+    Keyword arguments:
+    text -- string to be used with LIKE SQL command
+    """
 
-    return new_text
+    return text.translate(_LIKE_ESCAPES)
 
 #-----------------------------------------------------------------------
 
@@ -102,24 +298,36 @@ def get_classes_with_condition(condition, prepared_values):
     prepared_values -- values that accompany given condition
     """
 
-    with connect(DATABASE_URL, uri=True) as connection:
+    classes = []
+
+    for chunk in iter_classes_with_condition(condition,
+        prepared_values):
+        classes += chunk
+
+    return classes
+
+#-----------------------------------------------------------------------
+
+def iter_classes_with_condition(condition, prepared_values,
+    chunk_size=FETCH_SIZE):
+    """
+    Prepares the SQL Query for the given condition and prepared
+    values then yields the results as lists of up to chunk_size
+    RegClass objects, in the order of get_classes_with_condition,
+    while the cursor produces them. The connection stays out of the
+    pool until the last chunk has been taken (or the generator is
+    closed).
+
+    Keyword arguments:
+    condition -- conditions to be added to the SQL query
+    prepared_values -- values that accompany given condition
+    chunk_size -- the largest number of classes in one chunk
+    """
+
+    with __get_pool().connection() as connection:
         with closing(connection.cursor()) as cursor:
 
-            # classes: courseid, classid
-            # courses: courseid, area, title
-            # crosslistings: courseid, dept, coursenum
-
-            # prepare query
-            stmt_str = "SELECT classes.classid, classes.courseid, "
-            stmt_str += "courses.courseid, courses.area, courses.title"
-            stmt_str += ", crosslistings.courseid, crosslistings.dept, "
-            stmt_str += "crosslistings.coursenum "
-            stmt_str += "FROM classes, courses, crosslistings "
-            stmt_str += "WHERE classes.courseid = courses.courseid "
-            stmt_str += "AND courses.courseid = crosslistings.courseid "
-            stmt_str += condition + " "
-            stmt_str += "ORDER BY crosslistings.dept, "
-            stmt_str += "crosslistings.coursenum, classes.classid ASC"
+            stmt_str = get_classes_statement(condition)
 
             # execute query
             if len(prepared_values) == 0:
@@ -127,20 +335,104 @@ def get_classes_with_condition(condition, prepared_values):
             else:
                 cursor.execute(stmt_str, prepared_values)
 
-            row = cursor.fetchone()
+            rows = cursor.fetchmany(chunk_size)
+
+            while rows:
+                yield __create_classes(rows)
+
+                rows = cursor.fetchmany(chunk_size)
+
+#-----------------------------------------------------------------------
+
+def get_classes_page(condition, prepared_values, after, limit):
+    """
+    Returns the first limit classes (as RegClass objects) of
+    get_classes_with_condition for the given condition and prepared
+    values that come after the class of the keyset cursor after (see
+    page.py), or the first limit classes if after is None. Only the
+    rows of the page are read into RegClass objects.
+
+    Keyword arguments:
+    condition -- conditions to be added to the SQL query
+    prepared_values -- values that accompany given condition
+    after -- a (dept, course number, class id) cursor, or None
+    limit -- the largest number of classes to return
+    """
+    prepared_values = list(prepared_values)
+    if after is not None:
+        condition += _AFTER_CONDITION
+        prepared_values += [after[0], after[1], int(after[2])]
+
+    with __get_pool().connection() as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(get_classes_statement(condition)\
+                + " LIMIT ?", prepared_values + [limit])
+            return __create_classes(cursor.fetchall())
+
+#-----------------------------------------------------------------------
+
+def count_classes_with_condition(condition, prepared_values):
+    """
+    Returns the number of classes that get_classes_with_condition
+    returns for the given condition and prepared values, without
+    reading them.
 
-            classes = []
+    Keyword arguments:
+    condition -- conditions to be added to the SQL query
+    prepared_values -- values that accompany given condition
+    """
+    stmt_str = "SELECT count(*) "
+    stmt_str += "FROM classes, courses, crosslistings "
+    stmt_str += "WHERE classes.courseid = courses.courseid "
+    stmt_str += "AND courses.courseid = crosslistings.courseid "
+    stmt_str += condition
 
-            while row is not None:
-                # 0 = class id; 1, 2, 5 = course id; 3 = area;
-                # #4 = title; 6 = dept; 7 = coursenum
-                classes.append(RegClass([str(row[0]),\
-                    str(row[6]), str(row[7]), str(row[3]),\
-                    str(row[4])]))
+    with __get_pool().connection() as connection:
+        return connection.execute(stmt_str, prepared_values)\
+            .fetchone()[0]
 
-                row = cursor.fetchone()
+#-----------------------------------------------------------------------
 
-            return classes
+def __create_classes(rows):
+    # TEXT columns hold strings or NULL; NULLs are only possible for
+    # fields that the search leaves out
+    return [RegClass(row) if None not in row\
+        else RegClass([str(value) for value in row]) for row in rows]
+
+#-----------------------------------------------------------------------
+
+def get_classes_statement(condition):
+    """
+    Returns the SQL statement of iter_classes_with_condition for the
+    given condition. The same condition always gives the same string,
+    built only the first time, so sqlite3 prepares the statement
+    once per connection and reuses it afterwards.
+
+    Keyword arguments:
+    condition -- a condition from create_condition_and_prepared_values
+    """
+    stmt_str = _CLASSES_STATEMENTS.get(condition)
+    if stmt_str is not None:
+        return stmt_str
+
+    # classes: courseid, classid
+    # courses: courseid, area, title
+    # crosslistings: courseid, dept, coursenum
+
+    # the columns are those of a RegClass, so each row becomes one
+    # without being copied
+    stmt_str = "SELECT CAST(classes.classid AS TEXT), "
+    stmt_str += "crosslistings.dept, crosslistings.coursenum, "
+    stmt_str += "courses.area, courses.title "
+    stmt_str += "FROM classes, courses, crosslistings "
+    stmt_str += "WHERE classes.courseid = courses.courseid "
+    stmt_str += "AND courses.courseid = crosslistings.courseid "
+    stmt_str += condition + " "
+    stmt_str += "ORDER BY crosslistings.dept, "
+    stmt_str += "crosslistings.coursenum, classes.classid ASC"
+
+    _CLASSES_STATEMENTS[condition] = stmt_str
+    return stmt_str
 
 #-----------------------------------------------------------------------
 
@@ -149,103 +441,145 @@ def get_class_details(class_id):
     Prepares the SQL Query for the given class id
     then query the database to construct the results as a
     a RegClassDetails. Returns that RegClassDetails object.
+    Raises ValueError if there is no class with that id.
 
     Keyword arguments:
     class_id - the id of the class to request the details for
     """
 
-    with connect(DATABASE_URL, uri=True) as connection:
+    class_details = get_classes_details([class_id])[0]
+
+    if class_details is None:
+        raise ValueError("no class with class id " +\
+                        str(class_id) + " exists")
+
+    return class_details
+
+#-----------------------------------------------------------------------
+
+def get_classes_details(class_ids):
+    """
+    Queries the database for the details of many classes at once,
+    with three statements in total no matter how many classes are
+    asked for. Returns a list with a RegClassDetails for each class
+    id, in the same order, or None for ids of classes that do not
+    exist.
+
+    Keyword arguments:
+    class_ids - the ids of the classes to request the details for,
+        at most MAX_DETAILS_BATCH of them
+    """
+
+    if len(class_ids) > MAX_DETAILS_BATCH:
+        raise ValueError("at most " + str(MAX_DETAILS_BATCH)\
+            + " class details can be requested at once")
+
+    if not class_ids:
+        return []
+
+    with __get_pool().connection() as connection:
         with closing(connection.cursor()) as cursor:
 
-            # query classes variables
-            stmt_str = "SELECT classid, courseid, days, starttime, "\
-                + "endtime, bldg, roomnum "\
-                + "FROM classes WHERE classid = ? "
-            cursor.execute(stmt_str, [class_id])
+            # classes and courses variables, joined with the
+            # requested ids so that every id is looked up in one
+            # pass over classes (which has no index on classid)
+            stmt_str = "WITH requested(position, classid) AS "\
+                + "(VALUES " + ", ".join(["(?, ?)"] * len(class_ids))\
+                + ") "\
+                + "SELECT requested.position, classes.courseid, "\
+                + "classes.days, classes.starttime, classes.endtime, "\
+                + "classes.bldg, classes.roomnum, courses.area, "\
+                + "courses.title, courses.descrip, courses.prereqs "\
+                + "FROM requested, classes LEFT OUTER JOIN courses "\
+                + "ON courses.courseid = classes.courseid "\
+                + "WHERE classes.classid = requested.classid"
 
-            classes_row = cursor.fetchone()
+            prepared_values = []
+            for position, class_id in enumerate(class_ids):
+                prepared_values += [position, class_id]
 
-            if classes_row is None:
-                raise ValueError("no class with class id " +\
-                                str(class_id) + " exists")
+            cursor.execute(stmt_str, prepared_values)
 
-            class_details = []
+            rows = [None] * len(class_ids)
+            course_ids = set()
 
-            # course id
-            course_id = str(classes_row[1])
-            class_details.append(course_id)
-            # days
-            class_details.append(str(classes_row[2]))
-            # starttime
-            class_details.append(str(classes_row[3]))
-            # endtime
-            class_details.append(str(classes_row[4]))
-            # bldg
-            class_details.append(str(classes_row[5]))
-            # roomnum
-            class_details.append(str(classes_row[6]))
+            for row in cursor:
+                # only the first matching class, like fetchone()
+                if rows[row[0]] is None:
+                    rows[row[0]] = row
+                    course_ids.add(row[1])
 
-            # crosslisting variables
-            stmt_str = "SELECT courseid, dept, coursenum "\
-                + "FROM crosslistings WHERE "\
-                + "crosslistings.courseid = ? "\
-                + "ORDER BY dept, coursenum ASC"
+            course_ids = list(course_ids)
+            crosslistings = __get_crosslistings(cursor, course_ids)
+            prof_names = __get_prof_names(cursor, course_ids)
 
-            cursor.execute(stmt_str, [course_id])
+            details = []
 
-            cl_row = cursor.fetchone()
+            for row in rows:
+                if row is None:
+                    details.append(None)
+                    continue
 
-            cl_details = []
+                # course id, days, starttime, endtime, bldg, roomnum
+                class_details = [str(value) for value in row[1:7]]
 
-            depts = []
-            course_nums = []
+                # area, title, descrip, prereqs
+                courses_details = [str(value) for value in row[7:11]]
 
-            while cl_row is not None:
-                depts.append(str(cl_row[1]))
-                course_nums.append(str(cl_row[2]))
+                depts, course_nums = crosslistings.get(row[1],\
+                    ([], []))
 
-                cl_row = cursor.fetchone()
+                details.append(RegClassDetails(class_details,
+                    [list(depts), list(course_nums)], courses_details,
+                    list(prof_names.get(row[1], []))))
 
-            cl_details = [depts, course_nums]
+            return details
 
-            # courses variables
+#-----------------------------------------------------------------------
 
-            stmt_str = "SELECT courseid, area, title, descrip, "\
-                + "prereqs FROM courses WHERE courseid = ? "
+def __get_crosslistings(cursor, course_ids):
+    # Returns a dictionary from each of the course ids to its
+    # ([depts], [course nums]), sorted by dept and course number.
+    crosslistings = {}
 
-            cursor.execute(stmt_str, [course_id])
-            courses_row = cursor.fetchone()
+    if not course_ids:
+        return crosslistings
 
-            courses_details = []
+    stmt_str = "SELECT courseid, dept, coursenum "\
+        + "FROM crosslistings WHERE crosslistings.courseid IN ("\
+        + ", ".join(["?"] * len(course_ids)) + ") "\
+        + "ORDER BY courseid, dept, coursenum ASC"
 
-            # area
-            courses_details.append(str(courses_row[1]))
-            #title
-            courses_details.append(str(courses_row[2]))
-            # descrip
-            courses_details.append(str(courses_row[3]))
-            # prereqs
-            courses_details.append(str(courses_row[4]))
+    cursor.execute(stmt_str, course_ids)
 
-            # professor variables
+    for cl_row in cursor:
+        depts, course_nums = crosslistings.setdefault(cl_row[0],\
+            ([], []))
+        depts.append(str(cl_row[1]))
+        course_nums.append(str(cl_row[2]))
+
+    return crosslistings
+
+#-----------------------------------------------------------------------
 
-            stmt_str = "SELECT coursesprofs.courseid, "\
-                + "coursesprofs.profid, "\
-                + "profs.profid, profs.profname "\
-                + "FROM coursesprofs, profs WHERE "\
-                + "coursesprofs.courseid = ? "\
-                + "AND profs.profid = coursesprofs.profid "\
-                + "ORDER BY profs.profname ASC"
+def __get_prof_names(cursor, course_ids):
+    # Returns a dictionary from each of the course ids to the names of
+    # its professors, sorted by name.
+    prof_names = {}
 
-            cursor.execute(stmt_str, [course_id])
-            prof_row = cursor.fetchone()
+    if not course_ids:
+        return prof_names
 
-            prof_names = []
+    stmt_str = "SELECT coursesprofs.courseid, profs.profname "\
+        + "FROM coursesprofs, profs WHERE "\
+        + "coursesprofs.courseid IN ("\
+        + ", ".join(["?"] * len(course_ids)) + ") "\
+        + "AND profs.profid = coursesprofs.profid "\
+        + "ORDER BY coursesprofs.courseid, profs.profname ASC"
 
-            while prof_row is not None:
-                prof_names.append(prof_row[3])
+    cursor.execute(stmt_str, course_ids)
 
-                prof_row = cursor.fetchone()
+    for prof_row in cursor:
+        prof_names.setdefault(prof_row[0], []).append(prof_row[1])
 
-            return RegClassDetails(class_details, cl_details,
-                courses_details, prof_names)
+    return prof_names
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# likepattern.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Evaluates the LIKE patterns built by
+database.create_like_pattern in Python, with the same rules as
+SQLite's LIKE with ESCAPE '\\'. Such a pattern is the text of a
+search field, with every '_', '%' and escape character escaped,
+between two '%': a value matches it if it contains the text, and
+only ASCII letters are compared case-insensitively. Since these
+patterns never contain an unescaped '_', that wildcard is not
+supported.
+"""
+
+from string import ascii_lowercase, ascii_uppercase
+
+#-----------------------------------------------------------------------
+
+# LIKE only ignores the case of ASCII letters, so only fold those.
+_ASCII_FOLD = str.maketrans(ascii_uppercase, ascii_lowercase)
+
+# The token of a parsed pattern that stands for '%'.
+ANY_RUN = object()
+
+#-----------------------------------------------------------------------
+
+def fold_case(text):
+    """
+    Returns text with its ASCII letters lowercased, which is how
+    SQLite's LIKE compares text.
+
+    Keyword arguments:
+    text -- the string to fold
+    """
+    return text.translate(_ASCII_FOLD)
+
+#-----------------------------------------------------------------------
+
+def parse_like_pattern(pattern):
+    """
+    Splits a LIKE pattern into tokens: a case-folded literal
+    character, or ANY_RUN for '%'. Returns None for a pattern that
+    ends with an unfinished escape, which SQLite never matches.
+    Raises ValueError for an unescaped '_', which SQLite would match
+    to any one character but create_like_pattern never produces.
+
+    Keyword arguments:
+    pattern -- a LIKE pattern, e.g. from create_like_pattern
+    """
+    tokens = []
+
+    chars = iter(fold_case(pattern))
+    for char in chars:
+        if char == "\\":
+            char = next(chars, None)
+            if char is None:
+                return None
+            tokens.append(char)
+        elif char == "%":
+            tokens.append(ANY_RUN)
+        elif char == "_":
+            raise ValueError("'_' wildcards are not supported: "\
+                + pattern)
+        else:
+            tokens.append(char)
+
+    return tokens
+
+#-----------------------------------------------------------------------
+
+def create_like_matcher(pattern):
+    """
+    Returns a function that tells whether a case-folded value
+    matches pattern, which is whether it contains the text between
+    the '%' that pattern starts and ends with. Raises ValueError for
+    any other kind of pattern.
+
+    Keyword arguments:
+    pattern -- a LIKE pattern from create_like_pattern
+    """
+    tokens = parse_like_pattern(pattern)
+    if tokens is None:
+        return lambda value: False
+
+    inner = tokens[1:-1]
+    if len(tokens) < 2 or tokens[0] is not ANY_RUN\
+        or tokens[-1] is not ANY_RUN\
+        or any(token is ANY_RUN for token in inner):
+        raise ValueError("not a pattern of create_like_pattern: "\
+            + pattern)
+
+    substring = "".join(inner)
+    return lambda value: substring in value
+
+#-----------------------------------------------------------------------
+
+def literal_runs(pattern):
+    """
+    Returns the runs of literal characters of a LIKE pattern, which
+    every matching (case-folded) value must contain, or None if the
+    pattern can never match.
+
+    Keyword arguments:
+    pattern -- a LIKE pattern, e.g. from create_like_pattern
+    """
+    tokens = parse_like_pattern(pattern)
+    if tokens is None:
+        return None
+
+    runs = []
+    run = ""
+    for token in tokens:
+        if isinstance(token, str):
+            run += token
+        else:
+            if run:
+                runs.append(run)
+            run = ""
+    if run:
+        runs.append(run)
+
+    return runs
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# loadsim.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Simulates the latency of a slower backend
+before the server answers a request, so that the server can be
+benchmarked against realistic latency profiles. Each command gets a
+latency distribution: a fixed number of seconds, a uniform range or
+an exponential distribution with a given mean.
+
+By default the simulated latency is spent sleeping, like a request
+that waits on another service, so that it costs no CPU time and the
+server's capacity can be measured honestly. For comparison, the
+latency can instead be spent burning CPU time in a busy loop, as the
+original server did.
+"""
+
+import random
+from time import monotonic, sleep, process_time
+
+#-----------------------------------------------------------------------
+
+# Seconds between checks of whether the request has been cancelled
+# while sleeping, and iterations of the busy loop between them.
+CANCEL_CHECK_SECONDS = 0.01
+CANCEL_CHECK_INTERVAL = 10000
+
+# The key of the latency of commands without one of their own.
+DEFAULT_COMMAND = '*'
+
+#-----------------------------------------------------------------------
+
+class FixedLatency:
+    """
+    The same latency every time.
+    """
+
+    def __init__(self, seconds):
+        if seconds < 0:
+            raise ValueError("latency must not be negative")
+        self._seconds = seconds
+
+    def __str__(self):
+        return 'fixed:' + format(self._seconds, 'g')
+
+    def sample(self):
+        """
+        Returns the number of seconds of one latency.
+        """
+        return self._seconds
+
+#-----------------------------------------------------------------------
+
+class UniformLatency:
+    """
+    A latency drawn uniformly from [low, high] seconds.
+    """
+
+    def __init__(self, low, high):
+        if not 0 <= low <= high:
+            raise ValueError("uniform latency needs 0 <= low <= high")
+        self._low = low
+        self._high = high
+
+    def __str__(self):
+        return 'uniform:' + format(self._low, 'g') + ':'\
+            + format(self._high, 'g')
+
+    def sample(self):
+        """
+        Returns the number of seconds of one latency.
+        """
+        return random.uniform(self._low, self._high)
+
+#-----------------------------------------------------------------------
+
+class ExponentialLatency:
+    """
+    A latency drawn from an exponential distribution with a mean of
+    mean seconds, which models the long tail of real latencies.
+    """
+
+    def __init__(self, mean):
+        if mean < 0:
+            raise ValueError("latency must not be negative")
+        self._mean = mean
+
+    def __str__(self):
+        return 'exp:' + format(self._mean, 'g')
+
+    def sample(self):
+        """
+        Returns the number of seconds of one latency.
+        """
+        if self._mean == 0:
+            return 0.0
+        return random.expovariate(1 / self._mean)
+
+#-----------------------------------------------------------------------
+
+def parse_latency(text):
+    """
+    Returns the latency distribution described by text: fixed:SECONDS
+    (or just SECONDS), uniform:LOW:HIGH or exp:MEAN. Raises
+    ValueError if text describes none.
+
+    Keyword arguments:
+        text -- the description of the distribution
+    """
+    kind, _, arguments = text.partition(':')
+
+    try:
+        if not arguments:
+            return FixedLatency(float(kind))
+
+        numbers = [float(number) for number in arguments.split(':')]
+        if kind == 'fixed' and len(numbers) == 1:
+            return FixedLatency(numbers[0])
+        if kind == 'uniform' and len(numbers) == 2:
+            return UniformLatency(numbers[0], numbers[1])
+        if kind == 'exp' and len(numbers) == 1:
+            return ExponentialLatency(numbers[0])
+    except ValueError as ex:
+        raise ValueError("invalid latency " + text + ": " + str(ex))\
+            from ex
+
+    raise ValueError("invalid latency " + text + " (use SECONDS, "\
+        + "fixed:SECONDS, uniform:LOW:HIGH or exp:MEAN)")
+
+#-----------------------------------------------------------------------
+
+class LatencySimulator:
+    """
+    Simulates the latency of each command of the protocol. latencies
+    maps commands (or DEFAULT_COMMAND) to latency distributions;
+    commands with neither get no latency. If cpu_bound is set, the
+    latency is spent burning CPU time instead of sleeping.
+
+    A simulator is copied into every worker process. Latencies are
+    drawn from the generator of the random module, which reseeds
+    itself in forked children, so workers do not draw the same
+    latencies.
+    """
+
+    def __init__(self, latencies, cpu_bound=False):
+        self._latencies = dict(latencies)
+        self._cpu_bound = cpu_bound
+
+    def __str__(self):
+        return ', '.join(command + '=' + str(latency)\
+            for command, latency in self._latencies.items())\
+            + (' (CPU-bound)' if self._cpu_bound else '')
+
+    def simulate(self, command, cancelled=None):
+        """
+        Spends the latency of one request of command. Returns False if
+        the request was cancelled before the latency was over, and
+        True otherwise.
+
+        Keyword arguments:
+            command -- one of the commands in protocol.py
+            cancelled -- a function that tells whether the client has
+                cancelled the request, or None
+        """
+        latency = self._latencies.get(command,
+            self._latencies.get(DEFAULT_COMMAND))
+        if latency is None:
+            return True
+
+        seconds = latency.sample()
+        if seconds <= 0:
+            return True
+
+        if self._cpu_bound:
+            return _burn_cpu_time(seconds, cancelled)
+        return _sleep(seconds, cancelled)
+
+#-----------------------------------------------------------------------
+
+def _sleep(seconds, cancelled):
+    if cancelled is None:
+        sleep(seconds)
+        return True
+
+    deadline = monotonic() + seconds
+    while True:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return True
+        sleep(min(remaining, CANCEL_CHECK_SECONDS))
+        if cancelled():
+            return False
+
+#-----------------------------------------------------------------------
+
+# taken from class pennyserver.py
+def _burn_cpu_time(seconds, cancelled):
+
+    i = 0
+    initial_time = process_time()
+    while (process_time() - initial_time) < seconds:
+        i += 1  # Do a nonsensical computation.
+
+        # stop early if the client has cancelled the request
+        if cancelled is not None and i % CANCEL_CHECK_INTERVAL == 0\
+            and cancelled():
+            return False
+
+    return True
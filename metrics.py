@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# metrics.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Histograms of how long each stage (span)
+of a request takes, shared by every process of the server, and
+rendered in the Prometheus text format for the METRICS command.
+
+The spans of a request are dispatch (from reading the request until
+a worker starts executing it), decode (decoding the request), delay
+(the simulated latency, see loadsim.py), query (computing the
+result: the SQL queries or searches, and building the RegClass and
+RegClassDetails objects, which happens as the rows are read), encode
+(encoding the responses), send (writing them to the socket) and
+total (from reading the request until its last response is sent).
+Connections have an accept span of their own: from accepting the
+connection until the protocol it speaks is known.
+"""
+
+from bisect import bisect_left
+from multiprocessing import get_context
+from protocol import GET_OVERVIEWS, GET_OVERVIEWS_PAGE,\
+    STREAM_OVERVIEWS, GET_DETAIL, GET_DETAILS, CACHE_STATS, METRICS
+
+#-----------------------------------------------------------------------
+
+REQUEST_SPANS = ('dispatch', 'decode', 'delay', 'query', 'encode',
+    'send', 'total')
+ACCEPT_SPAN = 'accept'
+
+# The commands that get histograms; requests of other commands are
+# not measured.
+COMMANDS = (GET_OVERVIEWS, GET_OVERVIEWS_PAGE, STREAM_OVERVIEWS,
+    GET_DETAIL, GET_DETAILS, CACHE_STATS, METRICS)
+
+# The upper bounds (in seconds) of the buckets of every histogram,
+# besides +Inf.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Each histogram takes a count per bucket (the last for +Inf) and the
+# sum of its observations.
+_SERIES_SIZE = len(BUCKETS) + 2
+
+# (command, span) of every histogram, by position in the array; the
+# accept histogram has no command.
+_SERIES = [(None, ACCEPT_SPAN)] + [(command, span)\
+    for command in COMMANDS for span in REQUEST_SPANS]
+_POSITIONS = {series: position for position, series\
+    in enumerate(_SERIES)}
+
+#-----------------------------------------------------------------------
+
+class Metrics:
+    """
+    The span histograms of the server, in one array of shared memory
+    with one lock. A Metrics object is created once, in the main
+    process, with the multiprocessing context of the worker
+    processes (the default one if context is None), and given to
+    every worker when it is started.
+    """
+
+    def __init__(self, context=None):
+        if context is None:
+            context = get_context()
+        self._array = context.Array('d', len(_SERIES) * _SERIES_SIZE)
+
+    def observe(self, command, spans):
+        """
+        Records how long the spans of one request (or connection)
+        took, taking the lock once.
+
+        Keyword arguments:
+            command -- the command of the request, or None for the
+                accept span of a connection
+            spans -- an iterable of (span, seconds) tuples
+        """
+        positions = []
+        for span, seconds in spans:
+            position = _POSITIONS.get((command, span))
+            if position is not None:
+                positions.append((position * _SERIES_SIZE, seconds))
+        if not positions:
+            return
+
+        with self._array.get_lock():
+            array = self._array.get_obj()
+            for start, seconds in positions:
+                array[start + bisect_left(BUCKETS, seconds)] += 1
+                array[start + _SERIES_SIZE - 1] += seconds
+
+    def render(self):
+        """
+        Returns the histograms that have observations in the
+        Prometheus text exposition format.
+        """
+        with self._array.get_lock():
+            values = self._array[:]
+
+        lines = ['# HELP reg_accept_seconds Time from accepting a '\
+            + 'connection until its protocol is known.',
+            '# TYPE reg_accept_seconds histogram']
+        lines += _render_series(values, 0, 'reg_accept_seconds', '')
+
+        lines += ['# HELP reg_request_span_seconds Time each span '\
+            + 'of a request took.',
+            '# TYPE reg_request_span_seconds histogram']
+        for position, (command, span) in enumerate(_SERIES[1:], 1):
+            lines += _render_series(values, position,
+                'reg_request_span_seconds',
+                'command="' + command + '",span="' + span + '"')
+
+        return '\n'.join(lines) + '\n'
+
+#-----------------------------------------------------------------------
+
+def _render_series(values, position, name, labels):
+    start = position * _SERIES_SIZE
+    counts = values[start:start + _SERIES_SIZE - 1]
+    total = sum(counts)
+    if total == 0:
+        return []
+
+    lines = []
+    separator = ',' if labels else ''
+    cumulative = 0
+    for bound, count in zip(BUCKETS + ('+Inf',), counts):
+        cumulative += count
+        lines.append(name + '_bucket{' + labels + separator + 'le="'\
+            + str(bound) + '"} ' + format(cumulative, '.0f'))
+
+    braces = '{' + labels + '}' if labels else ''
+    lines.append(name + '_sum' + braces + ' '\
+        + repr(values[start + _SERIES_SIZE - 1]))
+    lines.append(name + '_count' + braces + ' ' + format(total, '.0f'))
+    return lines
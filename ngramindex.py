@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# ngramindex.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. An n-gram index over the values of one
+searchable field, used to narrow a LIKE search down to the few
+values that can possibly match before the exact pattern is checked.
+"""
+
+from likepattern import fold_case, literal_runs
+
+#-----------------------------------------------------------------------
+
+# Longest n-grams that are indexed. Literal runs of up to this many
+# characters are looked up directly; longer ones are narrowed with
+# all of their trigrams.
+MAX_N = 3
+
+_NO_KEYS = frozenset()
+
+#-----------------------------------------------------------------------
+
+class NgramIndex:
+    """
+    Maps every substring of one to MAX_N characters of a set of
+    case-folded values to the set of keys of the values that contain
+    it. The keys can be anything hashable, e.g. course ids or row
+    numbers.
+    """
+
+    def __init__(self, items):
+        """
+        Keyword arguments:
+        items -- iterable of (key, value) pairs; a key may appear
+            with several values
+        """
+        self._postings = {}
+        self._keys = set()
+
+        for key, value in items:
+            self._keys.add(key)
+            value = fold_case(value)
+            grams = {value[start:start + n]\
+                for n in range(1, MAX_N + 1)\
+                for start in range(len(value) - n + 1)}
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def candidates(self, pattern):
+        """
+        Returns the set of keys whose values may match the LIKE
+        pattern (a superset of the keys whose values do match), or
+        None if the pattern has no literal characters to narrow the
+        search with.
+
+        Keyword arguments:
+        pattern -- a LIKE pattern, e.g. from create_like_pattern
+        """
+        runs = literal_runs(pattern)
+        if runs is None:
+            return set()
+
+        grams = set()
+        for run in runs:
+            if len(run) <= MAX_N:
+                grams.add(run)
+            else:
+                grams.update(run[start:start + MAX_N]\
+                    for start in range(len(run) - MAX_N + 1))
+
+        if not grams:
+            return None
+
+        # intersect the shortest posting sets first
+        postings = sorted((self._postings.get(gram, _NO_KEYS)\
+            for gram in grams), key=len)
+
+        keys = set(postings[0])
+        for posting in postings[1:]:
+            if not keys:
+                break
+            keys &= posting
+
+        return keys
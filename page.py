@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# page.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module shared by the client and the server. A class list can be
+requested a page at a time (GET_OVERVIEWS_PAGE) instead of all at
+once, so that the size and the time of a response are bounded by
+the page rather than by the number of classes that match.
+
+Pages are found with a keyset cursor instead of an offset: a
+PageQuery asks for the classes that come after a given class in the
+order of search results (dept, course number, then class id as a
+number). The database reads the page as a range of that order
+without counting the rows before it, and a page never repeats or
+skips classes because the classes before it have changed.
+"""
+
+from search import Search
+
+#-----------------------------------------------------------------------
+
+# The number of classes of a page, unless a PageQuery asks for
+# another number, and the largest number it may ask for.
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+#-----------------------------------------------------------------------
+
+def get_cursor(regclass):
+    """
+    Returns the keyset cursor of regclass: its (dept, course number,
+    class id) tuple, which a PageQuery for the classes after it
+    takes.
+
+    Keyword arguments:
+        regclass -- a RegClass of a search result
+    """
+    return (regclass.get_dept(), regclass.get_course_num(),
+        regclass.get_class_id())
+
+#-----------------------------------------------------------------------
+
+def get_sort_key(cursor):
+    """
+    Returns the key by which the class of cursor sorts among the
+    results of a search, like ORDER BY dept, coursenum, classid.
+
+    Keyword arguments:
+        cursor -- a cursor of get_cursor
+    """
+    dept, course_num, class_id = cursor
+    return (dept, course_num, int(class_id))
+
+#-----------------------------------------------------------------------
+
+class PageQuery:
+    """
+    A request for a page of the classes that match a Search: at most
+    limit classes that come after the class of the cursor after (or
+    the first ones, if after is None), and, if count_total is set,
+    the number of classes that match in all.
+    """
+
+    def __init__(self, search, after=None, limit=PAGE_SIZE,
+        count_total=False):
+        if not isinstance(search, Search):
+            raise ValueError("a page query needs a Search")
+        if isinstance(limit, bool) or not isinstance(limit, int)\
+            or not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError("the limit of a page must be from 1 to "\
+                + str(MAX_PAGE_SIZE))
+        if after is not None:
+            after = tuple(after)
+            if len(after) != 3\
+                or not all(isinstance(field, str) for field in after)\
+                or not after[2].isascii()\
+                or not after[2].isdecimal():
+                raise ValueError("the cursor of a page must be a "\
+                    + "dept, a course number and a class id")
+
+        self._search = search
+        self._after = after
+        self._limit = limit
+        self._count_total = bool(count_total)
+
+    def get_key(self):
+        """
+        Returns a tuple that page queries with the same page of the
+        same results share.
+        """
+        return (self._search.get_key(), self._after, self._limit,
+            self._count_total)
+
+    def get_search(self):
+        """
+        Returns the Search of the page query.
+        """
+        return self._search
+
+    def get_after(self):
+        """
+        Returns the cursor of the class the page comes after, or None
+        for the first page.
+        """
+        return self._after
+
+    def get_limit(self):
+        """
+        Returns the largest number of classes of the page.
+        """
+        return self._limit
+
+    def get_count_total(self):
+        """
+        Returns whether the page should tell the number of classes
+        that match in all.
+        """
+        return self._count_total
+
+    def get_next(self, page):
+        """
+        Returns the PageQuery of the page that follows page, the
+        answer to this query, or None if page is the last one. The
+        total is only counted once.
+
+        Keyword arguments:
+            page -- the Page that answered this query
+        """
+        if not page.has_more() or not page.get_classes():
+            return None
+        return PageQuery(self._search, get_cursor(
+            page.get_classes()[-1]), self._limit)
+
+#-----------------------------------------------------------------------
+
+class Page:
+    """
+    A page of a search result: a list of RegClass objects, whether
+    more classes follow it and the number of classes that match in
+    all (None unless the PageQuery asked for it).
+    """
+
+    def __init__(self, classes, more, total=None):
+        self._classes = classes
+        self._more = more
+        self._total = total
+
+    def get_classes(self):
+        """
+        Returns the list of RegClass objects of the page.
+        """
+        return self._classes
+
+    def has_more(self):
+        """
+        Returns whether more classes follow the page.
+        """
+        return self._more
+
+    def get_total(self):
+        """
+        Returns the number of classes that match in all, or None.
+        """
+        return self._total
+
+#-----------------------------------------------------------------------
+
+def get_page(classes, query):
+    """
+    Returns the Page that answers query from the whole result of its
+    search.
+
+    Keyword arguments:
+        classes -- the list of RegClass objects that match the
+            search of query, in the order of search results
+        query -- a PageQuery
+    """
+    # the page starts after the last class that sorts no later than
+    # the cursor, found by bisection (bisect_right only takes a key
+    # since Python 3.10)
+    start = 0
+    if query.get_after() is not None:
+        after = get_sort_key(query.get_after())
+        high = len(classes)
+        while start < high:
+            middle = (start + high) // 2
+            if after < get_sort_key(get_cursor(classes[middle])):
+                high = middle
+            else:
+                start = middle + 1
+
+    end = start + query.get_limit()
+    total = len(classes) if query.get_count_total() else None
+    return Page(classes[start:end], end < len(classes), total)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# protocol.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module shared by the client and the server. Defines the framed
+protocol that lets one persistent connection carry many requests.
+
+A framed client starts its connection with a magic number that names
+the version of the protocol, which is also the encoding of its
+messages (see codec.py): JSON_MAGIC for the schema-defined JSON
+encoding, or PICKLE_MAGIC for pickles. After that, every message in
+either direction is a frame: a 4-byte big-endian length followed by
+that many bytes of encoded message. A request is a (request_id,
+command, payload) tuple and its response is a (request_id,
+successful, data) tuple with the same request id, so responses may
+arrive in any order. Most requests get exactly one response; a
+STREAM_OVERVIEWS request gets a response for every chunk of its
+class list, each with a (classes, last) tuple as data, until the
+last chunk or an error. A GET_OVERVIEWS_PAGE request, whose payload
+is a PageQuery, gets a Page of a class list (see page.py), so that a
+client can fetch a long list as it is scrolled. A CANCEL request,
+whose payload is the id of an earlier request, asks the server to
+abandon that request and not answer it any further; CANCEL itself
+is never answered.
+
+Connections that do not start with a magic number use the original
+protocol: the client sends two pickles (whether the request is a
+search, and a Search or class id), the server answers with two
+pickles (whether the request succeeded, and the data or error
+message) and closes the connection. A pickle stream never starts
+with a b'R' byte, so the protocols can be told apart from the first
+byte.
+"""
+
+from struct import Struct
+from socket import MSG_PEEK
+
+#-----------------------------------------------------------------------
+
+# version 1: pickled messages; version 2: JSON messages
+PICKLE_MAGIC = b'REG1'
+JSON_MAGIC = b'REG2'
+MAGIC_SIZE = 4
+
+GET_OVERVIEWS = 'get_overviews'
+GET_OVERVIEWS_PAGE = 'get_overviews_page'
+STREAM_OVERVIEWS = 'stream_overviews'
+GET_DETAIL = 'get_detail'
+GET_DETAILS = 'get_details'
+CACHE_STATS = 'cache_stats'
+METRICS = 'metrics'
+CANCEL = 'cancel'
+
+SERVER_ERROR_MESSAGE = 'A server error occurred. '\
+    + 'Please contact the system administrator.'
+
+# The error message of a request that the server shed because it was
+# too busy to work on it (see admission.py); the client may try it
+# again later.
+SERVER_BUSY_MESSAGE = 'The server is busy. Please try again.'
+
+# Largest frame body (in bytes) either side is willing to read.
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+HEADER = Struct('!I')
+
+#-----------------------------------------------------------------------
+
+def legacy_command(request_type_is_search):
+    """
+    Returns the command that a request of the original protocol
+    stands for.
+
+    Keyword arguments:
+    request_type_is_search -- the first pickle of an original request
+    """
+    return GET_OVERVIEWS if request_type_is_search else GET_DETAIL
+
+#-----------------------------------------------------------------------
+
+def encode_frame(body):
+    """
+    Returns the bytes of a frame holding body.
+
+    Keyword arguments:
+    body -- an encoded request or response
+    """
+    return HEADER.pack(len(body)) + body
+
+#-----------------------------------------------------------------------
+
+def decode_frame_length(header):
+    """
+    Returns the body length stored in the HEADER.size bytes of a frame
+    header, raising ValueError if it is larger than MAX_FRAME_SIZE.
+
+    Keyword arguments:
+    header -- the first HEADER.size bytes of a frame
+    """
+    length = HEADER.unpack(header)[0]
+    if length > MAX_FRAME_SIZE:
+        raise ValueError("frame of " + str(length) + " bytes is larger"\
+            + " than " + str(MAX_FRAME_SIZE) + " bytes")
+    return length
+
+#-----------------------------------------------------------------------
+
+def read_frame(read_flo):
+    """
+    Reads one frame from the binary file-like object read_flo and
+    returns its body, or None if the connection was closed between
+    frames.
+
+    Keyword arguments:
+    read_flo -- a binary file-like object made from a socket
+    """
+    header = read_flo.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise EOFError("connection closed in the middle of a frame")
+
+    length = decode_frame_length(header)
+    body = read_flo.read(length)
+    if len(body) < length:
+        raise EOFError("connection closed in the middle of a frame")
+
+    return body
+
+#-----------------------------------------------------------------------
+
+def is_framed(first):
+    """
+    Returns whether a connection whose first byte is first uses the
+    framed protocol.
+
+    Keyword arguments:
+    first -- the first byte sent by the client, as bytes
+    """
+    return first == JSON_MAGIC[:1]
+
+#-----------------------------------------------------------------------
+
+def recv_frame(sock):
+    """
+    Receives one frame from sock and returns its body, or None if the
+    connection was closed between frames. Unlike read_frame, it never
+    receives more than the frame, so that the connection can be
+    handed to another process between frames.
+
+    Keyword arguments:
+    sock -- a blocking socket
+    """
+    header = _recv_exactly(sock, HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise EOFError("connection closed in the middle of a frame")
+
+    length = decode_frame_length(header)
+    body = _recv_exactly(sock, length)
+    if len(body) < length:
+        raise EOFError("connection closed in the middle of a frame")
+
+    return body
+
+#-----------------------------------------------------------------------
+
+def recv_magic(sock):
+    """
+    Returns the magic number a connection starts with, receiving
+    only it, or None (receiving nothing) if the connection uses the
+    original protocol.
+
+    Keyword arguments:
+    sock -- a blocking socket, before anything has been received
+        from it
+    """
+    if not is_framed(sock.recv(1, MSG_PEEK)):
+        return None
+
+    return _recv_exactly(sock, MAGIC_SIZE)
+
+#-----------------------------------------------------------------------
+
+def _recv_exactly(sock, size):
+    # Returns the next size bytes received from sock, or fewer if the
+    # connection is closed first.
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            break
+        received += count
+
+    return bytes(data[:received])
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# refiner.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Remembers the last few search results of
+a worker process so that a search that narrows one of them (e.g. a
+user typing "COS" after "CO") is answered by filtering that result
+in memory instead of searching all classes again.
+"""
+
+from collections import OrderedDict
+from likepattern import fold_case
+
+#-----------------------------------------------------------------------
+
+class Refiner:
+    """
+    Holds the results of up to capacity recent searches, keyed by
+    Search.get_key(), along with the case-folded searchable fields
+    of every class in them.
+
+    A search narrows a remembered one if every one of its fields
+    contains the corresponding remembered field: every class that
+    contains the longer text also contains the shorter one, so the
+    new result is the remembered result minus the classes that do
+    not contain the new fields. Filtering keeps the order of the
+    remembered result, which is the order of the database query.
+    This holds for every search, since create_like_pattern makes
+    every character of a field literal.
+    """
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+
+        # key -> list of (RegClass, folded fields), most recent last
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def search(self, search, compute):
+        """
+        Returns the classes that match search as a list of RegClass
+        objects: filtered from the smallest remembered result that
+        search narrows, or else computed with compute(). Either way
+        the result is remembered.
+
+        Keyword arguments:
+        search -- a Search object that contains all relevant search
+            fields (e.g. area)
+        compute -- a function that searches all classes for search
+        """
+        key = search.get_key()
+
+        supersets = self._find_supersets(key)
+        if not supersets:
+            classes = compute()
+            rows = [(regclass, _fold_fields(regclass))\
+                for regclass in classes]
+        else:
+            old_key, old_rows = supersets[0]
+            rows = _filter_rows(old_rows, old_key, key)
+            classes = [regclass for regclass, _ in rows]
+
+        self._remember(key, rows, supersets)
+        return classes
+
+    def _find_supersets(self, key):
+        # Returns the (remembered key, rows) pairs of the remembered
+        # results that key narrows, smallest first.
+        supersets = [(old_key, rows)\
+            for old_key, rows in self._results.items()\
+            if all(old in new for old, new in zip(old_key, key))]
+        supersets.sort(key=lambda superset: len(superset[1]))
+        return supersets
+
+    def _remember(self, key, rows, supersets):
+        # Remembered results are dropped least recently used first.
+        # Narrowing a result counts as using it, and the broadest
+        # results are used last, so that the results a user keeps
+        # typing into (down to the empty search) outlive the
+        # intermediate ones.
+        for old_key, _ in supersets:
+            self._results.move_to_end(old_key)
+
+        self._results[key] = rows
+        self._results.move_to_end(key)
+        while len(self._results) > self._capacity:
+            self._results.popitem(last=False)
+
+#-----------------------------------------------------------------------
+
+def _fold_fields(regclass):
+    return (fold_case(regclass.get_dept()),
+        fold_case(regclass.get_course_num()),
+        fold_case(regclass.get_area()), fold_case(regclass.get_title()))
+
+#-----------------------------------------------------------------------
+
+def _filter_rows(rows, old_key, key):
+    # only the fields that changed need checking
+    changed = [(position, new) for position, (old, new)\
+        in enumerate(zip(old_key, key)) if old != new]
+
+    return [row for row in rows\
+        if all(new in row[1][position] for position, new in changed)]
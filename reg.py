@@ -14,18 +14,54 @@ to see and search classes, and also display class details.
 
 import argparse
 import sys
-from pickle import dump, load
 from sys import argv, stderr
-from socket import socket
 from threading import Thread
+from time import sleep
+from queue import Full
 from PyQt5 import QtCore
 from PyQt5.QtGui import QFont
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import QObject, QTimer, QPoint, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QLineEdit, QLabel, QFrame,\
     QGridLayout, QVBoxLayout, QMainWindow, QMessageBox, QDesktopWidget,\
-    QListWidget, QListWidgetItem
+    QListView
 from safequeue import SafeQueue
+from classlistmodel import ClassListModel
 from search import Search
+from page import PageQuery, PAGE_SIZE
+from regconnection import RegConnection
+from protocol import GET_OVERVIEWS_PAGE, GET_DETAILS,\
+    SERVER_ERROR_MESSAGE, SERVER_BUSY_MESSAGE
+
+# Most class details prefetched with one request; a screenful of the
+# class list is far fewer rows than this.
+MAX_PREFETCH = 100
+
+# Milliseconds without typing before a search is sent, so that a
+# burst of keystrokes costs the server one search instead of one per
+# keystroke.
+DEBOUNCE_INTERVAL = 150
+
+# Milliseconds the class list has to stay still before the details
+# of its visible classes are prefetched, so that scrolling through
+# it sends one prefetch instead of one per step of the scroll bar.
+PREFETCH_INTERVAL = 150
+
+# Most pages of search results waiting for the GUI thread; a worker
+# thread that gets this far ahead waits for the GUI to catch up.
+QUEUE_CAPACITY = 64
+
+# Seconds a worker thread waits for room in a full queue before it
+# checks whether its search was abandoned.
+QUEUE_PUT_TIMEOUT = 0.1
+
+# Times a page that the server was too busy for is requested again,
+# and seconds before the first retry (doubled before every other
+# one).
+BUSY_RETRIES = 3
+BUSY_RETRY_DELAY = 0.2
+
+# Milliseconds the status bar shows that the server is busy.
+BUSY_MESSAGE_TIMEOUT = 3000
 
 #-----------------------------------------------------------------------
 
@@ -68,6 +104,10 @@ def __parse_args():
 def __show_gui(arg, host, port):
     app = QApplication(arg)
 
+    # one persistent connection carries every request to the server
+    connection = RegConnection(host, port)
+    app.aboutToQuit.connect(connection.close)
+
     window = QMainWindow()
     __set_window_properties(window)
 
@@ -78,14 +118,33 @@ def __show_gui(arg, host, port):
     area = QLineEdit()
     title = QLineEdit()
 
-    list_widget = QListWidget()
+    list_view = __create_class_list()
+
+    # the number of classes that match the search
+    total_label = QLabel()
+    window.statusBar().addPermanentWidget(total_label)
+
+    # class id -> (Future of the get_details request that prefetched
+    # the class details, position of the class in that request)
+    prefetched = {}
+
+    def __prefetch_visible_details():
+        __prefetch_details(connection, list_view, prefetched)
+
+    prefetch_timer = QTimer()
+    prefetch_timer.setSingleShot(True)
+    prefetch_timer.setInterval(PREFETCH_INTERVAL)
+    prefetch_timer.timeout.connect(__prefetch_visible_details)
 
     # Set event listeners
 
-    queue, timer= __set_up_queue_and_timer(window, list_widget)
-    timer.start()
+    queue = __set_up_queue(window, list_view, total_label,\
+        __prefetch_visible_details)
 
+    # the threads that fetch the first page of the current search
+    # and the page the class list asked for last
     worker_thread = None
+    page_thread = None
 
     def __initiate_search_query():
         nonlocal worker_thread
@@ -93,25 +152,51 @@ def __show_gui(arg, host, port):
         search = Search(dept.text(), num.text(), area.text(),\
             title.text())
 
-        if worker_thread is not None:
-            worker_thread.stop()
+        for thread in (worker_thread, page_thread):
+            if thread is not None:
+                thread.stop()
+
+        # the classes of the old result are no longer worth the
+        # server's time
+        prefetch_timer.stop()
+        __cancel_prefetches(connection, prefetched)
 
-        worker_thread = WorkerThread(host, port, search, queue)
+        worker_thread = WorkerThread(connection,
+            PageQuery(search, None, PAGE_SIZE, True), queue)
         worker_thread.start()
 
-    dept.textChanged.connect(__initiate_search_query)
-    num.textChanged.connect(__initiate_search_query)
-    area.textChanged.connect(__initiate_search_query)
-    title.textChanged.connect(__initiate_search_query)
+    def __fetch_page(query):
+        nonlocal page_thread
+
+        page_thread = WorkerThread(connection, query, queue)
+        page_thread.start()
+
+    # the class list asks for the next page when it is scrolled to
+    # its end
+    list_view.model().fetch_requested.connect(__fetch_page)
+
+    # every keystroke restarts the timer; the search is sent once
+    # the user pauses
+    debounce_timer = QTimer()
+    debounce_timer.setSingleShot(True)
+    debounce_timer.setInterval(DEBOUNCE_INTERVAL)
+    debounce_timer.timeout.connect(__initiate_search_query)
+
+    dept.textChanged.connect(lambda: debounce_timer.start())
+    num.textChanged.connect(lambda: debounce_timer.start())
+    area.textChanged.connect(lambda: debounce_timer.start())
+    title.textChanged.connect(lambda: debounce_timer.start())
 
     def __initiate_class_details_query():
-        __initiate_class_details_query_helper(host, port, window,\
-            list_widget)
+        __initiate_class_details_query_helper(connection, window,\
+            list_view, prefetched)
 
-    list_widget.itemActivated.connect(__initiate_class_details_query)
+    list_view.activated.connect(__initiate_class_details_query)
+    list_view.verticalScrollBar().valueChanged.connect(\
+        lambda: prefetch_timer.start())
 
     __set_up_layout(window, [__create_inputs(dept, num, area, title),\
-        list_widget])
+        list_view])
 
     window.show()
 
@@ -129,43 +214,72 @@ def __set_window_properties(window):
 
 #-----------------------------------------------------------------------
 
-def __set_up_queue_and_timer(window, list_widget):
+def __set_up_queue(window, list_view, total_label, prefetch):
 
-    queue = SafeQueue()
+    # The queue posts an event to the GUI thread when results arrive
+    # in it: a signal emitted from a worker thread is delivered to
+    # the slots of an object of the GUI thread through its event
+    # loop, so results are shown as soon as they arrive and the GUI
+    # thread sleeps while there are none.
+    notifier = _QueueNotifier(window)
+    queue = SafeQueue(QUEUE_CAPACITY, notifier.ready.emit)
 
-    def poll_queue():
-        classes_response = queue.get()
+    def process_queue():
+        errors = []
 
-        while classes_response is not None:
-            process_successful, process_data = classes_response
+        for query, process_successful, process_data in queue.drain():
 
             if process_successful:
                 query_successful, query_data = process_data
 
                 if query_successful:
-                    __populate_list_with_classes(query_data,\
-                        list_widget)
+                    # the first page of a search replaces the list;
+                    # the others are appended as it is scrolled
+                    list_view.model().show_page(query, query_data)
+                    if query.get_after() is None:
+                        __select_first_class(list_view)
+                        __show_total(total_label,
+                            query_data.get_total())
+                        prefetch()
+                    continue
+
+                if str(query_data) == SERVER_BUSY_MESSAGE:
+                    # the list keeps the last result; the next search
+                    # (or scroll) may get through
+                    window.statusBar().showMessage(str(query_data),
+                        BUSY_MESSAGE_TIMEOUT)
+                elif str(query_data) == SERVER_ERROR_MESSAGE:
+                    errors.append(('Server Error', str(query_data)))
                 else:
-                    if str(query_data) == "A server error occurred. "+\
-                        "Please contact the system administrator.":
-                        QMessageBox.critical(window, 'Server Error',
-                            str(query_data))
-                    else:
-                        QMessageBox.critical(window, 'Error',
-                            str(query_data))
+                    errors.append(('Error', str(query_data)))
             else:
-                QMessageBox.critical(window, 'Server Error',\
-                    str(process_data))
+                errors.append(('Server Error', str(process_data)))
+
+            list_view.model().fetch_failed(query)
+
+        # a message box runs the event loop until it is closed, which
+        # may process the queue again; by now, the pages drained
+        # above have all been shown, so they stay in order
+        for title, message in errors:
+            QMessageBox.critical(window, title, message)
 
-            classes_response = queue.get()
+    notifier.ready.connect(process_queue)
 
-    timer = QTimer()
+    return queue
 
-    timer.timeout.connect(poll_queue)
-    timer.setInterval(100) # milliseconds
-    timer.start()
+#-----------------------------------------------------------------------
+
+class _QueueNotifier (QObject):
+    # lives in the GUI thread; ready is emitted by worker threads
+    ready = pyqtSignal()
+
+#-----------------------------------------------------------------------
 
-    return queue, timer
+def __show_total(total_label, total):
+    if total == 1:
+        total_label.setText('1 class')
+    else:
+        total_label.setText(str(total) + ' classes')
 
 #-----------------------------------------------------------------------
 
@@ -216,101 +330,206 @@ def __create_label(text):
 
 #-----------------------------------------------------------------------
 
-def __populate_list_with_classes(classes, list_widget):
+def __create_class_list():
+    list_view = QListView()
+    list_view.setModel(ClassListModel(list_view))
+
+    # one font for every row, and rows of the same height, so the
+    # view only has to lay out and format the rows it paints
+    list_view.setFont(QFont("Courier", 10))
+    list_view.setUniformItemSizes(True)
 
-    list_widget.clear()
+    return list_view
 
-    for i, regclass in enumerate(classes):
-        item = QListWidgetItem()
+#-----------------------------------------------------------------------
+
+def __select_first_class(list_view):
 
-        item.setFont(QFont("Courier", 10))
-        item.setText(str(regclass))
+    if list_view.model().rowCount() > 0:
+        list_view.setCurrentIndex(list_view.model().index(0))
 
-        # Role documentation:
-        # https://doc.qt.io/qtforpython/PySide6/QtCore/Qt.html
-        # setData() documention:
-        # https://doc.qt.io/qtforpython/PySide6/QtWidgets/
-        # QListWidgetItem.html
-        item.setData(QtCore.Qt.UserRole, regclass.get_class_id())
+#-----------------------------------------------------------------------
 
-        list_widget.insertItem(i, item)
+def __query_server_for_class_details(connection, class_id):
+    print('Sent command: get_details')
 
-    first_item = list_widget.item(0)
-    if first_item is not None:
-        first_item.setSelected(True)
+    return connection.get_detail(class_id)
 
 #-----------------------------------------------------------------------
 
-def __query_server_for_class_details(host, port, class_id):
+def __prefetch_details(connection, list_view, prefetched):
+    # Asks the server for the details of the classes visible in
+    # list_view that have not been prefetched yet, in one request
+    # that does not block the GUI, so that activating one of them
+    # shows its details without waiting for a round trip.
+    first = list_view.indexAt(QPoint(0, 0)).row()
+    if first < 0:
+        return
+
+    last = list_view.indexAt(\
+        list_view.viewport().rect().bottomLeft()).row()
+    if last < 0:
+        last = list_view.model().rowCount() - 1
+
+    class_ids = []
+    for row in range(first, last + 1):
+        class_id = list_view.model().get_class_id(row)
+        if class_id not in prefetched and class_id not in class_ids:
+            class_ids.append(class_id)
+
+    class_ids = class_ids[:MAX_PREFETCH]
+    if not class_ids:
+        return
+
     print('Sent command: get_details')
 
-    with socket() as sock:
-        sock.connect((host, port))
+    try:
+        future = connection.submit(GET_DETAILS, class_ids)
+    except OSError as ex:
+        # prefetching is only an optimization; a class that was not
+        # prefetched is queried when it is activated
+        print(ex, file=stderr)
+        return
+
+    for position, class_id in enumerate(class_ids):
+        prefetched[class_id] = (future, position)
+
+#-----------------------------------------------------------------------
+
+def __cancel_prefetches(connection, prefetched):
+    # Cancels the prefetch requests that are still in flight and
+    # forgets their classes; the details that have arrived are kept.
+    futures = {future for future, _ in prefetched.values()\
+        if not future.done()}
+
+    for future in futures:
+        connection.cancel(future)
+
+    for class_id, (future, _) in list(prefetched.items()):
+        if future in futures:
+            del prefetched[class_id]
 
-        write_flo = sock.makefile(mode='wb')
-        # false because this query is not a search
-        dump(False, write_flo)
-        dump(class_id, write_flo)
-        write_flo.flush()
+#-----------------------------------------------------------------------
+
+def __get_prefetched_details(prefetched, class_id):
+    # Returns the prefetched RegClassDetails of class_id, or None if
+    # the class was not prefetched successfully or its prefetch
+    # request is still in flight, which is not waited for, since
+    # that would block the GUI.
+    if class_id not in prefetched:
+        return None
 
-        read_flo = sock.makefile(mode='rb')
+    future, position = prefetched[class_id]
+    if not future.done():
+        # kept, in case the class is activated again once it is done
+        return None
 
-        query_successful = load(read_flo)
+    try:
+        successful, data = future.result()
+    except OSError:
+        successful = False
 
-        if query_successful:
-            details = load(read_flo)
-            return (True, details)
+    if not successful or data[position] is None:
+        # query the class on its own, which also reports the error
+        del prefetched[class_id]
+        return None
 
-        ex_message = load(read_flo)
-        return (False, ex_message)
+    return data[position]
 
 #-----------------------------------------------------------------------
 
 class WorkerThread (Thread):
 
-    def __init__(self, host, port, search, queue):
+    def __init__(self, connection, query, queue):
         Thread.__init__(self)
-        self._host = host
-        self._port = port
-        self._search = search
+        self._connection = connection
+        self._query = query
         self._queue = queue
         self._should_stop = False
+        self._future = None
 
     def stop(self):
         self._should_stop = True
 
-    def run(self):
-        print('Sent command: get_overviews')
+        # tell the server to stop working on the abandoned page
+        future = self._future
+        if future is not None:
+            self._connection.cancel(future)
 
+    def run(self):
         try:
-            with socket() as sock:
-                sock.connect((self._host, self._port))
-
-                write_flo = sock.makefile(mode='wb')
-                dump(True, write_flo)
-                dump(self._search, write_flo)
-                write_flo.flush()
+            response = self._request_with_retries()
 
-                read_flo = sock.makefile(mode='rb')
-                query_successful = load(read_flo)
-                data = load(read_flo)
-
-            if not self._should_stop:
-                self._queue.put((True, (query_successful, data)))
+            if response is not None and not self._should_stop:
+                self._put((self._query, True, response))
         except Exception as ex:
             if not self._should_stop:
-                self._queue.put((False, ex))
+                self._put((self._query, False, ex))
+
+    def _request_with_retries(self):
+        # Returns the response of the page query, or None if it was
+        # abandoned. A busy server answers at once, so a page it was
+        # too busy for is requested again after a pause, a few times;
+        # the last busy response is returned like any other error.
+        retry_delay = BUSY_RETRY_DELAY
+
+        for retries_left in range(BUSY_RETRIES, -1, -1):
+            # every request is read-only, so one that is lost with
+            # the connection is sent again once
+            try:
+                response = self._request()
+            except OSError:
+                response = self._request()
+
+            if response != (False, SERVER_BUSY_MESSAGE)\
+                or retries_left == 0:
+                return response
+
+            sleep(retry_delay)
+            retry_delay *= 2
+            if self._should_stop:
+                return None
+
+    def _request(self):
+        print('Sent command: get_overviews_page')
+
+        self._future = self._connection.submit(GET_OVERVIEWS_PAGE,
+            self._query)
+        if self._should_stop:
+            self._connection.cancel(self._future)
+
+        return self._future.result()
+
+    def _put(self, item):
+        # Waits for room in the queue unless the search is abandoned,
+        # in which case the GUI does not want item. Returns whether
+        # item was put in the queue.
+        while not self._should_stop:
+            try:
+                self._queue.put(item, QUEUE_PUT_TIMEOUT)
+                return True
+            except Full:
+                pass
+        return False
 
 #-----------------------------------------------------------------------
 
-def __initiate_class_details_query_helper(host, port, window,\
-    list_widget):
-    selected_item = list_widget.selectedItems()[0]
-    class_id = selected_item.data(QtCore.Qt.UserRole)
+def __initiate_class_details_query_helper(connection, window,\
+    list_view, prefetched):
+    current_index = list_view.currentIndex()
+    if not current_index.isValid():
+        return
+    class_id = current_index.data(QtCore.Qt.UserRole)
+
+    class_details = __get_prefetched_details(prefetched, class_id)
+    if class_details is not None:
+        QMessageBox.information(window, 'Class Details',\
+            str(class_details))
+        return
 
     try:
         successful, data =\
-            __query_server_for_class_details(host, port, class_id)
+            __query_server_for_class_details(connection, class_id)
     except Exception as ex:
         QMessageBox.critical(window, 'Server Error', str(ex))
         return
@@ -321,8 +540,9 @@ def __initiate_class_details_query_helper(host, port, window,\
     else:
         # QMessageBox.critical(window,\
         #     'Error', str(data))
-        if str(data) == "A server error occurred. "+\
-            "Please contact the system administrator.":
+        if str(data) == SERVER_BUSY_MESSAGE:
+            QMessageBox.warning(window, 'Server Busy', str(data))
+        elif str(data) == SERVER_ERROR_MESSAGE:
             QMessageBox.critical(window, 'Server Error',
                 str(data))
         else:
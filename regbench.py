@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# regbench.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Load generator and latency benchmark for a running registrar server.
+Many simulated clients, each with a persistent connection of its
+own, replay the sessions of users of reg.py: typing the dept, course
+number, area or title of a random class one character at a time,
+with a search after every keystroke, then prefetching the details of
+the first classes of the result and looking up a few of them. The
+sessions depend only on the seed, so server modes, caches and codecs
+can be compared on the same workload. Prints the throughput and the
+latency percentiles of each command, and the number of requests the
+server shed because it was too busy (see admission.py), and exits
+with status 1 if any other request failed (or, with --check,
+returned the wrong classes).
+"""
+
+import argparse
+import random
+import sys
+from sys import argv, stderr
+from threading import Thread, Lock
+from queue import SimpleQueue, Empty
+from time import perf_counter, sleep
+from statistics import mean, quantiles
+from catalog import Catalog, read_overviews
+from database import DATABASE_PATH, create_database_url
+from protocol import JSON_MAGIC, PICKLE_MAGIC, GET_OVERVIEWS,\
+    GET_OVERVIEWS_PAGE, STREAM_OVERVIEWS, GET_DETAIL, GET_DETAILS,\
+    SERVER_BUSY_MESSAGE
+from regconnection import RegConnection
+from search import Search
+from page import PageQuery, MAX_PAGE_SIZE
+
+# The magic number of each codec a client may use.
+_MAGICS = {'json': JSON_MAGIC, 'pickle': PICKLE_MAGIC}
+
+# The number of classes whose details a session prefetches, like the
+# visible rows of the class list of reg.py.
+PREFETCHED_CLASSES = 12
+
+# The name under which the latency of the first chunk of streamed
+# class lists is reported.
+FIRST_CHUNK = STREAM_OVERVIEWS + ' (first)'
+
+#-----------------------------------------------------------------------
+
+def main():
+    """
+    Parses the command-line arguments (host and port of the server,
+    the number of clients and sessions and the shape of the
+    workload), runs every session against the server and prints
+    throughput and latency statistics per command.
+    """
+
+    try:
+        parser = argparse.ArgumentParser(allow_abbrev=False,
+        description="Load generator for the registrar server")
+        parser.add_argument("host", type=str,
+        help="the host on which the server is running")
+        parser.add_argument("port", type=int,
+        help = "the port at which the server is listening")
+        parser.add_argument("--clients", type=__positive_int,
+        default=8,
+        help = "the number of simulated clients, each with a\
+            connection of its own (default: 8)")
+        parser.add_argument("--sessions", type=__positive_int,
+        default=100,
+        help = "the number of typing sessions the clients share\
+            (default: 100)")
+        parser.add_argument("--lookups", type=int, default=2,
+        help = "the number of classes whose details each session\
+            looks up after its last search (default: 2)")
+        parser.add_argument("--think-time", type=float, default=0.0,
+        help = "the number of seconds a client waits between\
+            requests, like the pause between keystrokes (default: 0)")
+        parser.add_argument("--codec", choices=sorted(_MAGICS),
+        default="json",
+        help = "the encoding of the messages (default: json)")
+        searches = parser.add_mutually_exclusive_group()
+        searches.add_argument("--no-stream", action="store_true",
+        help = "search with get_overviews instead of streaming the\
+            class lists")
+        searches.add_argument("--page-size", type=__page_size,
+        default=None,
+        help = "search with get_overviews_page, fetching only the\
+            first page of this many classes (and their number), like\
+            reg.py")
+        parser.add_argument("--check", action="store_true",
+        help = "check that every search returns the classes of a\
+            local catalog of the database")
+        parser.add_argument("--database", type=str,
+        default=DATABASE_PATH,
+        help = "the path of the registrar database the sessions are\
+            drawn from (default: " + DATABASE_PATH + ")")
+        parser.add_argument("--seed", type=int, default=333,
+        help = "the seed of the random session generator")
+
+        args = parser.parse_args()
+
+        catalog = Catalog(*read_overviews(
+            create_database_url(args.database)))
+        sessions = SimpleQueue()
+        for session in __create_sessions(catalog, args.sessions,
+            args.lookups, random.Random(args.seed)):
+            sessions.put(session)
+
+        recorder = _Recorder()
+        clients = [_Client(args, catalog, sessions, recorder)\
+            for _ in range(args.clients)]
+
+        start = perf_counter()
+        threads = [Thread(target=client.run) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+
+        __print_report(recorder, elapsed, args)
+
+        if recorder.failures:
+            for failure in recorder.failures[:10]:
+                print(failure, file=stderr)
+            print(str(len(recorder.failures)) + ' requests failed',
+                file=stderr)
+            sys.exit(1)
+
+    except argparse.ArgumentError as ex:
+        print(argv[0] + ": " + str(ex), file=stderr)
+        sys.exit(2)
+
+#-----------------------------------------------------------------------
+
+def __create_sessions(catalog, sessions, lookups, rand):
+    # Each session is a (searches, lookups) tuple: the searches a user
+    # produces while typing one or two fields of a random class,
+    # starting from the empty search that reg.py runs at startup, and
+    # which of the prefetched classes of the last result the user
+    # looks up, as fractions of their number.
+    all_classes = catalog.search(Search('', '', '', ''))
+    created = []
+
+    for _ in range(sessions):
+        regclass = rand.choice(all_classes)
+        fields = [regclass.get_dept(), regclass.get_course_num(),
+            regclass.get_area(), regclass.get_title()]
+        texts = ['', '', '', '']
+        searches = [Search(*texts)]
+
+        for position in rand.sample(range(4), rand.choice([1, 1, 2])):
+            text = fields[position]
+            if position == 3:
+                # a word or two from the title, not the whole title
+                words = text.split()
+                text = ' '.join(words[rand.randrange(len(words)):][:2])
+
+            for length in range(1, len(text) + 1):
+                texts[position] = text[:length]
+                searches.append(Search(*texts))
+
+        created.append((searches,
+            [rand.random() for _ in range(lookups)]))
+
+    return created
+
+#-----------------------------------------------------------------------
+
+def __print_report(recorder, elapsed, args):
+    # the first chunks are part of the streamed requests
+    total = sum(len(latencies) for command, latencies\
+        in recorder.latencies.items() if command != FIRST_CHUNK)
+
+    print(str(args.clients) + ' clients, ' + str(args.sessions)\
+        + ' sessions, ' + str(total) + ' requests in '\
+        + format(elapsed, '.2f') + ' s (' + format(total / elapsed,
+        '.1f') + ' requests/s, codec ' + args.codec + ')')
+    print('{:<24}{:>8}{:>7}{:>10}{:>9}{:>9}{:>9}{:>9}'.format(
+        'command (ms)', 'count', 'shed', 'req/s', 'mean', 'p50', 'p95',
+        'p99'))
+
+    for command in (GET_OVERVIEWS, GET_OVERVIEWS_PAGE, STREAM_OVERVIEWS,
+        FIRST_CHUNK, GET_DETAILS, GET_DETAIL):
+        latencies = recorder.latencies.get(command)
+        if not latencies:
+            continue
+
+        if len(latencies) > 1:
+            cut_points = quantiles(latencies, n=100)
+        else:
+            cut_points = latencies * 99
+
+        print('{:<24}{:>8}{:>7}{:>10.1f}{:>9.3f}{:>9.3f}{:>9.3f}'\
+            '{:>9.3f}'.format(command, len(latencies),
+            recorder.shed.get(command, 0), len(latencies) / elapsed,
+            mean(latencies), cut_points[49], cut_points[94],
+            cut_points[98]))
+
+#-----------------------------------------------------------------------
+
+class _Recorder:
+    """
+    The latencies of the successful requests of all clients in
+    milliseconds and the number of shed requests, by command, and
+    descriptions of the requests that failed.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.latencies = {}
+        self.shed = {}
+        self.failures = []
+
+    def record(self, command, milliseconds):
+        """
+        Adds the latency of one request.
+        """
+        with self._lock:
+            self.latencies.setdefault(command, []).append(milliseconds)
+
+    def fail(self, description):
+        """
+        Records that a request failed.
+        """
+        with self._lock:
+            self.failures.append(description)
+
+    def reject(self, command, message):
+        """
+        Records that the server answered a request of command with an
+        error message: shed if the server was busy, failed otherwise.
+        """
+        if message != SERVER_BUSY_MESSAGE:
+            self.fail(command + ': ' + str(message))
+            return
+        with self._lock:
+            self.shed[command] = self.shed.get(command, 0) + 1
+
+#-----------------------------------------------------------------------
+
+class _Client:
+    """
+    A simulated user of reg.py that runs sessions from a queue shared
+    with the other clients until none are left.
+    """
+
+    def __init__(self, args, catalog, sessions, recorder):
+        self._connection = RegConnection(args.host, args.port,
+            _MAGICS[args.codec])
+        self._args = args
+        self._catalog = catalog
+        self._sessions = sessions
+        self._recorder = recorder
+
+    def run(self):
+        """
+        Runs sessions until the queue is empty, then closes the
+        connection.
+        """
+        try:
+            while True:
+                try:
+                    searches, lookups = self._sessions.get_nowait()
+                except Empty:
+                    return
+                self._run_session(searches, lookups)
+        finally:
+            self._connection.close()
+
+    def _run_session(self, searches, lookups):
+        classes = []
+        for search in searches:
+            # the user keeps typing after a search that failed
+            result = self._search(search)
+            if result is not None:
+                classes = result
+            self._think()
+
+        class_ids = [regclass.get_class_id() for regclass\
+            in classes[:PREFETCHED_CLASSES]]
+        if not class_ids:
+            return
+
+        self._request(GET_DETAILS, class_ids)
+        self._think()
+
+        for lookup in lookups:
+            self._request(GET_DETAIL,
+                class_ids[int(lookup * len(class_ids))])
+            self._think()
+
+    def _search(self, search):
+        # Returns the classes of search (of its first page, with
+        # --page-size), or None if it failed.
+        expected = self._catalog.search(search)\
+            if self._args.check else None
+
+        if self._args.page_size is not None:
+            page = self._request(GET_OVERVIEWS_PAGE, PageQuery(search,
+                None, self._args.page_size, True))
+            classes = None if page is None else page.get_classes()
+            if expected is not None and page is not None\
+                and page.get_total() != len(expected):
+                self._recorder.fail('wrong total for '\
+                    + str(search.get_key()))
+                return None
+            if expected is not None:
+                expected = expected[:self._args.page_size]
+        elif self._args.no_stream:
+            classes = self._request(GET_OVERVIEWS, search)
+        else:
+            classes = self._stream(search)
+
+        if classes is not None and expected is not None\
+            and [str(regclass) for regclass in classes]\
+            != [str(regclass) for regclass in expected]:
+            self._recorder.fail('wrong classes for '\
+                + str(search.get_key()))
+            return None
+
+        return classes
+
+    def _request(self, command, payload):
+        # Returns the data of the response, or None if it failed.
+        start = perf_counter()
+        try:
+            successful, data = self._connection.request(command,
+                payload)
+        except OSError as ex:
+            self._recorder.fail(command + ': ' + str(ex))
+            return None
+
+        if not successful:
+            self._recorder.reject(command, data)
+            return None
+        self._recorder.record(command, (perf_counter() - start) * 1000)
+        return data
+
+    def _stream(self, search):
+        # Returns the classes of all chunks, or None if it failed.
+        start = perf_counter()
+        classes = []
+        first = True
+        try:
+            for successful, data in\
+                self._connection.stream_overviews(search):
+                if not successful:
+                    self._recorder.reject(STREAM_OVERVIEWS, data)
+                    return None
+                if first:
+                    self._recorder.record(FIRST_CHUNK,
+                        (perf_counter() - start) * 1000)
+                    first = False
+                classes.extend(data[0])
+        except OSError as ex:
+            self._recorder.fail(STREAM_OVERVIEWS + ': ' + str(ex))
+            return None
+
+        self._recorder.record(STREAM_OVERVIEWS,
+            (perf_counter() - start) * 1000)
+        return classes
+
+    def _think(self):
+        if self._args.think_time > 0:
+            sleep(self._args.think_time)
+
+#-----------------------------------------------------------------------
+
+def __positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return value
+
+#-----------------------------------------------------------------------
+
+def __page_size(text):
+    value = int(text)
+    if not 1 <= value <= MAX_PAGE_SIZE:
+        raise argparse.ArgumentTypeError("must be from 1 to "\
+            + str(MAX_PAGE_SIZE))
+    return value
+
+#-----------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
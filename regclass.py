@@ -5,35 +5,65 @@
 # Author: AnneMarie Caballero and Jen Secrest
 #-----------------------------------------------------------------------
 
-class RegClass:
+# Formats the fields of a RegClass as one line of the class list.
+_format_line = '{:>5} {:>4} {:>6} {:>4} {}'.format
+
+#-----------------------------------------------------------------------
+
+class RegClass (tuple):
 
     """
     Creates an object to represent the relevant information
     about a class in the registrar database (class id, dept,
-    course num, area, title). Only has one public method
-    to get a class id because the only relevant aspects
-    are its string representation and also the class id.
+    course num, area, title). The client only needs its string
+    representation and its class id; the server also reads the
+    searchable fields to refine earlier search results.
+
+    A RegClass is an immutable tuple of those five strings, so it
+    needs no per-object dictionary, can be built straight from a
+    database row, can be shared by every result that contains it,
+    and pickles as just its tuple of fields.
     """
 
-    def __init__(self, class_details):
-        self._class_id = class_details[0]
-        self._dept = class_details[1]
-        self._course_num = class_details[2]
-        self._area = class_details[3]
-        self._title = class_details[4]
+    # RegClass(class_details) takes any sequence of the five fields
+    __slots__ = ()
 
-    def __str__(self):
-        format_str = '{clsid:>5} {dept:>4} {crsnum:>6} {area:>4} '
-        format_str += '{title}'
+    def __reduce__(self):
+        # Unpickled by calling RegClass with the fields, which is also
+        # how clients whose RegClass is not a tuple build one.
+        return (RegClass, (tuple(self),))
 
-        return format_str.format(clsid = self._class_id,
-            dept = self._dept,
-            crsnum = self._course_num, area = self._area,
-            title = self._title)
+    def __str__(self):
+        # clsid, dept, crsnum, area, title
+        return _format_line(*self)
 
     def get_class_id(self):
         """
         Returns the class id of the regclass object on which it is
         called.
         """
-        return self._class_id
+        return self[0]
+
+    def get_dept(self):
+        """
+        Returns the department of the regclass object.
+        """
+        return self[1]
+
+    def get_course_num(self):
+        """
+        Returns the course number of the regclass object.
+        """
+        return self[2]
+
+    def get_area(self):
+        """
+        Returns the area of the regclass object.
+        """
+        return self[3]
+
+    def get_title(self):
+        """
+        Returns the title of the regclass object.
+        """
+        return self[4]
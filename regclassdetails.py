@@ -8,25 +8,40 @@
 class RegClassDetails:
     """
     Creates an object to represent all of the main details
-    of a class from the reegistrar database. Does not have any
-    public methods because the main use of this class is to
-    store the details of a class and then print those details.
+    of a class from the reegistrar database. The main use of
+    this class is to store the details of a class and then print
+    those details; the getters let the codec send them over the
+    network.
+
+    The details are kept in slots rather than a per-object
+    dictionary, and pickle as just the four lists the object was
+    created with. The text of the details is formatted the first
+    time it is needed and kept until a setter changes them.
     """
 
+    __slots__ = ('_class_details', '_cl_details', '_course_details',
+        '_prof_details', '_text')
+
     def __init__(self, class_details, cl_details,
         course_details, prof_details):
         self._class_details = class_details
         self._cl_details = cl_details
         self._course_details = course_details
         self._prof_details = prof_details
+        self._text = None
+
+    def __reduce__(self):
+        return (RegClassDetails, (self._class_details, self._cl_details,
+            self._course_details, self._prof_details))
 
     def __str__(self):
-        reg_class_details = self.__format_class_info()
-        reg_class_details += self.__format_crosslistings_info()
-        reg_class_details += self.__format_courses_info()
-        reg_class_details += self.__format_profs_info()
+        if self._text is None:
+            self._text = self.__format_class_info()\
+                + self.__format_crosslistings_info()\
+                + self.__format_courses_info()\
+                + self.__format_profs_info()
 
-        return reg_class_details
+        return self._text
 
     def set_class_data(self, class_details):
         """
@@ -39,6 +54,7 @@ class RegClassDetails:
                 bldg and roomnum)
         """
         self._class_details = class_details
+        self._text = None
 
     def set_cl_data(self, cl_details):
         """
@@ -50,6 +66,7 @@ class RegClassDetails:
             course numbers)
         """
         self._cl_details = cl_details
+        self._text = None
 
     def set_courses_data(self, courses_details):
         """
@@ -61,6 +78,7 @@ class RegClassDetails:
         """
 
         self._course_details = courses_details
+        self._text = None
 
     def set_prof_data(self, prof_names):
         """
@@ -71,6 +89,34 @@ class RegClassDetails:
             the course in question
         """
         self._prof_details = prof_names
+        self._text = None
+
+    def get_class_data(self):
+        """
+        Returns the data for classes (course_id, days, starttime,
+        endtime, bldg and roomnum)
+        """
+        return self._class_details
+
+    def get_cl_data(self):
+        """
+        Returns the data for crosslistings (the list of departments
+        and the list of course numbers)
+        """
+        return self._cl_details
+
+    def get_courses_data(self):
+        """
+        Returns the data for courses (area, title, descrip, and
+        prereqs)
+        """
+        return self._course_details
+
+    def get_prof_data(self):
+        """
+        Returns the names of professors who teach the course
+        """
+        return self._prof_details
 
     def __format_class_info(self):
         class_info = "Course Id: " + str(self._class_details[0])\
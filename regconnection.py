@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# regconnection.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the client side. Keeps one persistent connection to the
+registrar server that all class list and class details requests
+share, using the framed protocol defined in protocol.py with JSON
+messages (see codec.py), so that a request costs one round trip
+instead of a TCP handshake as well.
+"""
+
+from socket import socket, SHUT_RDWR
+from threading import Lock, Thread
+from queue import SimpleQueue
+from concurrent.futures import Future, CancelledError
+from protocol import JSON_MAGIC, GET_OVERVIEWS, GET_OVERVIEWS_PAGE,\
+    STREAM_OVERVIEWS, GET_DETAIL, GET_DETAILS, CANCEL, encode_frame,\
+    read_frame
+from codec import get_codec
+
+#-----------------------------------------------------------------------
+
+class RegConnection:
+    """
+    A thread-safe, persistent connection to the registrar server.
+    Any number of threads may have requests in flight at once; a
+    reader thread matches each response to its request by request
+    id. The socket is opened on the first request and reopened
+    whenever the server has closed it (e.g. because it was idle).
+    Messages are encoded with the codec of magic (JSON by default).
+    """
+
+    def __init__(self, host, port, magic=JSON_MAGIC):
+        self._host = host
+        self._port = port
+        self._magic = magic
+        self._codec = get_codec(magic)
+        self._lock = Lock()
+        self._sock = None
+        self._write_flo = None
+        self._pending = {}
+        self._next_request_id = 0
+
+    def get_overviews(self, search):
+        """
+        Asks the server for the classes that match search. Returns
+        a tuple: either True and the list of RegClass objects, or
+        False and the error message sent by the server.
+
+        Keyword arguments:
+            search -- the Search to run
+        """
+        return self.request(GET_OVERVIEWS, search)
+
+    def stream_overviews(self, search):
+        """
+        Asks the server for the classes that match search, delivered
+        in chunks as the server produces them. Returns a
+        ResponseStream that yields a tuple per chunk: either True
+        and a (list of RegClass objects, last) tuple, or False and
+        the error message sent by the server, which ends the stream.
+        reg.py pages its class lists with get_overviews_page instead;
+        streaming is kept for regbench.py and other API clients.
+
+        Keyword arguments:
+            search -- the Search to run
+        """
+        return self.submit_stream(STREAM_OVERVIEWS, search)
+
+    def get_overviews_page(self, query):
+        """
+        Asks the server for a page of the classes that match a
+        search. Returns a tuple: either True and the Page, or False
+        and the error message sent by the server.
+
+        Keyword arguments:
+            query -- the PageQuery of the page
+        """
+        return self.request(GET_OVERVIEWS_PAGE, query)
+
+    def get_detail(self, class_id):
+        """
+        Asks the server for the details of a class. Returns a tuple:
+        either True and the RegClassDetails, or False and the error
+        message sent by the server.
+
+        Keyword arguments:
+            class_id -- the class id as a string
+        """
+        return self.request(GET_DETAIL, class_id)
+
+    def get_details(self, class_ids):
+        """
+        Asks the server for the details of several classes in one
+        request. Returns a tuple: either True and a list with the
+        RegClassDetails of each class (None for class ids that do
+        not exist), or False and the error message sent by the
+        server.
+
+        Keyword arguments:
+            class_ids -- the class ids as strings
+        """
+        return self.request(GET_DETAILS, list(class_ids))
+
+    def request(self, command, payload):
+        """
+        Sends a request and blocks until its response arrives.
+        Returns the (successful, data) tuple sent by the server.
+        A request that is lost because the connection was closed
+        is retried once on a new connection, since every request
+        is read-only; OSError is raised if that fails too.
+
+        Keyword arguments:
+            command -- one of the commands in protocol.py
+            payload -- the data the command needs
+        """
+        try:
+            return self.submit(command, payload).result()
+        except OSError:
+            return self.submit(command, payload).result()
+
+    def submit(self, command, payload):
+        """
+        Sends a request without waiting for its response. Returns a
+        concurrent.futures.Future that receives the (successful,
+        data) tuple sent by the server, or an OSError if the
+        connection is lost first.
+
+        Keyword arguments:
+            command -- one of the commands in protocol.py
+            payload -- the data the command needs
+        """
+        future = Future()
+        self._send(command, payload, future)
+        return future
+
+    def submit_stream(self, command, payload):
+        """
+        Sends a request whose responses come in chunks (see
+        protocol.py) without waiting for them. Returns a
+        ResponseStream of the (successful, data) tuples sent by the
+        server. Like request, the request is retried once if the
+        connection is lost before the first chunk arrives.
+
+        Keyword arguments:
+            command -- one of the streaming commands in protocol.py
+            payload -- the data the command needs
+        """
+        stream = ResponseStream(
+            lambda receiver: self._send(command, payload, receiver),
+            self.cancel)
+        try:
+            stream.send()
+        except OSError:
+            stream.retry()
+        return stream
+
+    def cancel(self, receiver):
+        """
+        Cancels a request that is still in flight: tells the server
+        to abandon it, and fails receiver with a CancelledError.
+        Does nothing if the request has already been answered.
+
+        Keyword arguments:
+            receiver -- the Future or ResponseStream of the request
+        """
+        with self._lock:
+            request_id = next((request_id for request_id, pending\
+                in self._pending.items() if pending is receiver), None)
+            if request_id is None:
+                return
+            del self._pending[request_id]
+
+            # the server never answers a cancellation
+            try:
+                self._write_flo.write(encode_frame(
+                    self._codec.encode_request(self._next_request_id,
+                        CANCEL, request_id)))
+                self._write_flo.flush()
+                self._next_request_id += 1
+            except OSError as ex:
+                self._disconnect(self._sock, ex)
+
+        receiver.set_exception(CancelledError("request cancelled"))
+
+    def close(self):
+        """
+        Closes the connection. Requests still in flight fail with
+        an OSError.
+        """
+        with self._lock:
+            self._disconnect(self._sock,
+                ConnectionAbortedError("connection closed"))
+
+    def _send(self, command, payload, receiver):
+        # receiver is a Future or ResponseStream for the responses
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+
+                request_id = self._next_request_id
+                self._next_request_id += 1
+                self._pending[request_id] = receiver
+
+                self._write_flo.write(encode_frame(
+                    self._codec.encode_request(request_id, command,
+                        payload)))
+                self._write_flo.flush()
+            except OSError as ex:
+                self._disconnect(self._sock, ex)
+                raise
+
+    def _connect(self):
+        # called with self._lock held
+        sock = socket()
+        try:
+            sock.connect((self._host, self._port))
+            write_flo = sock.makefile(mode='wb')
+            write_flo.write(self._magic)
+            write_flo.flush()
+        except OSError:
+            sock.close()
+            raise
+
+        self._sock = sock
+        self._write_flo = write_flo
+
+        reader = Thread(target=self._read_responses, args=[sock],
+            daemon=True)
+        reader.start()
+
+    def _disconnect(self, sock, ex):
+        # called with self._lock held; fails every pending request
+        # if sock is still the current socket
+        if sock is None or sock is not self._sock:
+            return
+
+        self._sock = None
+        self._write_flo = None
+
+        # shutdown() also wakes up the reader thread blocked on sock
+        try:
+            sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+        pending = self._pending
+        self._pending = {}
+        for receiver in pending.values():
+            receiver.set_exception(ex)
+
+    def _read_responses(self, sock):
+        read_flo = sock.makefile(mode='rb')
+
+        try:
+            while True:
+                body = read_frame(read_flo)
+                if body is None:
+                    raise ConnectionResetError(
+                        "server closed the connection")
+
+                request_id, successful, data =\
+                    self._codec.decode_response(body)
+                with self._lock:
+                    receiver = self._pending.get(request_id)
+                    if not isinstance(receiver, ResponseStream)\
+                        or receiver.is_last(successful, data):
+                        self._pending.pop(request_id, None)
+                if receiver is not None:
+                    receiver.set_result((successful, data))
+
+        except Exception as ex:
+            # a response that cannot be read leaves the stream unusable
+            if not isinstance(ex, OSError):
+                ex = ConnectionResetError(str(ex))
+            with self._lock:
+                self._disconnect(sock, ex)
+
+#-----------------------------------------------------------------------
+
+class ResponseStream:
+    """
+    The responses to a streaming request of a RegConnection, in the
+    order the server sent them. Iterating over it blocks until each
+    response arrives and stops after the last one. An OSError is
+    raised if the connection is lost (after one retry if no
+    response had arrived yet), and a CancelledError if the request
+    is cancelled.
+    """
+
+    def __init__(self, send, cancel):
+        """
+        Keyword arguments:
+            send -- a function that sends the request to the server
+                with a receiver for its responses
+            cancel -- a function that cancels the request of a
+                receiver
+        """
+        self._send = send
+        self._cancel = cancel
+        self._responses = SimpleQueue()
+        self._started = False
+        self._retried = False
+        self._cancelled = False
+        self._finished = False
+
+    def __iter__(self):
+        while not self._finished:
+            response = self._responses.get()
+
+            if isinstance(response, OSError) and not self._started\
+                and not self._retried and not self._cancelled:
+                self.retry()
+                continue
+
+            if isinstance(response, BaseException):
+                self._finished = True
+                raise response
+
+            self._started = True
+            self._finished = self.is_last(*response)
+            yield response
+
+    def send(self):
+        """
+        Sends the request, raising OSError if that fails.
+        """
+        self._send(self)
+
+    def retry(self):
+        """
+        Sends the request again on a new connection, once. Raises
+        OSError if that fails too.
+        """
+        self._retried = True
+        self._send(self)
+
+    def cancel(self):
+        """
+        Cancels the request (see RegConnection.cancel).
+        """
+        self._cancelled = True
+        self._cancel(self)
+
+    def is_last(self, successful, data):
+        """
+        Returns whether a response ends the stream: an error, or a
+        chunk marked as the last one.
+
+        Keyword arguments:
+            successful -- whether the request succeeded
+            data -- a (chunk, last) tuple, or the error message
+        """
+        return not successful or data[1]
+
+    def set_result(self, response):
+        """
+        Adds a (successful, data) response to the stream. Called by
+        the reader thread of the RegConnection.
+        """
+        self._responses.put(response)
+
+    def set_exception(self, ex):
+        """
+        Ends the stream with an exception. Called by the
+        RegConnection when the connection is lost.
+        """
+        self._responses.put(ex)
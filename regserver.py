@@ -11,112 +11,987 @@ class details by receiving requests written to the server, and
 responding to them with a boolean as to whether that
 request was successful and the pertinent information (
 e.g. either a class list or the details for a class.)
+Clients may send one request per connection, or many requests
+over one persistent connection (see protocol.py).
 """
 
 import argparse
+import signal
 import sqlite3
 import sys
 from sys import stderr, argv
-from os import name
-from socket import socket, SOL_SOCKET, SO_REUSEADDR
-from multiprocessing import Process
-from pickle import load, dump
-from time import process_time
+from os import name, cpu_count, stat
+from socket import socket, SOL_SOCKET, SO_REUSEADDR, SHUT_RDWR,\
+    MSG_PEEK
+from select import select
+from threading import Thread, Lock, Event
+from queue import SimpleQueue, Empty
+from pickle import load, dump, loads, dumps
+from time import sleep, monotonic
 from database import create_condition_and_prepared_values,\
-    get_class_details, get_classes_with_condition
+    get_class_details, get_classes_details, get_classes_with_condition,\
+    iter_classes_with_condition, get_classes_page,\
+    count_classes_with_condition, build_search_index, use_search_index,\
+    use_connection_pool, create_database_url, count_classes,\
+    DATABASE_PATH
+from connectionpool import ConnectionPool
+from catalog import load_catalog
+from snapshot import SNAPSHOT_PATH, Snapshot, build_snapshot,\
+    is_snapshot_current
+from protocol import GET_OVERVIEWS, GET_OVERVIEWS_PAGE,\
+    STREAM_OVERVIEWS, GET_DETAIL, GET_DETAILS, CACHE_STATS, METRICS,\
+    CANCEL, SERVER_ERROR_MESSAGE, SERVER_BUSY_MESSAGE, JSON_MAGIC,\
+    MAGIC_SIZE, HEADER, legacy_command, is_framed, encode_frame,\
+    decode_frame_length, recv_frame, recv_magic
+from codec import MalformedRequestError, get_codec
+from search import Search
+from page import PageQuery, Page, get_page
+from resultcache import start_cache_process
+from refiner import Refiner
+from workerpool import WorkerPool, MAX_WAIT
+from asyncserver import AsyncServer, get_executor_context
+from metrics import Metrics
+from admission import RequestQueue, MAX_PENDING, get_priority
+from loadsim import LatencySimulator, parse_latency, DEFAULT_COMMAND
 
-DATABASE_URL = 'file:reg.sqlite?mode=ro'
+CANCELLED_MESSAGE = 'request cancelled'
+
+# The commands whose latency --latency may set.
+_SIMULATED_COMMANDS = (DEFAULT_COMMAND, GET_OVERVIEWS,
+    GET_OVERVIEWS_PAGE, STREAM_OVERVIEWS, GET_DETAIL, GET_DETAILS)
+
+# The number of classes in each chunk of a streamed class list. The
+# first chunk fills the visible rows of the client's class list.
+STREAM_CHUNK_SIZE = 100
+
+# The most seconds a worker waits for another worker that is
+# computing the same result for the shared result cache (see
+# resultcache.py) before computing it itself.
+COALESCE_TIMEOUT = 5.0
+
+# Fork mode: a worker hands a persistent connection back to the pool
+# once the client has not sent anything for this many seconds after
+# its requests were answered (see workerpool.py), and the parent
+# sheds at most the requests in the first SHED_READ_SIZE bytes that
+# have arrived on a connection.
+RELEASE_LINGER = 0.02
+SHED_READ_SIZE = 64 * 1024
+
+# The number of recent search results each worker process keeps to
+# refine narrower searches from, with --refine.
+REFINE_HISTORY = 8
+
+# The in-memory catalog of this worker process, if the server was
+# started with --catalog (or the Snapshot it maps, with --snapshot),
+# the proxy of the result cache shared by all workers, if it was
+# started with --cache-size, and the Refiner of this worker process,
+# if it was started with --refine, and the Metrics shared by all
+# processes of the server (see init_worker).
+_catalog = None
+_result_cache = None
+_refiner = None
+_metrics = None
+
+# The settings of init_worker that reloads of the database reuse, the
+# version of the database file that this worker answers from, and
+# the states loaded from newer versions that are waiting to be
+# installed (see __watch_database).
+_settings = None
+_version = None
+_reloaded_states = SimpleQueue()
 
 #-----------------------------------------------------------------------
 
-# taken from class pennyserver.py
-def __consume_cpu_time(delay):
+def __simulate_latency(simulator, command, cancelled):
+    # Spends the simulated latency of command, and stops the request
+    # if the client cancels it in the meantime. Returns the time at
+    # which the latency ended.
+    start = monotonic()
+    finished = simulator.simulate(command, cancelled)
+    delayed = monotonic()
+    __observe(command, [('delay', delayed - start)])
+
+    if not finished:
+        raise ValueError(CANCELLED_MESSAGE)
+    return delayed
 
-    i = 0
-    initial_time = process_time()
-    while (process_time() - initial_time) < delay:
-        i += 1  # Do a nonsensical computation.
+#-----------------------------------------------------------------------
+
+def __observe(command, spans):
+    # Records the (span, seconds) tuples of a request of command.
+    if _metrics is not None:
+        _metrics.observe(command, spans)
 
 #-----------------------------------------------------------------------
 
-def handle_client(sock, delay):
+def init_worker(use_catalog, use_index, result_cache, use_refiner,
+    pool_options, snapshot_path, database_path, reload_interval,
+    metrics):
     """
-    Handles a request from the client for either a class list
-    or class details by reading in the request information
-    from the passed-in socket sock: a boolean indicating
-    whether or not it is a search [which is a class list request;
-    if not, it's  a class details request], and the relevant query
-    information [either a Search or a class id]. Then,
-    queries the reg.sqlite database using the database module
-    to return the response information:either True and the requested
-    data, or False and the pertinent error information.
+    Sets up the state of a process that executes requests. Called
+    once in every worker process before it handles any requests.
 
     Keyword arguments:
-        sock -- the socket to be reading and writing information to
+        use_catalog -- whether to answer searches from an in-memory
+            catalog instead of querying the database for each one
+        use_index -- whether to narrow the database queries of
+            searches with an n-gram index of the courses
+        result_cache -- a proxy of the shared ResultCache, or None
+            to compute every result
+        use_refiner -- whether to answer searches that narrow a
+            recent search by filtering its result
+        pool_options -- the keyword arguments of the ConnectionPool
+            of the worker (e.g. cache_size), besides the database
+        snapshot_path -- the path of a snapshot image to answer
+            searches from instead of a catalog of the worker's own,
+            or None
+        database_path -- the path of the registrar database
+        reload_interval -- the number of seconds between checks of
+            whether the database file has changed, or 0 to never
+            reload it
+        metrics -- the Metrics to record the spans of requests in,
+            or None
     """
+    global _result_cache, _settings, _metrics
 
-    print('Forked child process')
+    _result_cache = result_cache
+    _metrics = metrics
+    _settings = (use_catalog, use_index, use_refiner, pool_options,
+        snapshot_path, database_path)
 
-    try:
-        read_flo = sock.makefile(mode='rb')
-        request_type_is_search = load(read_flo)
-        data = load(read_flo)
+    __install_state(__load_state(__get_version(database_path)))
+
+    if reload_interval > 0:
+        Thread(target=__watch_database, args=(reload_interval,),
+            daemon=True).start()
+
+#-----------------------------------------------------------------------
+
+def __get_version(database_path):
+    # Identifies the contents of the database file without reading
+    # it: a new file, or a rewritten one, has another version.
+    status = stat(database_path)
+    return (status.st_ino, status.st_size, status.st_mtime_ns)
+
+#-----------------------------------------------------------------------
+
+def __load_state(version):
+    # Loads everything a worker derives from the database file, as a
+    # (version, catalog, refiner, connection pool, search index)
+    # tuple, without touching the state the worker is using.
+    use_catalog, use_index, use_refiner, pool_options, snapshot_path,\
+        database_path = _settings
+    database_url = create_database_url(database_path)
+
+    print('Database has ' + str(count_classes(database_url))\
+        + ' class overviews')
+
+    pool = ConnectionPool(database_url, **pool_options)
+
+    catalog = None
+    if use_catalog:
+        catalog = load_catalog(database_url)
+        print('Loaded catalog of ' + str(len(catalog)) + ' classes')
+
+    if snapshot_path is not None:
+        # every worker checks the image; any of them may rebuild it
+        if not is_snapshot_current(snapshot_path, database_path):
+            build_snapshot(snapshot_path, database_path)
+            print('Built snapshot image')
+
+        # a worker never answers from a stale image; it queries the
+        # database instead
+        try:
+            catalog = Snapshot(snapshot_path, database_path)
+            print('Mapped snapshot of ' + str(len(catalog))\
+                + ' classes')
+        except (OSError, ValueError) as ex:
+            print('Snapshot not used: ' + str(ex), file=stderr)
+
+    search_index = None
+    if use_index:
+        search_index = build_search_index(database_url)
+        print('Built search index')
+
+    refiner = Refiner(REFINE_HISTORY) if use_refiner else None
+
+    return (version, catalog, refiner, pool, search_index)
 
-        response = None
-        write_flo = sock.makefile(mode='wb')
+#-----------------------------------------------------------------------
+
+def __install_state(state):
+    # Makes the worker answer requests from state, a tuple from
+    # __load_state.
+    global _version, _catalog, _refiner
+
+    _version, _catalog, _refiner, pool, search_index = state
+    use_connection_pool(pool)
+    use_search_index(search_index)
+
+#-----------------------------------------------------------------------
+
+def __install_reloaded_state():
+    # Installs the latest state that __watch_database has loaded, if
+    # any. Called at the start of every request, so that a request
+    # runs against one version of the database from start to end.
+    state = None
+    while True:
+        try:
+            state = _reloaded_states.get_nowait()
+        except Empty:
+            break
+
+    if state is not None:
+        __install_state(state)
+        print('Reloaded database')
 
-        if request_type_is_search:
+#-----------------------------------------------------------------------
+
+def __watch_database(reload_interval):
+    # Runs in a thread of every worker process. Checks the database
+    # file every reload_interval seconds, and once a new version has
+    # stayed unchanged for one interval (so that it is not still
+    # being written), loads it in the background for the next
+    # request to install.
+    database_path = _settings[5]
+    loaded = _version
+    candidate = None
+
+    while True:
+        sleep(reload_interval)
+
+        try:
+            version = __get_version(database_path)
+        except OSError:
+            # e.g. in the middle of being replaced
+            continue
+
+        if version == loaded:
+            candidate = None
+            continue
+        if version != candidate:
+            candidate = version
+            continue
+
+        # a version that cannot be loaded is not tried again until
+        # the file changes once more; the worker keeps the old one
+        loaded = version
+        try:
+            _reloaded_states.put(__load_state(version))
+        except (OSError, ValueError, sqlite3.DatabaseError) as ex:
+            print('Database not reloaded: ' + str(ex), file=stderr)
+
+#-----------------------------------------------------------------------
+
+def execute_request(command, data, simulator, cancelled=None):
+    """
+    Carries out a single request for either a class list or class
+    details, and returns the response as a tuple: either True and
+    the requested data, or False and the pertinent error message.
+    This does not touch any sockets, so every server mode can use
+    it (including from an executor process).
+
+    Keyword arguments:
+        command -- GET_OVERVIEWS [a class list request],
+            GET_OVERVIEWS_PAGE [a request for a page of a class
+            list], GET_DETAIL [a class details request] or
+            GET_DETAILS [a request for the details of several
+            classes]
+        data -- a Search for a class list request, a PageQuery for
+            a page of a class list, the class id as a string for a
+            class details request, or a list of class ids for a
+            request for several class details
+        simulator -- the LatencySimulator that delays the response
+        cancelled -- a function that tells whether the client has
+            cancelled the request, or None
+    """
+
+    __install_reloaded_state()
+
+    # the end of the simulated latency, once it is over
+    delayed = None
+
+    try:
+        if command == GET_OVERVIEWS:
             print('Received command: get_overviews')
 
-            # Consume delay seconds of CPU time.
-            __consume_cpu_time(delay)
+            delayed = __simulate_latency(simulator, command, cancelled)
 
             # if we're executing a search then data will be a Search
-            db_values = create_condition_and_prepared_values(data)
-            response = get_classes_with_condition(db_values[0],\
-                db_values[1])
+            response = __get_cached((command, data.get_key()),
+                lambda: __search_classes(data))
+
+        elif command == GET_OVERVIEWS_PAGE:
+            print('Received command: get_overviews_page')
+
+            delayed = __simulate_latency(simulator, command, cancelled)
+
+            if not isinstance(data, PageQuery):
+                raise ValueError("get_overviews_page needs a page "\
+                    + "query")
+            response = __get_overviews_page(data)
 
         # if it's not a search, then it's a request for class details
-        else:
+        elif command == GET_DETAIL:
             print('Received command: get_detail')
 
-            # Consume delay seconds of CPU time.
-            __consume_cpu_time(delay)
+            delayed = __simulate_latency(simulator, command, cancelled)
 
             # if we're getting class details,
             # data will be the class id as a string
-            response = get_class_details(data)
+            response = __get_cached((command, str(data)),
+                lambda: get_class_details(data))
 
-        dump(True, write_flo) # query succeeded!
-        dump(response, write_flo)
+        elif command == GET_DETAILS:
+            print('Received command: get_details')
 
-        write_flo.flush()
+            delayed = __simulate_latency(simulator, command, cancelled)
+
+            if not isinstance(data, (list, tuple)):
+                raise ValueError("get_details needs a list of "\
+                    + "class ids")
+            response = __get_details_cached(list(data))
+
+        elif command == CACHE_STATS:
+            if _result_cache is None:
+                raise ValueError("the result cache is disabled")
+            response = _result_cache.stats()
+
+        elif command == METRICS:
+            if _metrics is None:
+                raise ValueError("metrics are disabled")
+            response = _metrics.render()
+
+        else:
+            raise ValueError("unknown command " + str(command))
+
+        return (True, response) # query succeeded!
 
     except ValueError as ex:
         print(str(ex), file=stderr)
-        dump(False, write_flo)
-        dump(str(ex), write_flo)
+        return (False, str(ex))
+
+    except sqlite3.Error as ex:
+        # e.g. an InterfaceError for a value that cannot be bound,
+        # which is not a DatabaseError
+        print(str(ex), file=stderr)
+        return (False, SERVER_ERROR_MESSAGE)
+
+    finally:
+        if delayed is not None:
+            __observe(command, [('query', monotonic() - delayed)])
+
+#-----------------------------------------------------------------------
+
+def execute_streamed_request(command, data, simulator,
+    cancelled=None):
+    """
+    Carries out a single request of the framed protocol and yields
+    its responses as tuples: either True and the requested data,
+    or False and the pertinent error message. A STREAM_OVERVIEWS
+    request yields its class list in chunks of STREAM_CHUNK_SIZE
+    classes, each as a (classes, last) tuple, while the database
+    produces them; every other request yields the one response of
+    execute_request.
 
-    except sqlite3.DatabaseError as ex:
+    Keyword arguments:
+        command -- one of the commands in protocol.py
+        data -- the data the command needs (a Search for
+            STREAM_OVERVIEWS)
+        simulator -- the LatencySimulator that delays the response
+        cancelled -- a function that tells whether the client has
+            cancelled the request, or None
+    """
+
+    if command != STREAM_OVERVIEWS:
+        yield execute_request(command, data, simulator, cancelled)
+        return
+
+    __install_reloaded_state()
+
+    try:
+        print('Received command: stream_overviews')
+
+        delayed = __simulate_latency(simulator, command, cancelled)
+
+        # the other search paths build the whole list anyway (and
+        # may have it already), so only the database is streamed
+        if _catalog is None and _refiner is None\
+            and _result_cache is None:
+            db_values = create_condition_and_prepared_values(data)
+            chunks = iter_classes_with_condition(db_values[0],
+                db_values[1], STREAM_CHUNK_SIZE)
+        else:
+            classes = __get_cached((GET_OVERVIEWS, data.get_key()),
+                lambda: __search_classes(data))
+            chunks = (classes[start:start + STREAM_CHUNK_SIZE]\
+                for start in range(0, len(classes), STREAM_CHUNK_SIZE))
+
+        # hold every chunk back until the next one shows whether it
+        # is the last; the time spent sending (or encoding) chunks is
+        # not part of the query
+        query = 0.0
+        resumed = delayed
+        previous = []
+        for chunk in chunks:
+            if previous:
+                query += monotonic() - resumed
+                yield (True, (previous, False))
+                resumed = monotonic()
+            previous = chunk
+
+        query += monotonic() - resumed
+        __observe(command, [('query', query)])
+
+        yield (True, (previous, True))
+
+    except ValueError as ex:
         print(str(ex), file=stderr)
-        dump(False, write_flo)
-        dump('A server error occurred. '+\
-            'Please contact the system administrator.', write_flo)
+        yield (False, str(ex))
+
+    except sqlite3.Error as ex:
+        print(str(ex), file=stderr)
+        yield (False, SERVER_ERROR_MESSAGE)
+
+#-----------------------------------------------------------------------
+
+def __get_overviews_page(query):
+    # Returns the Page that answers query. Like streaming, only
+    # queries of the database read just the rows of the page (and
+    # count the others if asked); the other search paths build the
+    # whole class list anyway (and may have it already).
+    search = query.get_search()
+
+    if _catalog is None and _refiner is None and _result_cache is None:
+        condition, prepared_values =\
+            create_condition_and_prepared_values(search)
+
+        # one more row tells whether more classes follow the page
+        classes = get_classes_page(condition, prepared_values,
+            query.get_after(), query.get_limit() + 1)
+        total = None
+        if query.get_count_total():
+            total = count_classes_with_condition(condition,
+                prepared_values)
+        return Page(classes[:query.get_limit()],
+            len(classes) > query.get_limit(), total)
+
+    classes = __get_cached((GET_OVERVIEWS, search.get_key()),
+        lambda: __search_classes(search))
+    return get_page(classes, query)
+
+#-----------------------------------------------------------------------
+
+def __search_classes(search):
+    if _refiner is not None:
+        return _refiner.search(search,
+            lambda: __search_all_classes(search))
+
+    return __search_all_classes(search)
+
+#-----------------------------------------------------------------------
+
+def __search_all_classes(search):
+    if _catalog is not None:
+        return _catalog.search(search)
+
+    db_values = create_condition_and_prepared_values(search)
+    return get_classes_with_condition(db_values[0], db_values[1])
+
+#-----------------------------------------------------------------------
+
+def __get_cached(key, compute):
+    # Returns the result stored under key in the shared result cache,
+    # or computes it with compute() and stores it. Errors raised by
+    # compute() are not cached. A worker that needs a result another
+    # worker is computing waits for that result instead.
+    if _result_cache is None:
+        return compute()
+
+    # workers that have not reloaded the database yet must not share
+    # results with those that have
+    key = (_version,) + key
+
+    try:
+        cached = _result_cache.claim(key, COALESCE_TIMEOUT)
+    except (OSError, EOFError) as ex:
+        # the cache process is gone; keep serving without it
+        print(ex, file=stderr)
+        return compute()
+
+    if cached is not None:
+        return loads(cached)
+
+    try:
+        result = compute()
+    except BaseException:
+        # the waiting workers must compute the result themselves
+        try:
+            _result_cache.release(key)
+        except (OSError, EOFError) as ex:
+            print(ex, file=stderr)
+        raise
+
+    try:
+        _result_cache.put(key, dumps(result))
+    except (OSError, EOFError) as ex:
+        print(ex, file=stderr)
+
+    return result
 
-    write_flo.flush()
-    sock.close()
+#-----------------------------------------------------------------------
+
+def __get_details_cached(class_ids):
+    # Returns the details of the classes with class_ids (None for
+    # classes that do not exist), taking what it can from the shared
+    # result cache under the same keys as GET_DETAIL, and querying
+    # the rest in one batch.
+    if _result_cache is None:
+        return get_classes_details(class_ids)
+
+    keys = [(_version, GET_DETAIL, str(class_id))\
+        for class_id in class_ids]
+
+    try:
+        cached = [_result_cache.get(key) for key in keys]
+    except (OSError, EOFError) as ex:
+        print(ex, file=stderr)
+        return get_classes_details(class_ids)
+
+    missing = [position for position, value in enumerate(cached)\
+        if value is None]
+    queried = get_classes_details([class_ids[position]\
+        for position in missing])
+
+    details = [None if value is None else loads(value)\
+        for value in cached]
+    for position, class_details in zip(missing, queried):
+        details[position] = class_details
+
+    try:
+        for position, class_details in zip(missing, queried):
+            # like errors, classes that do not exist are not cached
+            if class_details is not None:
+                _result_cache.put(keys[position], dumps(class_details))
+    except (OSError, EOFError) as ex:
+        print(ex, file=stderr)
+
+    return details
+
+#-----------------------------------------------------------------------
+
+def __coalescing_key(command, data):
+    # Returns the key that requests of command with the same result
+    # as a request of command with data share, or None if it must be
+    # executed on its own (see AsyncServer).
+    if command in (GET_OVERVIEWS, STREAM_OVERVIEWS)\
+        and isinstance(data, Search):
+        return (command, data.get_key())
+    if command == GET_OVERVIEWS_PAGE and isinstance(data, PageQuery):
+        return (command, data.get_key())
+    if command == GET_DETAIL and isinstance(data, (str, int)):
+        return (command, str(data))
+    if command == GET_DETAILS and isinstance(data, (list, tuple)):
+        return (command, tuple(str(class_id) for class_id in data))
+    return None
+
+#-----------------------------------------------------------------------
+
+def handle_client(sock, magic, simulator, idle_timeout,
+    allow_pickle, max_pending):
+    """
+    Handles the requests of one client connection. A client using
+    the original protocol sends a single request: a boolean
+    indicating whether or not it is a search [which is a class list
+    request; if not, it's  a class details request], and the relevant
+    query information [either a Search or a class id]. A client
+    using the framed protocol may send any number of requests, each
+    tagged with a request id, in the encoding named by the magic
+    number it starts with (see codec.py). Unless allow_pickle is
+    set, clients that send pickles are refused, since unpickling
+    runs code chosen by the client. Each request is answered
+    by querying the reg.sqlite database using the database module:
+    either True and the requested data, or False and the pertinent
+    error information.
+
+    Once every request of a framed connection has been answered and
+    the client has not sent another one for RELEASE_LINGER seconds,
+    returns the magic number of the connection, so that the worker
+    hands the connection back to the WorkerPool, which passes it to
+    handle_client again (with that magic number) when the client
+    sends more requests. Returns None if the connection is to be
+    closed.
+
+    Keyword arguments:
+        sock -- the socket to be reading and writing information to
+        magic -- the magic number the connection started with, or
+            None if nothing has been read from it yet
+        simulator -- the LatencySimulator that delays each response
+        idle_timeout -- the number of seconds the server waits for
+            the rest of a request before it closes the connection
+        allow_pickle -- whether to serve clients of the original
+            protocol and of version 1 of the framed protocol
+        max_pending -- the number of requests of a persistent
+            connection that may wait while the worker is busy; the
+            worker sheds requests beyond that (see admission.py)
+    """
+
+    write_flo = sock.makefile(mode='wb')
+
+    if magic is None:
+        accepted = monotonic()
+        magic = recv_magic(sock)
+        __observe(None, [('accept', monotonic() - accepted)])
+
+    if magic is not None:
+        codec = get_codec(magic, allow_pickle)
+        if __handle_framed_requests(sock, write_flo, codec, simulator,
+            idle_timeout, max_pending):
+            return magic
+    elif not allow_pickle:
+        print('Refused client of the original protocol', file=stderr)
+    else:
+        read_flo = sock.makefile(mode='rb')
+        start = monotonic()
+        request_type_is_search = load(read_flo)
+        data = load(read_flo)
+        read_time = monotonic()
+
+        command = legacy_command(request_type_is_search)
+        successful, response = execute_request(command, data,
+            simulator)
+
+        executed = monotonic()
+        dump(successful, write_flo)
+        dump(response, write_flo)
+        encoded = monotonic()
+        write_flo.flush()
+
+        sent = monotonic()
+        __observe(command, [('decode', read_time - start),
+            ('encode', encoded - executed), ('send', sent - encoded),
+            ('total', sent - read_time)])
+
+    print ('Closed socket in worker process')
+    return None
+
+#-----------------------------------------------------------------------
+
+def __handle_framed_requests(sock, write_flo, codec, simulator,
+    idle_timeout, max_pending):
+
+    # A reader thread reads requests while this thread works on them,
+    # so that a cancellation can reach a request that is waiting or
+    # in progress. Requests are answered one at a time, the most
+    # urgent first; the reader thread answers the requests that are
+    # shed itself, so writes to the socket take write_lock. Returns
+    # whether the reader thread has released the connection (rather
+    # than the client closing it).
+    requests = RequestQueue(max_pending)
+    tracker = _RequestTracker()
+    write_lock = Lock()
+    released = Event()
+
+    reader = Thread(target=__read_requests, args=[sock, write_flo,
+        write_lock, codec, requests, tracker, released], daemon=True)
+    reader.start()
 
-    print ('Closed socket in child process')
-    print ('Exiting child process')
+    try:
+        while True:
+            # The reader thread releases an idle connection, so this
+            # only times out if a client stops in the middle of a
+            # request.
+            try:
+                request = requests.get(timeout=idle_timeout)
+            except Empty:
+                print('Closing idle connection')
+                return False
+
+            if request is None:
+                return released.is_set()
+
+            request_id, command, data, read_time = request
+            __observe(command, [('dispatch', monotonic() - read_time)])
+
+            def cancelled(request_id=request_id):
+                return tracker.is_cancelled(request_id)
+
+            try:
+                # a request cancelled while it waited is not started
+                if cancelled():
+                    print('Cancelled request')
+                    continue
+
+                # every chunk of a streamed response is sent as soon
+                # as it is ready; nothing more is sent once the
+                # request has been cancelled
+                responses = execute_streamed_request(command, data,
+                    simulator, cancelled)
+                encoding = 0.0
+                sending = 0.0
+                for successful, response in responses:
+                    if cancelled():
+                        print('Cancelled request')
+                        responses.close()
+                        break
+                    start = monotonic()
+                    frame = encode_frame(codec.encode_response(
+                        request_id, command, successful, response))
+                    encoded = monotonic()
+                    with write_lock:
+                        write_flo.write(frame)
+                        write_flo.flush()
+                    encoding += encoded - start
+                    sending += monotonic() - encoded
+
+                __observe(command, [('encode', encoding),
+                    ('send', sending),
+                    ('total', monotonic() - read_time)])
+            finally:
+                tracker.finish(request_id)
+    finally:
+        # wakes up the reader thread if it is still reading
+        if not released.is_set():
+            try:
+                sock.shutdown(SHUT_RDWR)
+            except OSError:
+                pass
+        reader.join()
+
+#-----------------------------------------------------------------------
+
+def __read_requests(sock, write_flo, write_lock, codec, requests,
+    tracker, released):
+    # Reads the requests of a framed connection into requests until
+    # the connection is closed, or until every request has been
+    # answered and the client has been quiet for RELEASE_LINGER
+    # seconds (then sets released); either way, closes requests.
+    # Cancellations are handled here, as soon as they arrive, and so
+    # are requests shed because too many are waiting.
+    try:
+        while True:
+            if not select([sock], [], [], RELEASE_LINGER)[0]:
+                if tracker.is_idle(RELEASE_LINGER):
+                    released.set()
+                    break
+                continue
+
+            body = recv_frame(sock)
+            if body is None:
+                break
+
+            read_time = monotonic()
+            try:
+                request_id, command, data = codec.decode_request(body)
+            except MalformedRequestError as ex:
+                __answer_malformed(write_flo, write_lock, codec, ex)
+                continue
+            __observe(command, [('decode', monotonic() - read_time)])
+
+            if command == CANCEL:
+                tracker.cancel(data)
+            else:
+                tracker.start(request_id)
+                shed = requests.put((request_id, command, data,
+                    read_time), get_priority(command))
+                if shed is not None:
+                    __shed_request(write_flo, write_lock, codec, shed,
+                        tracker)
+
+    except Exception as ex:
+        print(ex, file=stderr)
+
+    finally:
+        requests.close()
+
+#-----------------------------------------------------------------------
+
+def __answer_malformed(write_flo, write_lock, codec, error):
+    # Answers a request that could not be decoded with the error of
+    # its MalformedRequestError, under the id it was sent with (None
+    # if even that could not be decoded).
+    print(error, file=stderr)
+
+    with write_lock:
+        write_flo.write(encode_frame(codec.encode_response(
+            error.request_id, error.command, False, str(error))))
+        write_flo.flush()
+
+#-----------------------------------------------------------------------
+
+def __shed_request(write_flo, write_lock, codec, request, tracker):
+    # Answers a request that waited in vain with SERVER_BUSY_MESSAGE.
+    request_id, command, _, _ = request
+    print('Server busy, shed request')
+
+    try:
+        if not tracker.is_cancelled(request_id):
+            with write_lock:
+                write_flo.write(encode_frame(codec.encode_response(
+                    request_id, command, False, SERVER_BUSY_MESSAGE)))
+                write_flo.flush()
+    finally:
+        tracker.finish(request_id)
+
+#-----------------------------------------------------------------------
+
+def shed_client(sock, magic, allow_pickle):
+    """
+    Answers the requests that a client connection has sent with
+    SERVER_BUSY_MESSAGE, without working on them, because no worker
+    was free to handle the connection in time. Called in the parent
+    process of fork mode (see workerpool.py), which also accepts and
+    dispatches the connections of every other client, so it never
+    blocks: it only answers the complete requests that have already
+    arrived, and a request that has only partly arrived is left for
+    a worker. Returns the magic number of a framed connection to
+    keep it open, or None to close the connection.
+
+    Requests are only decoded from JSON. A client of the original
+    protocol is answered without reading its request, and a client
+    of version 1 of the framed protocol is disconnected, since
+    unpickling its requests would run code chosen by the client in
+    the parent process.
+
+    Keyword arguments:
+        sock -- the socket of the connection
+        magic -- the magic number the connection started with, or
+            None if nothing has been read from it yet
+        allow_pickle -- whether to answer clients of the original
+            protocol
+    """
+
+    sock.setblocking(False)
+
+    try:
+        # peeked, so that a partial request stays in the socket
+        buffered = sock.recv(SHED_READ_SIZE, MSG_PEEK)
+        if not buffered:
+            return None
+
+        consumed = 0
+        if magic is None:
+            if not is_framed(buffered[:1]):
+                if allow_pickle:
+                    print('Server busy, shed request')
+                    sock.send(dumps(False) + dumps(SERVER_BUSY_MESSAGE))
+                # read what has arrived, so that closing the socket
+                # does not reset the connection before the answer
+                sock.recv(len(buffered))
+                return None
+
+            magic = buffered[:MAGIC_SIZE]
+            consumed = MAGIC_SIZE
+
+        if magic != JSON_MAGIC:
+            return None
+        codec = get_codec(magic)
+
+        answers = []
+        while consumed + HEADER.size <= len(buffered):
+            start = consumed + HEADER.size
+            end = start + decode_frame_length(buffered[consumed:start])
+            if end > len(buffered):
+                break
+
+            try:
+                request_id, command, _ = codec.decode_request(
+                    buffered[start:end])
+            except MalformedRequestError as ex:
+                answers.append(encode_frame(codec.encode_response(
+                    ex.request_id, ex.command, False, str(ex))))
+                consumed = end
+                continue
+            if command != CANCEL:
+                print('Server busy, shed request')
+                answers.append(encode_frame(codec.encode_response(
+                    request_id, command, False, SERVER_BUSY_MESSAGE)))
+            consumed = end
+
+        if len(sock.recv(consumed)) < consumed:
+            return None
+
+        # a client that does not read its answers is not waited for
+        answer = b''.join(answers)
+        if answer and sock.send(answer) < len(answer):
+            return None
+        return magic
+
+    except Exception as ex:
+        print(ex, file=stderr)
+        return None
+
+    finally:
+        sock.setblocking(True)
+
+#-----------------------------------------------------------------------
+
+class _RequestTracker:
+    """
+    The ids of the requests of one connection that have been read but
+    not yet answered, and which of them have been cancelled. Shared
+    by the reader thread and the thread that answers the requests.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._active = set()
+        self._cancelled = set()
+        self._finished = monotonic()
+
+    def start(self, request_id):
+        """
+        Records that a request has been read.
+        """
+        with self._lock:
+            self._active.add(request_id)
+
+    def cancel(self, request_id):
+        """
+        Records that the client has cancelled a request; ignored if
+        the request has already been answered.
+        """
+        with self._lock:
+            if request_id in self._active:
+                self._cancelled.add(request_id)
+
+    def is_cancelled(self, request_id):
+        """
+        Returns whether the client has cancelled a request.
+        """
+        with self._lock:
+            return request_id in self._cancelled
+
+    def finish(self, request_id):
+        """
+        Records that a request has been answered (or abandoned).
+        """
+        with self._lock:
+            self._active.discard(request_id)
+            self._cancelled.discard(request_id)
+            self._finished = monotonic()
+
+    def is_idle(self, quiet):
+        """
+        Returns whether every request that has been read has been
+        answered, the last one at least quiet seconds ago.
+        """
+        with self._lock:
+            return not self._active\
+                and monotonic() - self._finished >= quiet
 
 #-----------------------------------------------------------------------
 
 def main():
     """
-    Parses the command-line argument of a port, and connects the
-    server to this port. Then, until server is closed, handles requests
-    for class lists (including overviews) and class details
-    from the registrar database.
+    Parses the command-line arguments (a port, a delay and optionally
+    the simulated latency of each command, the server mode and number
+    of worker processes), and connects the server to this port. Then,
+    until server is closed, handles requests for class lists
+    (including overviews) and class details from the registrar
+    database, either with a pool of pre-forked worker processes (fork
+    mode) or with an asyncio event loop that runs the queries in a
+    pool of executor processes (asyncio mode).
     """
 
     try:
@@ -124,13 +999,106 @@ def main():
         description="Server for the registrar application")
         parser.add_argument("port", type=int,
         help = "the port at which the server should listen")
-        parser.add_argument("delay", type=int,
+        parser.add_argument("delay", type=__latency,
         help = "the number of seconds that the server should\
-            delay before responding to each client request")
+            delay before responding to each client request, unless\
+            --latency sets the latency of the request's command")
+        parser.add_argument("--latency", action="append", default=[],
+        type=__command_latency, metavar="COMMAND=LATENCY",
+        help = "the latency of the requests of one command (e.g.\
+            get_detail=exp:0.05), as SECONDS, fixed:SECONDS,\
+            uniform:LOW:HIGH or exp:MEAN; may be repeated, and\
+            *=LATENCY replaces the delay of every other command")
+        parser.add_argument("--cpu-bound", action="store_true",
+        help = "spend the latency of each request burning CPU time,\
+            as the original server did, instead of sleeping")
+        parser.add_argument("--workers", type=__positive_int,
+        default=cpu_count() or 1,
+        help = "the number of worker processes that handle client\
+            requests (default: the number of CPUs)")
+        parser.add_argument("--idle-timeout", type=float, default=5.0,
+        help = "the number of seconds a persistent client connection\
+            may stay idle before the server closes it (default: 5)")
+        parser.add_argument("--mode", choices=["fork", "asyncio"],
+        default="fork",
+        help = "fork: pre-forked worker processes that each handle\
+            the requests of one connection at a time, while the main\
+            process holds the idle connections; asyncio: one event\
+            loop holds all connections and runs the queries in worker\
+            processes (default: fork)")
+        parser.add_argument("--max-wait", type=float, default=MAX_WAIT,
+        help = "fork mode: the number of seconds the requests of a\
+            client may wait for a free worker before the server\
+            answers them that it is too busy (default: "\
+            + str(MAX_WAIT) + ")")
+        overviews = parser.add_mutually_exclusive_group()
+        overviews.add_argument("--catalog", action="store_true",
+        help = "load the class overviews into memory in every worker\
+            at startup and answer searches from there instead of\
+            querying the database for each one")
+        overviews.add_argument("--snapshot", nargs="?",
+        const=SNAPSHOT_PATH, default=None, metavar="PATH",
+        help = "answer searches from a snapshot image of the class\
+            overviews that all workers map into memory and share;\
+            the image is (re)built at startup if it is missing or\
+            stale (default path: " + SNAPSHOT_PATH + ")")
+        parser.add_argument("--index", action="store_true",
+        help = "build an n-gram index of the courses in every worker\
+            at startup and use it to narrow the database queries of\
+            searches")
+        parser.add_argument("--refine", action="store_true",
+        help = "answer a search that narrows one of the last few\
+            searches of a worker by filtering that search's result\
+            instead of searching all classes again")
+        parser.add_argument("--max-running", type=__positive_int,
+        default=None,
+        help = "asyncio mode: the number of requests that executor\
+            processes work on at once (default: --workers); in fork\
+            mode, every worker works on one request at a time")
+        parser.add_argument("--max-pending", type=__positive_int,
+        default=MAX_PENDING,
+        help = "the number of requests that may wait for a worker,\
+            in the whole server (asyncio mode) or per connection (fork\
+            mode); once that many wait, the server answers the least\
+            urgent requests that it is too busy: class details come\
+            before searches, which come before prefetches of class\
+            details (default: " + str(MAX_PENDING) + ")")
+        parser.add_argument("--no-pickle", action="store_true",
+        help = "refuse clients that send pickled requests (the\
+            original protocol and version 1 of the framed protocol),\
+            since unpickling runs code chosen by the client")
+        parser.add_argument("--database", type=str,
+        default=DATABASE_PATH,
+        help = "the path of the registrar database (default: "\
+            + DATABASE_PATH + ")")
+        parser.add_argument("--reload-interval", type=float,
+        default=2.0,
+        help = "the number of seconds between checks of whether the\
+            database file has changed; workers load a changed file\
+            in the background and switch to it between requests\
+            (default: 2; 0 never reloads)")
+        parser.add_argument("--db-cache", type=float, default=2,
+        help = "the number of megabytes of database pages each open\
+            connection of a worker keeps in memory (default: 2)")
+        parser.add_argument("--db-mmap", type=float, default=0,
+        help = "the number of megabytes of the database file each\
+            connection reads through a memory map (default: 0, none)")
+        parser.add_argument("--db-immutable", action="store_true",
+        help = "tell SQLite that the database file never changes, so\
+            that connections skip locking; replace the file (e.g.\
+            with mv) instead of modifying it while the server runs")
+        parser.add_argument("--cache-size", type=float, default=0,
+        help = "the number of megabytes of results to keep in a cache\
+            shared by all workers (default: 0, no cache)")
+        parser.add_argument("--cache-ttl", type=float, default=None,
+        help = "the number of seconds cached results stay valid\
+            (default: until evicted)")
 
         args = parser.parse_args()
         port = args.port
-        delay = args.delay
+        simulator = LatencySimulator([(DEFAULT_COMMAND, args.delay)]\
+            + args.latency,
+            args.cpu_bound)
 
         try:
             server_sock = socket()
@@ -144,20 +1112,42 @@ def main():
             server_sock.listen()
             print('Listening')
 
-            while True:
-                try:
-                    sock, address = server_sock.accept()
-                    with sock:
-                        print('Accepted connection, opened socket for '\
-                            + str(address))
+            cache_manager = None
+            result_cache = None
+            if args.cache_size > 0:
+                cache_manager, result_cache = start_cache_process(
+                    int(args.cache_size * 1024 * 1024), args.cache_ttl)
+                print('Started result cache process')
+
+            pool_options = {'cache_size': int(args.db_cache * 1024),
+                'mmap_size': int(args.db_mmap * 1024 * 1024),
+                'immutable': args.db_immutable}
+            if args.snapshot is not None and not is_snapshot_current(
+                args.snapshot, args.database):
+                build_snapshot(args.snapshot, args.database)
+                print('Built snapshot image')
 
-                        process = Process(target=handle_client,
-                            args=[sock, delay])
-                        process.start()
+            print('Simulated latency: ' + str(simulator))
+
+            # shared with processes of the kind the mode starts
+            metrics = Metrics(get_executor_context()\
+                if args.mode == 'asyncio' else None)
+
+            initargs = [args.catalog, args.index, result_cache,
+                args.refine, pool_options, args.snapshot,
+                args.database, args.reload_interval, metrics]
+
+            try:
+                if args.mode == 'asyncio':
+                    __serve_asyncio(server_sock, args, simulator,
+                        initargs, metrics)
+                else:
+                    __serve_forked(server_sock, args, simulator,
+                        initargs)
+            finally:
+                if cache_manager is not None:
+                    cache_manager.shutdown()
 
-                except Exception as ex:
-                    print(ex, file=stderr)
-                    sys.exit(1)
         except Exception as ex:
             print(ex, file=stderr)
             sys.exit(1)
@@ -166,6 +1156,69 @@ def main():
         print(argv[0] + ": " + str(ex), file=stderr)
         sys.exit(2)
 
+#-----------------------------------------------------------------------
+
+def __serve_forked(server_sock, args, simulator, initargs):
+    workers = args.workers
+    pool = WorkerPool(server_sock, workers, handle_client,
+        [simulator, args.idle_timeout, not args.no_pickle,
+        args.max_pending], init_worker, initargs, shed_client,
+        [not args.no_pickle], args.max_wait, args.idle_timeout)
+
+    # drain the workers on SIGTERM just like on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: pool.stop())
+
+    pool.start()
+    print('Started ' + str(workers) + ' worker processes')
+
+    try:
+        pool.supervise()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('Draining worker processes')
+        pool.shutdown()
+        server_sock.close()
+
+#-----------------------------------------------------------------------
+
+def __serve_asyncio(server_sock, args, simulator, initargs, metrics):
+    server = AsyncServer(server_sock, args.workers, args.idle_timeout,
+        not args.no_pickle, execute_streamed_request, [simulator],
+        init_worker, initargs, metrics, args.max_running,
+        args.max_pending, __coalescing_key)
+
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server_sock.close()
+
+#-----------------------------------------------------------------------
+
+def __positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return value
+
+#-----------------------------------------------------------------------
+
+def __latency(text):
+    try:
+        return parse_latency(text)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex)) from ex
+
+#-----------------------------------------------------------------------
+
+def __command_latency(text):
+    command, _, latency = text.partition('=')
+    if command not in _SIMULATED_COMMANDS:
+        raise argparse.ArgumentTypeError("unknown command " + command)
+    return (command, __latency(latency))
+
 #-----------------------------------------------------------------------
 if __name__ == '__main__':
     main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# regstats.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Command-line tool for operators of the registrar server. Asks a
+running server for the counters of its shared result cache and
+prints them, or, with --metrics, for the histograms of how long the
+spans of its requests take, in the Prometheus text format (e.g. for
+the textfile collector of the node exporter).
+"""
+
+import argparse
+import sys
+from sys import argv, stderr
+from regconnection import RegConnection
+from protocol import CACHE_STATS, METRICS
+
+#-----------------------------------------------------------------------
+
+def main():
+    """
+    Parses the command-line arguments (host and port of the server),
+    requests the result cache counters and prints one per line, or
+    requests the span histograms and prints them.
+    """
+
+    try:
+        parser = argparse.ArgumentParser(allow_abbrev=False,
+        description="Statistics of the registrar server")
+        parser.add_argument("host", type=str,
+        help="the host on which the server is running")
+        parser.add_argument("port", type=int,
+        help = "the port at which the server is listening")
+        parser.add_argument("--metrics", action="store_true",
+        help = "print the span histograms of the server's requests\
+            instead of the result cache counters")
+
+        args = parser.parse_args()
+
+        connection = RegConnection(args.host, args.port)
+        try:
+            successful, data = connection.request(
+                METRICS if args.metrics else CACHE_STATS, None)
+        except OSError as ex:
+            print(argv[0] + ": " + str(ex), file=stderr)
+            sys.exit(1)
+        finally:
+            connection.close()
+
+        if not successful:
+            print(argv[0] + ": " + str(data), file=stderr)
+            sys.exit(1)
+
+        if args.metrics:
+            print(data, end='')
+            return
+
+        for name, value in data.items():
+            print(name + ': ' + str(value))
+
+        lookups = data['hits'] + data['misses']
+        if lookups > 0:
+            print('hit_ratio: ' + format(data['hits'] / lookups, '.3f'))
+
+    except argparse.ArgumentError as ex:
+        print(argv[0] + ": " + str(ex), file=stderr)
+        sys.exit(2)
+
+#-----------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# resultcache.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. A cache of request results that all
+worker processes share. The cache lives in a separate local process
+(a multiprocessing manager), and the workers talk to it through
+proxies. Results are stored pickled, which bounds the memory the
+cache uses by the number of bytes it holds.
+
+A worker that misses a result may claim its key while it computes
+the result, so that workers that need the same result meanwhile
+wait for it instead of computing it again.
+"""
+
+import signal
+from threading import Lock, Condition
+from time import monotonic
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+
+#-----------------------------------------------------------------------
+
+class ResultCache:
+    """
+    A thread-safe cache of pickled results that evicts the least
+    recently used entries to stay within max_bytes, and, if ttl is
+    given, treats entries older than ttl seconds as missing. Counts
+    hits, misses, evictions and expirations for operators, and how
+    many of the hits waited for a claimed key (coalesced).
+
+    Nothing is ever removed explicitly. The server puts the version of
+    the database into every key, so once the database changes, the
+    entries of the old version are no longer looked up and age out:
+    they are evicted as least recently used, or they expire.
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = Lock()
+
+        # notified whenever a claimed key is put or released
+        self._filled = Condition(self._lock)
+        self._claims = set()
+
+        # key -> (pickled result, time at which it expires or None),
+        # least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._coalesced = 0
+
+    def get(self, key):
+        """
+        Returns the pickled result stored under key, or None if there
+        is none (or it has expired).
+
+        Keyword arguments:
+            key -- a hashable, picklable key
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return value
+
+    def claim(self, key, timeout):
+        """
+        Returns the pickled result stored under key like get, but if
+        another worker has claimed key, waits up to timeout seconds
+        for that worker to put the result. If it returns None, the
+        caller has claimed key and must put the result or release
+        key.
+
+        Keyword arguments:
+            key -- a hashable, picklable key
+            timeout -- the most seconds to wait for a claimed key
+        """
+        deadline = monotonic() + timeout
+        waited = False
+
+        with self._lock:
+            while True:
+                value = self._lookup(key)
+                if value is not None:
+                    self._hits += 1
+                    if waited:
+                        self._coalesced += 1
+                    return value
+
+                remaining = deadline - monotonic()
+                if key not in self._claims or remaining <= 0:
+                    break
+                self._filled.wait(remaining)
+                waited = True
+
+            # a worker that gave up waiting computes the result too
+            self._claims.add(key)
+            self._misses += 1
+            return None
+
+    def release(self, key):
+        """
+        Gives up the claim on key without putting a result (e.g.
+        because computing it failed), so that the next worker that
+        needs it computes it.
+
+        Keyword arguments:
+            key -- a key claimed with claim
+        """
+        with self._lock:
+            self._claims.discard(key)
+            self._filled.notify_all()
+
+    def put(self, key, value):
+        """
+        Stores the pickled result value under key, evicting least
+        recently used entries as needed. A value larger than the
+        whole cache is not stored. Releases the claim on key, if any.
+
+        Keyword arguments:
+            key -- a hashable, picklable key
+            value -- the pickled result, as bytes
+        """
+        expires = None if self._ttl is None else monotonic() + self._ttl
+
+        with self._lock:
+            if key in self._claims:
+                self._claims.discard(key)
+                self._filled.notify_all()
+
+            if len(value) > self._max_bytes:
+                return
+
+            if key in self._entries:
+                self._remove(key)
+
+            while self._bytes + len(value) > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+            self._entries[key] = (value, expires)
+            self._bytes += len(value)
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache counters and its current
+        size.
+        """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'coalesced': self._coalesced,
+                'entries': len(self._entries), 'bytes': self._bytes,
+                'max_bytes': self._max_bytes, 'ttl': self._ttl}
+
+    def _lookup(self, key):
+        # Returns the value of the entry of key, or None if there is
+        # none or it has expired.
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[1] is not None\
+            and entry[1] <= monotonic():
+            self._remove(key)
+            self._expirations += 1
+            entry = None
+
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+#-----------------------------------------------------------------------
+
+class CacheManager(BaseManager):
+    """
+    The manager whose server process holds the shared ResultCache.
+    """
+
+CacheManager.register('ResultCache', ResultCache)
+
+#-----------------------------------------------------------------------
+
+def _ignore_sigint():
+    # The server shuts the cache process down itself after draining
+    # its workers, which may still need the cache.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+#-----------------------------------------------------------------------
+
+def start_cache_process(max_bytes, ttl=None):
+    """
+    Starts the local process that holds the shared cache. Returns
+    the CacheManager (to shut the process down with) and a proxy of
+    the ResultCache, which can be handed to worker processes.
+
+    Keyword arguments:
+        max_bytes -- the most bytes of pickled results to keep
+        ttl -- the number of seconds results stay valid, or None for
+            no limit
+    """
+    manager = CacheManager()
+    manager.start(_ignore_sigint)
+    return (manager, manager.ResultCache(max_bytes, ttl))
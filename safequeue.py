@@ -5,36 +5,104 @@
 # Author: Bob Dondero
 #-----------------------------------------------------------------------
 
-from threading import RLock
+"""
+Module on the client side. A queue that worker threads use to hand
+results to the GUI thread. Instead of polling it, the GUI thread can
+be woken up whenever the queue stops being empty.
+"""
 
-# Each linked list node is implemented as a list with two elements.
-# Element 0 references an item, and element 1 references the next
-# node of the linked list.
-_ITEM = 0
-_NEXT = 1
+from collections import deque
+from queue import Full
+from threading import Lock, Condition
+
+#-----------------------------------------------------------------------
 
 class SafeQueue:
+    """
+    A thread-safe first-in first-out queue. get returns None instead
+    of blocking when the queue is empty, unless asked to wait. If a
+    capacity is given, put waits while the queue holds that many
+    items, so that a fast producer cannot run ahead of a slow
+    consumer without bound.
 
-    def __init__(self):
-        self._head_node = None
-        self._tail_node = None
-        self._lock = RLock()
+    If a wakeup function is given, put calls it (without holding any
+    lock) whenever it makes an empty queue non-empty. A consumer that
+    empties the queue each time it is woken up (e.g. with drain)
+    therefore misses no items, and is woken up once per batch rather
+    than once per item.
+    """
 
-    def put(self, item):
-        with self._lock:
-            new_node = [item, None]
-            if self._tail_node is None:
-                self._head_node = new_node
-            else:
-                self._tail_node[_NEXT] = new_node
-            self._tail_node = new_node
+    def __init__(self, capacity=None, wakeup=None):
+        self._items = deque()
+        self._capacity = capacity
+        self._wakeup = wakeup
+
+        lock = Lock()
+        self._not_empty = Condition(lock)
+        self._not_full = Condition(lock)
+
+    def __len__(self):
+        with self._not_empty:
+            return len(self._items)
+
+    def put(self, item, timeout=None):
+        """
+        Appends item to the queue, waiting while the queue is full.
+        Raises queue.Full if the queue is still full after timeout
+        seconds.
 
-    def get(self):
-        with self._lock:
-            if self._head_node is None:
+        Keyword arguments:
+            item -- the object to append (not None)
+            timeout -- the most seconds to wait, or None to wait
+                as long as it takes
+        """
+        with self._not_full:
+            if self._capacity is not None:
+                if not self._not_full.wait_for(
+                    lambda: len(self._items) < self._capacity, timeout):
+                    raise Full
+            was_empty = not self._items
+            self._items.append(item)
+            self._not_empty.notify()
+
+        if was_empty and self._wakeup is not None:
+            self._wakeup()
+
+    def get(self, block=False, timeout=None):
+        """
+        Removes and returns the first item of the queue, or returns
+        None if the queue is empty (after waiting for an item if block
+        is set).
+
+        Keyword arguments:
+            block -- whether to wait for an item if the queue is empty
+            timeout -- the most seconds to wait, or None to wait
+                as long as it takes
+        """
+        with self._not_empty:
+            if block:
+                self._not_empty.wait_for(lambda: self._items, timeout)
+            if not self._items:
                 return None
-            item = self._head_node[_ITEM]
-            self._head_node = self._head_node[_NEXT]
-            if self._head_node is None:
-                self._tail_node = None
+            item = self._items.popleft()
+            self._not_full.notify()
             return item
+
+    def drain(self, max_items=None):
+        """
+        Removes and returns the items of the queue as a list, first
+        item first, without waiting; the list is empty if the queue
+        is.
+
+        Keyword arguments:
+            max_items -- the most items to remove, or None for all
+        """
+        with self._not_empty:
+            if max_items is None or max_items >= len(self._items):
+                items = list(self._items)
+                self._items.clear()
+            else:
+                items = [self._items.popleft()\
+                    for _ in range(max_items)]
+            self._not_full.notify(len(items))
+            return items
@@ -5,6 +5,10 @@
 # Author: AnneMarie Caballero and Jen Secrest
 #-----------------------------------------------------------------------
 
+from likepattern import fold_case
+
+#-----------------------------------------------------------------------
+
 class Search:
     """
     Creates a search object that represents a way to
@@ -22,6 +26,16 @@ class Search:
         return '( ' + self._dept + ', ' + self._number\
             + ', ' + self._area + ', ' + self._title + ')'
 
+    def get_key(self):
+        """
+        Returns the normalized (dept, number, area, title) tuple of
+        the Search object. Searches with the same key always have
+        the same results, because searches ignore the case of ASCII
+        letters.
+        """
+        return (fold_case(self._dept), fold_case(self._number),
+            fold_case(self._area), fold_case(self._title))
+
     def get_dept(self):
         """
         Returns the department of the Search object.
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# snapshot.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. A read-only binary image of the class
+overviews (the data of a Catalog) in a file that worker processes
+memory-map. Every worker maps the same file, so they all share one
+copy of its pages through the operating system's page cache, and
+searches read the image in place instead of copies in each worker.
+
+The image is a header followed by nine columns: the class ids,
+depts, course numbers, areas and titles, then the case-folded depts,
+course numbers, areas and titles. A column is an array of row count
++ 1 unsigned 32-bit offsets (in the byte order of the machine that
+built it) followed by the UTF-8 values, each ending with a NUL byte,
+padded to a multiple of 4 bytes; value i of a column is the bytes
+from offset i to offset i + 1, minus the NUL. The header holds a
+SHA-256 checksum of the database file the image was built from,
+which tells whether the image is stale, and one of the columns,
+which tells whether the image is intact.
+"""
+
+import os
+import sys
+import mmap
+import hashlib
+import struct
+from array import array
+from bisect import bisect_right
+from regclass import RegClass
+from database import DATABASE_PATH, create_database_url
+from catalog import read_overviews
+from likepattern import fold_case
+
+#-----------------------------------------------------------------------
+
+SNAPSHOT_PATH = 'reg.snapshot'
+
+# magic, byte order, row count, checksum of the database, checksum of
+# the columns
+_HEADER = struct.Struct('<8sB3xI32s32s')
+_MAGIC = b'REGSNAP1'
+
+_COLUMNS = 9
+_FOLDED_COLUMNS = range(5, 9)
+
+#-----------------------------------------------------------------------
+
+def database_checksum(database_path=DATABASE_PATH):
+    """
+    Returns the SHA-256 digest of the contents of a database file.
+
+    Keyword arguments:
+    database_path -- the path of the registrar database
+    """
+    digest = hashlib.sha256()
+    with open(database_path, 'rb') as database_file:
+        for block in iter(lambda: database_file.read(1 << 16), b''):
+            digest.update(block)
+    return digest.digest()
+
+#-----------------------------------------------------------------------
+
+def build_snapshot(snapshot_path=SNAPSHOT_PATH,
+    database_path=DATABASE_PATH):
+    """
+    Reads the class overviews from a database file and writes them
+    to a snapshot image. The image replaces any older one at once,
+    so processes that still map the older one keep reading it
+    unchanged. Returns the number of rows of the image.
+
+    Keyword arguments:
+    snapshot_path -- the path of the image to write
+    database_path -- the path of the registrar database
+    """
+    checksum = database_checksum(database_path)
+    columns = read_overviews(create_database_url(database_path))
+    columns = list(columns) + [[fold_case(value) for value in column]\
+        for column in columns[1:]]
+
+    body = bytearray()
+    for column in columns:
+        values = [value.encode('utf-8') + b'\0' for value in column]
+        if any(b'\0' in value[:-1] for value in values):
+            raise ValueError("database values must not contain NUL")
+
+        offsets = array('I', [0])
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+
+        body += offsets.tobytes()
+        body += b''.join(values)
+        body += b'\0' * (-len(body) % 4)
+
+    header = _HEADER.pack(_MAGIC, sys.byteorder == 'big',
+        len(columns[0]), checksum, hashlib.sha256(body).digest())
+
+    temporary_path = snapshot_path + '.' + str(os.getpid())
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(header)
+        snapshot_file.write(body)
+    os.replace(temporary_path, snapshot_path)
+
+    return len(columns[0])
+
+#-----------------------------------------------------------------------
+
+def is_snapshot_current(snapshot_path=SNAPSHOT_PATH,
+    database_path=DATABASE_PATH):
+    """
+    Returns whether a snapshot image exists and was built from the
+    current contents of a database file (without checking the
+    columns).
+
+    Keyword arguments:
+    snapshot_path -- the path of the image
+    database_path -- the path of the registrar database
+    """
+    try:
+        with open(snapshot_path, 'rb') as snapshot_file:
+            header = snapshot_file.read(_HEADER.size)
+    except FileNotFoundError:
+        return False
+
+    if len(header) < _HEADER.size:
+        return False
+
+    magic, _, _, checksum, _ = _HEADER.unpack(header)
+    return magic == _MAGIC\
+        and checksum == database_checksum(database_path)
+
+#-----------------------------------------------------------------------
+
+class Snapshot:
+    """
+    A snapshot image mapped into memory, searched like a Catalog:
+    search returns exactly what Catalog.search returns. Opening an
+    image raises ValueError if it is stale, damaged or was built on
+    a machine of another byte order.
+
+    Every search field is a plain substring search (see
+    database.create_like_pattern), and UTF-8 is self-synchronizing,
+    so a field matches a row if the bytes of its folded text occur
+    in the folded column between the start of the row and its NUL.
+    The column is searched with mmap.find, which does not copy it.
+    The RegClass of a row is only decoded the first time a search
+    returns it, and then kept by the worker.
+    """
+
+    def __init__(self, snapshot_path=SNAPSHOT_PATH,
+        database_path=DATABASE_PATH):
+        with open(snapshot_path, 'rb') as snapshot_file:
+            self._map = mmap.mmap(snapshot_file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+
+        try:
+            self._columns = self._read_columns(database_path)
+        except (ValueError, struct.error):
+            self._map.close()
+            raise
+
+        self._classes = [None] * len(self)
+
+    def __len__(self):
+        return len(self._columns[0][1]) - 1
+
+    def close(self):
+        """
+        Unmaps the image. The Snapshot must not be used afterwards.
+        """
+        for _, offsets, _ in self._columns:
+            offsets.release()
+        self._columns = []
+        self._map.close()
+
+    def search(self, search):
+        """
+        Returns the classes that match search as a list of RegClass
+        objects, in the order of get_classes_with_condition.
+
+        Keyword arguments:
+        search -- a Search object that contains all relevant search
+        fields (e.g. area)
+        """
+        rows = None
+
+        for position, text in zip(_FOLDED_COLUMNS, (search.get_dept(),
+            search.get_number(), search.get_area(),
+            search.get_title())):
+
+            # no filter, or a filter that matches every row
+            if not text:
+                continue
+
+            matches = self._find_rows(position,
+                fold_case(text).encode('utf-8'))
+            rows = matches if rows is None else rows & matches
+            if not rows:
+                return []
+
+        if rows is None:
+            rows = range(len(self))
+        else:
+            rows = sorted(rows)
+
+        classes = self._classes
+        return [classes[row] or self._get_class(row) for row in rows]
+
+    def _read_columns(self, database_path):
+        # Checks the header and returns a (start of the values,
+        # memoryview of the offsets, end of the values) tuple for
+        # each column.
+        magic, big_endian, rows, checksum, body_checksum =\
+            _HEADER.unpack_from(self._map)
+
+        if magic != _MAGIC:
+            raise ValueError("not a snapshot image")
+        if big_endian != (sys.byteorder == 'big'):
+            raise ValueError("snapshot image of another byte order")
+        if checksum != database_checksum(database_path):
+            raise ValueError("stale snapshot image")
+        if hashlib.sha256(memoryview(self._map)[_HEADER.size:])\
+            .digest() != body_checksum:
+            raise ValueError("damaged snapshot image")
+
+        columns = []
+        start = _HEADER.size
+        for _ in range(_COLUMNS):
+            end = start + (rows + 1) * 4
+            offsets = memoryview(self._map)[start:end].cast('I')
+            columns.append((end, offsets, end + offsets[rows]))
+            start = end + offsets[rows] + (-offsets[rows] % 4)
+
+        return columns
+
+    def _find_rows(self, position, text):
+        # Returns the set of rows of the column at position whose
+        # value contains text.
+        if b'\0' in text:
+            return set()
+
+        start, offsets, end = self._columns[position]
+        rows = set()
+
+        found = self._map.find(text, start, end)
+        while found >= 0:
+            row = bisect_right(offsets, found - start) - 1
+            rows.add(row)
+            # the next match must be in a later row
+            found = self._map.find(text, start + offsets[row + 1], end)
+
+        return rows
+
+    def _get_class(self, row):
+        fields = []
+        for start, offsets, _ in self._columns[:5]:
+            fields.append(self._map[start + offsets[row]:\
+                start + offsets[row + 1] - 1].decode('utf-8'))
+        regclass = RegClass(fields)
+        self._classes[row] = regclass
+        return regclass
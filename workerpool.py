@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------
+# workerpool.py
+# Authors: Jennifer Secrest and AnneMarie Caballero
+#-----------------------------------------------------------------------
+
+"""
+Module on the server side. Maintains a pool of long-lived worker
+processes that are forked once at startup, so that no process has
+to be created for each client request. Workers that crash are
+respawned, and on shutdown the workers are drained: each one
+finishes the connection it is handling before it exits.
+
+The parent process accepts the connections and holds them while
+they are idle. As soon as a client sends something, the parent
+hands its connection to a free worker (passing the socket itself
+through a pipe), and the worker hands it back once it has answered
+the requests the client sent, so that a persistent connection only
+holds a worker while it has requests, and a few idle clients cannot
+keep the others from being served. A connection that waits longer
+than max_wait seconds for a free worker is handed to a busy handler
+in the parent instead, which answers the client that the server is
+busy.
+"""
+
+import os
+import signal
+from sys import stderr
+from time import monotonic, sleep
+from socket import socket
+from collections import deque
+from multiprocessing import Process, Event, Pipe, get_start_method
+from multiprocessing.connection import wait
+from multiprocessing.reduction import send_handle, recv_handle
+
+#-----------------------------------------------------------------------
+
+# How often (in seconds) an idle worker checks whether the pool is
+# shutting down, and how often the parent checks on its workers.
+ACCEPT_POLL_INTERVAL = 0.5
+SUPERVISE_INTERVAL = 1.0
+
+# Workers that die sooner than this after being spawned are respawned
+# only after RESPAWN_DELAY seconds, so that a worker that can never
+# start (e.g. a broken initializer) does not turn into a fork loop.
+MIN_WORKER_LIFETIME = 1.0
+RESPAWN_DELAY = 1.0
+
+# Seconds to wait for workers to finish their current connection
+# when the pool shuts down before they are terminated.
+DRAIN_TIMEOUT = 10.0
+
+# The default number of seconds a connection with requests waits for
+# a free worker before the busy handler answers it, and that an idle
+# connection is kept open.
+MAX_WAIT = 1.0
+IDLE_TIMEOUT = 5.0
+
+#-----------------------------------------------------------------------
+
+def _worker_main(channel, stopping, handler, handler_args,
+    initializer, initargs, inherited_fds):
+
+    # The parent coordinates shutdown through the stopping event, so
+    # a Ctrl-C in the terminal must not kill a worker mid-request.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # A respawned worker is forked while the parent holds client
+    # connections; its copies would keep them open after the parent
+    # closes them.
+    for fd in inherited_fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    print('Started worker process ' + str(os.getpid()))
+
+    while not stopping.is_set():
+        # waiting has to give up now and then to notice a shutdown
+        try:
+            if not channel.poll(ACCEPT_POLL_INTERVAL):
+                continue
+            state, address = channel.recv()
+            sock = socket(fileno=recv_handle(channel))
+        except (EOFError, OSError, RuntimeError):
+            # the parent has gone away
+            break
+
+        with sock:
+            sock.settimeout(None)
+            if state is None:
+                print('Accepted connection, opened socket for '\
+                    + str(address))
+
+            try:
+                state = handler(sock, state, *handler_args)
+            except Exception as ex:
+                # one bad connection must not take the worker down
+                print(ex, file=stderr)
+                state = None
+
+            if stopping.is_set():
+                state = None
+
+            # the parent keeps a connection that is handed back
+            channel.send(state)
+            if state is not None:
+                send_handle(channel, sock.fileno(), os.getppid())
+
+    print('Exiting worker process ' + str(os.getpid()))
+
+#-----------------------------------------------------------------------
+
+class WorkerPool:
+    """
+    A fixed-size pool of pre-forked worker processes that serve the
+    connections accepted from a listening socket. A connection that
+    has something to read is passed to handler(sock, state,
+    *handler_args) in a free worker, which returns a picklable state
+    to hand the idle connection back to the pool (the state it gets
+    the next time; None the first time), or None to close it. If no
+    worker is free within max_wait seconds, the connection is passed
+    to busy_handler(sock, state, *busy_args) in the parent instead,
+    which returns the same. Idle connections are closed after
+    idle_timeout seconds. If an initializer is given, every worker
+    calls initializer(*initargs) once before it handles any
+    connections, which is where per-worker state should be set up.
+    """
+
+    def __init__(self, server_sock, size, handler, handler_args=(),
+        initializer=None, initargs=(), busy_handler=None, busy_args=(),
+        max_wait=MAX_WAIT, idle_timeout=IDLE_TIMEOUT):
+        if size < 1:
+            raise ValueError("a worker pool needs at least one worker")
+
+        self._server_sock = server_sock
+        self._size = size
+        self._handler = handler
+        self._handler_args = tuple(handler_args)
+        self._initializer = initializer
+        self._initargs = tuple(initargs)
+        self._busy_handler = busy_handler
+        self._busy_args = tuple(busy_args)
+        self._max_wait = max_wait
+        self._idle_timeout = idle_timeout
+        self._stopping = Event()
+
+        self._workers = []
+        self._spawn_times = []
+        self._channels = []
+
+        # the address of the connection each worker is handling, or
+        # None if it is free
+        self._assigned = []
+
+        # socket -> (state, address, time since which it is idle)
+        self._idle = {}
+
+        # (socket, state, address, time since which it has waited)
+        # tuples of the connections with requests, oldest first
+        self._ready = deque()
+
+    def start(self):
+        """
+        Forks all of the worker processes of the pool.
+        """
+        for _ in range(self._size):
+            worker, channel = self._spawn()
+            self._workers.append(worker)
+            self._spawn_times.append(monotonic())
+            self._channels.append(channel)
+            self._assigned.append(None)
+
+    def stop(self):
+        """
+        Asks the pool to shut down. Safe to call from a signal
+        handler; supervise() returns shortly afterwards.
+        """
+        self._stopping.set()
+
+    def supervise(self):
+        """
+        Blocks until stop() is called, accepting connections, handing
+        them to the workers and respawning every worker that exits
+        while the pool is running.
+        """
+        while not self._stopping.is_set():
+            self._dispatch()
+
+            sentinels = {worker.sentinel: index\
+                for index, worker in enumerate(self._workers)}
+            channels = {self._channels[index]: index\
+                for index, address in enumerate(self._assigned)\
+                if address is not None}
+            waiting = [self._server_sock] + list(sentinels)\
+                + list(channels) + list(self._idle)
+
+            for ready in wait(waiting, self._get_timeout()):
+                if self._stopping.is_set():
+                    break
+
+                if ready is self._server_sock:
+                    self._accept()
+                elif ready in sentinels:
+                    self._respawn(sentinels[ready])
+                elif ready in channels:
+                    self._take_back(channels[ready], ready)
+                elif ready in self._idle:
+                    state, address, _ = self._idle.pop(ready)
+                    self._ready.append((ready, state, address,
+                        monotonic()))
+
+            self._expire()
+
+    def shutdown(self, timeout=DRAIN_TIMEOUT):
+        """
+        Stops the pool and waits up to timeout seconds for the workers
+        to finish the connections they are handling. Workers still
+        running after that are terminated. The connections the pool
+        holds are closed.
+        """
+        self.stop()
+
+        for sock in list(self._idle)\
+            + [entry[0] for entry in self._ready]:
+            sock.close()
+        self._idle.clear()
+        self._ready.clear()
+
+        deadline = monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - monotonic()))
+
+        for worker in self._workers:
+            if worker.is_alive():
+                print('Terminating worker process ' + str(worker.pid),
+                    file=stderr)
+                worker.terminate()
+                worker.join()
+
+        for channel in self._channels:
+            channel.close()
+
+        self._workers = []
+        self._spawn_times = []
+        self._channels = []
+        self._assigned = []
+
+    def _spawn(self):
+        channel, worker_channel = Pipe()
+
+        inherited_fds = []
+        if get_start_method() == 'fork':
+            inherited_fds = [sock.fileno() for sock in self._idle]\
+                + [entry[0].fileno() for entry in self._ready]
+
+        worker = Process(target=_worker_main,
+            args=[worker_channel, self._stopping, self._handler,
+                self._handler_args, self._initializer, self._initargs,
+                inherited_fds])
+        worker.start()
+        worker_channel.close()
+        return (worker, channel)
+
+    def _respawn(self, index):
+        worker = self._workers[index]
+        worker.join()
+
+        print('Worker process ' + str(worker.pid)\
+            + ' exited with code ' + str(worker.exitcode)\
+            + ', respawning', file=stderr)
+
+        # the connection it was handling died with it
+        self._channels[index].close()
+        self._assigned[index] = None
+
+        if monotonic() - self._spawn_times[index]\
+            < MIN_WORKER_LIFETIME:
+            sleep(RESPAWN_DELAY)
+
+        self._workers[index], self._channels[index] = self._spawn()
+        self._spawn_times[index] = monotonic()
+
+    def _accept(self):
+        try:
+            sock, address = self._server_sock.accept()
+        except OSError as ex:
+            # e.g. the client reset the connection, or the process
+            # is out of file descriptors
+            print(ex, file=stderr)
+            return
+
+        # handed to a worker once the client sends its request
+        self._idle[sock] = (None, address, monotonic())
+
+    def _dispatch(self):
+        # Hands the connections with requests to free workers, the
+        # connection that has waited longest first.
+        for index, address in enumerate(self._assigned):
+            if not self._ready:
+                break
+            if address is not None:
+                continue
+
+            sock, state, address, _ = self._ready.popleft()
+            channel = self._channels[index]
+            try:
+                channel.send((state, address))
+                send_handle(channel, sock.fileno(),
+                    self._workers[index].pid)
+                self._assigned[index] = address
+            except OSError as ex:
+                # the worker has died; it is respawned shortly
+                print(ex, file=stderr)
+            finally:
+                sock.close()
+
+    def _take_back(self, index, channel):
+        # Receives the connection a worker has finished handling, if
+        # it hands it back.
+        if channel is not self._channels[index]:
+            # the worker has died and been respawned meanwhile
+            return
+
+        address = self._assigned[index]
+        self._assigned[index] = None
+
+        try:
+            state = channel.recv()
+            if state is not None:
+                sock = socket(fileno=recv_handle(channel))
+                self._idle[sock] = (state, address, monotonic())
+        except (EOFError, OSError, RuntimeError) as ex:
+            # the worker has died; it is respawned shortly
+            print(ex, file=stderr)
+
+    def _get_timeout(self):
+        # Returns how long supervise may wait before a connection has
+        # waited or idled too long.
+        deadlines = [SUPERVISE_INTERVAL]
+        if self._ready and self._busy_handler is not None:
+            deadlines.append(self._ready[0][3] + self._max_wait\
+                - monotonic())
+        if self._idle:
+            deadlines.append(min(since for _, _, since\
+                in self._idle.values()) + self._idle_timeout\
+                - monotonic())
+        return max(0.0, min(deadlines))
+
+    def _expire(self):
+        # Closes the connections that have idled too long, and
+        # answers those that have waited too long for a worker with
+        # the busy handler.
+        now = monotonic()
+
+        for sock, (_, _, since) in list(self._idle.items()):
+            if now - since >= self._idle_timeout:
+                print('Closing idle connection')
+                del self._idle[sock]
+                sock.close()
+
+        if self._busy_handler is None:
+            return
+
+        while self._ready and now - self._ready[0][3] >= self._max_wait:
+            sock, state, address, _ = self._ready.popleft()
+            state = self._busy_handler(sock, state, *self._busy_args)
+            if state is None:
+                sock.close()
+            else:
+                self._idle[sock] = (state, address, monotonic())